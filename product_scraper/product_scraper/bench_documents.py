@@ -0,0 +1,114 @@
+"""
+bench_documents.py
+
+Benchmark for building LangChain Documents from the products DB: the
+row-by-row path (product_to_document per ORM object) versus the columnar
+batch path (documents_from_rows, requires pandas).
+
+Usage (from this directory, like create_documents.py):
+
+  python bench_documents.py --db bench_products.db --rows 500000
+
+The DB is filled with synthetic products if it has fewer than --rows rows.
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+
+from models import get_session
+from create_documents import iter_documents, pd
+
+WORDS = ("bok", "roman", "krim", "barn", "kokebok", "innbundet", "pocket", "lydbok",
+         "norsk", "engelsk", "serie", "samling", "historie", "natur", "reise")
+
+
+def synthetic_row(i, rng):
+    name = " ".join(rng.choice(WORDS) for _ in range(4)).capitalize()
+    extras = {
+        "format": rng.choice(("Innbundet", "Heftet", "Pocket", ": Lydbok")),
+        "publisher": rng.choice(("Cappelen Damm", "Gyldendal", "Aschehoug")),
+        "language": ": Bokmål",
+        "pages": str(rng.randint(40, 900)),
+        "isbn": f"978{rng.randint(10**9, 10**10 - 1)}",
+        "author": rng.choice(("Jo Nesbø", "Anne Holt", None)),
+    }
+    if i % 10 == 0:
+        extras["price"] = f"{rng.randint(49, 999)},-"
+    return (
+        "Bench", f"https://shop.example/p/{i}", name, f"{rng.randint(49, 999)},-",
+        rng.choice(("Brand A", "Brand B", None)),
+        " ".join(rng.choice(WORDS) for _ in range(60)),
+        json.dumps(extras, ensure_ascii=False),
+    )
+
+
+def fill_db(path, rows):
+    """
+    Creates the schema through models, then bulk-inserts synthetic rows.
+    """
+    get_session(f"sqlite:///{path}").close()
+    conn = sqlite3.connect(path)
+    existing = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    if existing >= rows:
+        conn.close()
+        return existing
+
+    rng = random.Random(42)
+    print(f"Adding {rows - existing} synthetic products to {path} ...")
+    for start in range(existing, rows, 10000):
+        batch = [synthetic_row(i, rng) for i in range(start, min(start + 10000, rows))]
+        conn.executemany(
+            "INSERT INTO products (shop, url, product_name, price, brand, description, extras)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+        conn.commit()
+    conn.close()
+    return rows
+
+
+def bench(label, db_path, batch_size, columnar):
+    started = time.perf_counter()
+    documents = 0
+    for batch in iter_documents(db_path, batch_size=batch_size, columnar=columnar):
+        documents += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12} {documents} documents in {elapsed:6.1f}s  {documents / elapsed:9.0f} docs/s")
+    return elapsed
+
+
+def check_same_output(db_path, batch_size):
+    rows = next(iter_documents(db_path, batch_size=batch_size, columnar=False))
+    columns = next(iter_documents(db_path, batch_size=batch_size, columnar=True))
+    for row_doc, column_doc in zip(rows, columns):
+        if (row_doc.page_content != column_doc.page_content
+                or row_doc.metadata != column_doc.metadata):
+            print(f"WARNING: paths disagree on {row_doc.metadata.get('url')}")
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document building from the products DB.")
+    parser.add_argument("--db", default="bench_products.db", help="SQLite file (created if missing).")
+    parser.add_argument("--rows", type=int, default=500_000, help="Number of synthetic products.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = fill_db(args.db, args.rows)
+    print(f"{rows} products, {os.path.getsize(args.db) / 1e6:.0f} MB, batch size {args.batch_size}")
+
+    row_path = bench("row", args.db, args.batch_size, columnar=False)
+    if pd is None:
+        print("pandas is not installed; skipping the columnar path")
+        return
+    check_same_output(args.db, args.batch_size)
+    columnar = bench("columnar", args.db, args.batch_size, columnar=True)
+    print(f"speedup: {row_path / columnar:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+bench_extraction.py
+
+Micro-benchmark for product page extraction: the per-field
+UniversalSpider.extract_field path versus the precompiled ExtractionPlan.
+
+Usage (from the directory containing the product_scraper package):
+
+  python -m product_scraper.bench_extraction product_scraper/configs/ark_shop_config.yml
+  python -m product_scraper.bench_extraction CONFIG --html saved_page.html --pages 2000
+
+Without --html, a synthetic page with a <dl> of product details is used.
+"""
+
+import time
+import argparse
+
+from scrapy.http import HtmlResponse
+
+from product_scraper.spiders.universal_spider import UniversalSpider
+
+SYNTHETIC_DETAILS = [
+    ("Format", "Innbundet"), ("Utgivelsesår", "2024"), ("Forlag", "Cappelen Damm"),
+    ("Språk", "Bokmål"), ("Antall sider", "412"), ("Høyde", "24 cm"),
+    ("Bredde", "16 cm"), ("Lengde", "3 cm"), ("Vekt", "640 g"),
+    ("Serie", "Serien"), ("ISBN", "9788202000000"),
+]
+
+
+def synthetic_page():
+    details = "".join(f"<dt>{label}</dt><dd>{value}</dd>" for label, value in SYNTHETIC_DETAILS)
+    filler = "".join(f"<div class='card'><a href='/p/{i}'>Product {i}</a><span>{i},-</span></div>"
+                     for i in range(300))
+    return (
+        "<html><head><title>Product</title></head><body><div id='innhold'>"
+        "<h1 class='font-display font-semibold'>A product</h1>"
+        "<div class='font-semibold text-[2.375rem] leading-none'>499,-</div>"
+        f"<div id='acc-product-details'><dl><dd class='font-display font-semibold'>Brand</dd>{details}</dl></div>"
+        f"<section>{filler}</section></div></body></html>"
+    ).encode("utf-8")
+
+
+def legacy_extract(spider, response):
+    selectors = spider.config.get("selectors", {})
+    extras_selectors = spider.config.get("extras", {})
+    values = {name: spider.extract_field(response, selectors.get(name))
+              for name in ("product_name", "price", "brand", "description")}
+    values["extras"] = {}
+    for field_name, field_config in extras_selectors.items():
+        val = spider.extract_field(response, field_config)
+        if val:
+            values["extras"][field_name] = val
+    return values
+
+
+def bench(label, pages, func):
+    started = time.perf_counter()
+    for _ in range(pages):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {elapsed / pages * 1e6:9.1f} us/page")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-page extraction cost.")
+    parser.add_argument("config_file", help="Shop YAML config.")
+    parser.add_argument("--html", help="Saved product page to use instead of the synthetic one.")
+    parser.add_argument("--pages", type=int, default=1000, help="Number of pages per measurement.")
+    args = parser.parse_args()
+
+    spider = UniversalSpider(config_file=args.config_file)
+    if args.html:
+        with open(args.html, "rb") as f:
+            body = f.read()
+    else:
+        body = synthetic_page()
+
+    def response():
+        return HtmlResponse(url="https://example.com/product", body=body, encoding="utf-8")
+
+    parsed = response()
+    parsed.selector  # parse once for the extraction-only measurements
+    if legacy_extract(spider, parsed) != spider.plan.extract(parsed.selector.root):
+        print("WARNING: legacy and compiled extraction disagree on this page")
+
+    print(f"{len(spider.plan.fields)} standard fields, {len(spider.plan.extras)} extras, "
+          f"{len(body)} byte page, {args.pages} pages")
+    legacy = bench("extract_field, parse + extract", args.pages,
+                   lambda: legacy_extract(spider, response()))
+    compiled = bench("ExtractionPlan, parse + extract", args.pages,
+                     lambda: spider.plan.extract(response().selector.root))
+    legacy_only = bench("extract_field, extract only", args.pages,
+                        lambda: legacy_extract(spider, parsed))
+    compiled_only = bench("ExtractionPlan, extract only", args.pages,
+                          lambda: spider.plan.extract(parsed.selector.root))
+    print(f"speedup: {legacy / compiled:.2f}x per page, {legacy_only / compiled_only:.2f}x extraction only")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# checkpoint.py
+"""
+Crawl checkpoints, so an interrupted sitemap crawl can resume instead of
+starting over.
+
+A checkpoint is one SQLite file per shop under CHECKPOINT_DIR:
+
+    shards     every sitemap (shard) seen: its parent sitemap, a cursor (the
+               number of entries already turned into requests), and once it
+               is done, its boundaries (first / last <loc>, entry count)
+    frontier   product URLs that were requested but not completed yet
+    completed  product URLs that are done: their item was committed to the
+               products DB or the server answered 304
+    failed     product URLs whose fetch failed, with the number of attempts;
+               a resumed run requests them again until CHECKPOINT_MAX_ATTEMPTS
+
+Changes are kept in memory and written every CHECKPOINT_INTERVAL seconds,
+in one transaction so the cursors always match the frontier. A resumed run
+re-requests the frontier, re-reads the unfinished sitemaps from their cursor
+and skips completed URLs, so nothing is fetched or written twice beyond the
+last interval. If a sitemap changed in between (the entry before its cursor
+is no longer the recorded last <loc>), it is read from the start instead and
+only the completed and frontier URLs are skipped. The checkpoint is deleted
+when a crawl finishes cleanly.
+
+Items only count as completed once SQLitePipeline has committed them
+(pipelines.items_committed); without that pipeline they stay in the frontier.
+"""
+
+import os
+import time
+import sqlite3
+
+from product_scraper.models import chunked, utcnow
+
+
+def open_checkpoint_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS shards ("
+        " url TEXT PRIMARY KEY,"
+        " parent TEXT,"
+        " status TEXT NOT NULL,"  # "pending" or "done"
+        " cursor INTEGER NOT NULL,"
+        " first_loc TEXT,"
+        " last_loc TEXT,"
+        " entries INTEGER,"
+        " updated_at TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS frontier ("
+        " url TEXT PRIMARY KEY,"
+        " lastmod TEXT,"
+        " shard TEXT)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS failed ("
+        " url TEXT PRIMARY KEY,"
+        " lastmod TEXT,"
+        " shard TEXT,"
+        " attempts INTEGER NOT NULL,"
+        " failed_at TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS completed ("
+        " url TEXT PRIMARY KEY,"
+        " shard TEXT,"
+        " completed_at TEXT NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+
+class CrawlCheckpoint:
+    """
+    Sitemap cursors, frontier and completed URLs of one shop's crawl, loaded
+    into memory and written back at intervals.
+    """
+
+    def __init__(self, path, interval=30.0, resume=True, max_attempts=3):
+        self.path = path
+        self.interval = interval
+        self.max_attempts = max_attempts
+        if not resume:
+            self.delete_files()
+        self.conn = open_checkpoint_db(path)
+
+        # url -> [parent, status, cursor, first_loc, last_loc, entries]
+        self.shards = {}
+        for url, parent, status, cursor, first_loc, last_loc, entries in self.conn.execute(
+                "SELECT url, parent, status, cursor, first_loc, last_loc, entries FROM shards"):
+            self.shards[url] = [parent, status, cursor, first_loc, last_loc, entries]
+        # url -> (lastmod, shard)
+        self.frontier = {url: (lastmod, shard) for url, lastmod, shard
+                         in self.conn.execute("SELECT url, lastmod, shard FROM frontier")}
+        self.completed = {url for (url,) in self.conn.execute("SELECT url FROM completed")}
+        # url -> (lastmod, shard, attempts)
+        self.failed = {url: (lastmod, shard, attempts) for url, lastmod, shard, attempts
+                       in self.conn.execute("SELECT url, lastmod, shard, attempts FROM failed")}
+        self.resumed = bool(self.shards)
+
+        # Item URL -> product URL (sitemap <loc>), for items not committed yet
+        self.awaiting_commit = {}
+
+        self.dirty_shards = set()
+        self.new_frontier = {}
+        self.new_completed = {}
+        self.new_failed = {}
+        self.last_flush = time.monotonic()
+
+    # ---------------------------------------------------------------------
+    # Shards
+    # ---------------------------------------------------------------------
+
+    def add_shard(self, url, parent=None):
+        if url not in self.shards:
+            self.shards[url] = [parent, "pending", 0, None, None, None]
+            self.dirty_shards.add(url)
+
+    def has_shard(self, url):
+        return url in self.shards
+
+    def cursor(self, url):
+        shard = self.shards.get(url)
+        return shard[2] if shard else 0
+
+    def last_loc(self, url):
+        """
+        The <loc> of the last handled entry of a shard, i.e. the one before its cursor.
+        """
+        shard = self.shards.get(url)
+        return shard[4] if shard else None
+
+    def pending_shards(self):
+        return [url for url, shard in self.shards.items() if shard[1] == "pending"]
+
+    def advance(self, url, cursor, loc):
+        """
+        Records that the first 'cursor' entries of a shard were handled,
+        the last one being 'loc'.
+        """
+        self.add_shard(url)
+        shard = self.shards[url]
+        shard[2] = cursor
+        if shard[3] is None:
+            shard[3] = loc
+        shard[4] = loc
+        self.dirty_shards.add(url)
+        self.maybe_flush()
+
+    def finish_shard(self, url):
+        self.add_shard(url)
+        shard = self.shards[url]
+        shard[1] = "done"
+        shard[5] = shard[2]
+        self.dirty_shards.add(url)
+        self.maybe_flush()
+
+    # ---------------------------------------------------------------------
+    # Product URLs
+    # ---------------------------------------------------------------------
+
+    def is_known(self, url):
+        """
+        True if the URL is completed, failed or already in the frontier.
+        """
+        return url in self.completed or url in self.frontier or url in self.failed
+
+    def pending_requests(self):
+        """
+        (url, lastmod, shard) of every URL in the frontier.
+        """
+        return [(url, lastmod, shard) for url, (lastmod, shard) in self.frontier.items()]
+
+    def retry_requests(self):
+        """
+        (url, lastmod, shard) of every failed URL with attempts left.
+        """
+        return [(url, lastmod, shard) for url, (lastmod, shard, attempts) in self.failed.items()
+                if attempts < self.max_attempts and url not in self.frontier]
+
+    def add_request(self, url, lastmod=None, shard=None):
+        if url not in self.frontier:
+            self.frontier[url] = (lastmod, shard)
+            self.new_frontier[url] = (lastmod, shard)
+
+    def mark_completed(self, url):
+        if url in self.completed:
+            return
+        _, shard = self.frontier.pop(url, (None, None))
+        self.new_frontier.pop(url, None)
+        if url in self.failed:
+            shard = self.failed.pop(url)[1]
+            self.new_failed.pop(url, None)
+        self.completed.add(url)
+        self.new_completed[url] = shard
+        self.maybe_flush()
+
+    def mark_failed(self, url):
+        """
+        Moves a URL from the frontier to the failed URLs, counting the attempt.
+        """
+        if url in self.completed:
+            return
+        lastmod, shard, attempts = self.failed.get(url, (None, None, 0))
+        if url in self.frontier:
+            lastmod, shard = self.frontier.pop(url)
+            self.new_frontier.pop(url, None)
+        self.failed[url] = self.new_failed[url] = (lastmod, shard, attempts + 1)
+        self.maybe_flush()
+
+    def await_commit(self, url, item_url):
+        """
+        'url' is completed once the item for 'item_url' is committed.
+        """
+        self.awaiting_commit[item_url] = url
+
+    def items_committed(self, urls):
+        for item_url in urls:
+            url = self.awaiting_commit.pop(item_url, None)
+            if url is not None:
+                self.mark_completed(url)
+
+    # ---------------------------------------------------------------------
+    # Persistence
+    # ---------------------------------------------------------------------
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        now = utcnow().isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO shards"
+                " (url, parent, status, cursor, first_loc, last_loc, entries, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(url, *self.shards[url], now) for url in self.dirty_shards],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO frontier (url, lastmod, shard) VALUES (?, ?, ?)",
+                [(url, lastmod, shard) for url, (lastmod, shard) in self.new_frontier.items()],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO completed (url, shard, completed_at) VALUES (?, ?, ?)",
+                [(url, shard, now) for url, shard in self.new_completed.items()],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO failed (url, lastmod, shard, attempts, failed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(url, *failure, now) for url, failure in self.new_failed.items()],
+            )
+            for chunk in chunked(list(self.new_completed) + list(self.new_failed)):
+                self.conn.execute(
+                    f"DELETE FROM frontier WHERE url IN ({','.join('?' * len(chunk))})", chunk
+                )
+            for chunk in chunked(list(self.new_completed)):
+                self.conn.execute(
+                    f"DELETE FROM failed WHERE url IN ({','.join('?' * len(chunk))})", chunk
+                )
+        self.dirty_shards = set()
+        self.new_frontier = {}
+        self.new_completed = {}
+        self.new_failed = {}
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def clear(self):
+        """
+        Deletes the checkpoint, e.g. after a crawl finished cleanly.
+        """
+        self.conn.close()
+        self.delete_files()
+
+    def delete_files(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
@@ -1,12 +1,15 @@
 import os
 import re
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
 # Adjust this import to match your actual package/module structure.
 # For example, if models.py is at the same level:
-from models import Product, Base
+from sqlalchemy import and_, or_
+from models import Product, Base, get_session
+
+try:
+    import pandas as pd
+except ImportError:  # optional, enables the columnar path in iter_documents
+    pd = None
 
 ###################################
 # Optional numeric field handling #
@@ -14,12 +17,20 @@ from models import Product, Base
 
 NUMERIC_FIELDS = {"price"}
 
+# Compiled once; these run for every metadata value of every document
+NON_NUMERIC_RE = re.compile(r"[^0-9,\.]")
+LEADING_COLON_RE = re.compile(r"^\s*:\s*")
+# Every character matched by \s in a str pattern (i.e. str.isspace())
+WHITESPACE = ("\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680"
+              "\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
+              "\u2028\u2029\u202f\u205f\u3000")
+
 def parse_numeric(value: str):
     """
     Given a string like '2400,-' or '1,899.95' or '6',
     return a float. If parsing fails, return None.
     """
-    cleaned = re.sub(r"[^0-9,\.]", "", value)
+    cleaned = NON_NUMERIC_RE.sub("", value)
     # If there's a comma but no period, treat comma as decimal
     if "," in cleaned and "." not in cleaned:
         cleaned = cleaned.replace(",", ".")
@@ -39,42 +50,45 @@ def sanitize_metadata(metadata: dict) -> dict:
     for key, value in metadata.items():
         if value is None:
             continue
+        cleaned[key] = sanitize_value(key, value)
+    return cleaned
 
-        # 1) If it's a string, remove leading colons like ": something"
+def sanitize_value(key, value):
+    """
+    Sanitizes a single non-None metadata value, see sanitize_metadata.
+    """
+    # 1) If it's a string, remove leading colons like ": something"
+    if isinstance(value, str):
+        # This regex removes any colon (and optional whitespace) at the start of the string
+        # e.g. ": Lightweight PU sole" -> "Lightweight PU sole"
+        value = LEADING_COLON_RE.sub("", value)
+
+    # 2) Special handling for known numeric fields
+    if key in NUMERIC_FIELDS:
         if isinstance(value, str):
-            # This regex removes any colon (and optional whitespace) at the start of the string
-            # e.g. ": Lightweight PU sole" -> "Lightweight PU sole"
-            value = re.sub(r"^\s*:\s*", "", value)
-
-        # 2) Special handling for known numeric fields
-        if key in NUMERIC_FIELDS:
-            if isinstance(value, str):
-                numeric_val = parse_numeric(value)
-                if numeric_val is not None:
-                    # If it's specifically "price", convert float -> int
-                    if key == "price":
-                        value = int(numeric_val)
-                    else:
-                        # e.g. weight or dropp can remain float
-                        value = numeric_val
-                # If parse fails, we leave value as-is (the raw string), or choose to skip
-            elif isinstance(value, (int, float)):
-                # If it's already numeric but "price" must be an integer
+            numeric_val = parse_numeric(value)
+            if numeric_val is not None:
+                # If it's specifically "price", convert float -> int
                 if key == "price":
-                    value = int(value)
-
-        # 3) Ensure the final type is acceptable (e.g. str, int, float, bool, list[str])
-        if isinstance(value, (bool, int, float, str)):
-            cleaned[key] = value
-        elif isinstance(value, list):
-            # Convert each element to string
-            str_list = [str(elem) if elem is not None else "N/A" for elem in value]
-            cleaned[key] = str_list
-        else:
-            # fallback: convert to string
-            cleaned[key] = str(value)
+                    value = int(numeric_val)
+                else:
+                    # e.g. weight or dropp can remain float
+                    value = numeric_val
+            # If parse fails, we leave value as-is (the raw string), or choose to skip
+        elif isinstance(value, (int, float)):
+            # If it's already numeric but "price" must be an integer
+            if key == "price":
+                value = int(value)
 
-    return cleaned
+    # 3) Ensure the final type is acceptable (e.g. str, int, float, bool, list[str])
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, list):
+        # Convert each element to string
+        return [str(elem) if elem is not None else "N/A" for elem in value]
+    else:
+        # fallback: convert to string
+        return str(value)
 
 ########################
 # Building the Document
@@ -132,14 +146,164 @@ def build_metadata(product: Product) -> dict:
 # Main entry point
 ########################
 
-def create_documents(db_path=None):
+def product_to_document(product: Product):
     """
-    Connects to the SQLite DB, fetches all Product rows, builds
-    a list of LangChain Document objects.
+    Builds a LangChain Document from a single Product row.
     """
     from langchain_core.documents import Document  # or from langchain.schema import Document
-    # Adjust your import to the actual Document location
-    
+
+    page_content = build_page_content(product)
+    raw_metadata = build_metadata(product)
+    clean_meta = sanitize_metadata(raw_metadata)
+    return Document(page_content=page_content, metadata=clean_meta)
+
+########################
+# Columnar batch path
+########################
+
+# The Product columns documents are built from, in page_content order
+PAGE_CONTENT_FIELDS = (
+    ("product_name", "Product Name: "),
+    ("brand", "Brand: "),
+    ("description", "Description: "),
+    ("price", "Price: "),
+    ("url", "URL: "),
+    ("shop", "Shop: "),
+)
+METADATA_FIELDS = ("shop", "url", "product_name", "description")
+DOCUMENT_COLUMNS = ("id", "shop", "url", "product_name", "brand", "description", "price", "extras")
+
+def build_page_contents(frame, extras):
+    """
+    page_content for a whole batch, same output as build_page_content.
+
+    Every present field becomes "<label><value>" plus a blank-line separator
+    and the parts are concatenated column by column; the trailing separator
+    is cut at the end.
+    """
+    contents = None
+    for column, label in PAGE_CONTENT_FIELDS:
+        values = frame[column].fillna("").astype(str)
+        part = (label + values + "\n\n").where(values != "", "")
+        contents = part if contents is None else contents + part
+
+    sections = ["Extras:" + "".join(f"\n\n  - {k}: {v}" for k, v in row_extras.items()) + "\n\n"
+                if row_extras else "" for row_extras in extras]
+    contents = contents + pd.Series(sections, index=frame.index, dtype=contents.dtype)
+    return contents.str.slice(stop=-2).tolist()
+
+def strip_leading_colons(series):
+    """
+    LEADING_COLON_RE.sub over a string Series. Only values whose first
+    non-whitespace character is a colon can match, so the regex runs on
+    that (usually tiny) subset alone.
+    """
+    leading_colon = series.str.lstrip(WHITESPACE).str.startswith(":").fillna(False).astype(bool)
+    if not leading_colon.any():
+        return series
+    matches = series[leading_colon]
+    fixed = pd.Series([LEADING_COLON_RE.sub("", value) for value in matches],
+                      index=matches.index, dtype=series.dtype)
+    return series.mask(leading_colon, fixed)
+
+def parse_numeric_strings(series):
+    """
+    parse_numeric over a string Series; NaN where parsing fails.
+    """
+    cleaned = series.str.replace(NON_NUMERIC_RE.pattern, "", regex=True)
+    # a comma but no period: the comma is the decimal point
+    comma_decimal = cleaned.str.contains(",", regex=False) & ~cleaned.str.contains(".", regex=False)
+    cleaned = cleaned.where(~comma_decimal, cleaned.str.replace(",", ".", regex=False))
+    return pd.to_numeric(cleaned, errors="coerce").astype("float64")
+
+def sanitize_extras(extras):
+    """
+    Sanitizes the values of a batch of extras dicts in one pass over a flat
+    column of all values. Most values come out unchanged, so each dict is
+    copied as-is and only the values that change are written back. Returns
+    the per-row dicts; dropped values are None.
+    """
+    present = [(i, values) for i, values in enumerate(extras) if values]
+    sanitized = [None] * len(extras)
+    if not present:
+        return sanitized
+
+    flat_keys, flat_values, owners = [], [], []
+    for i, values in present:
+        flat_keys.extend(values)
+        flat_values.extend(values.values())
+        owners.extend([i] * len(values))
+        sanitized[i] = dict(values)
+
+    # Leading colons: one vectorized check over all string values
+    string_positions = [j for j, value in enumerate(flat_values) if isinstance(value, str)]
+    strings = pd.Series([flat_values[j] for j in string_positions], dtype=str)
+    leading_colon = strings.str.lstrip(WHITESPACE).str.startswith(":").to_numpy(dtype=bool)
+
+    changed = {}
+    for k in leading_colon.nonzero()[0]:
+        j = string_positions[k]
+        changed[j] = LEADING_COLON_RE.sub("", flat_values[j])
+
+    numeric = [j for j in string_positions if flat_keys[j] in NUMERIC_FIELDS]
+    if numeric:
+        candidates = pd.Series([changed.get(j, flat_values[j]) for j in numeric], dtype=str)
+        for j, number in zip(numeric, parse_numeric_strings(candidates).tolist()):
+            if number == number:  # not NaN
+                changed[j] = int(number) if flat_keys[j] == "price" else number
+
+    # Non-strings (numbers, lists, ...) take the scalar path
+    if len(string_positions) < len(flat_values):
+        for j, value in enumerate(flat_values):
+            if value is not None and not isinstance(value, str):
+                changed[j] = sanitize_value(flat_keys[j], value)
+
+    for j, value in changed.items():
+        sanitized[owners[j]][flat_keys[j]] = value
+    return sanitized
+
+def build_metadatas(frame, extras):
+    """
+    Sanitized metadata for a whole batch, same output as
+    sanitize_metadata(build_metadata(product)).
+    """
+    base = []
+    for column in METADATA_FIELDS:
+        values = strip_leading_colons(frame[column])
+        base.append(values.astype(object).where(values.notna(), None).tolist())
+
+    metadatas = []
+    for values, row_extras in zip(zip(*base), sanitize_extras(extras)):
+        metadata = dict(zip(METADATA_FIELDS, values))
+        if row_extras:
+            metadata.update(row_extras)
+        if None in metadata.values():
+            metadata = {k: v for k, v in metadata.items() if v is not None}
+        metadatas.append(metadata)
+    return metadatas
+
+def documents_from_rows(rows):
+    """
+    Builds LangChain Documents for a batch of (DOCUMENT_COLUMNS) rows with
+    column-wise string operations instead of one Product at a time.
+    """
+    from langchain_core.documents import Document
+
+    frame = pd.DataFrame.from_records(rows, columns=DOCUMENT_COLUMNS)
+    extras = [value if isinstance(value, dict) else None for value in frame["extras"].tolist()]
+    contents = build_page_contents(frame, extras)
+    metadatas = build_metadatas(frame, extras)
+    return [Document(page_content=content, metadata=metadata)
+            for content, metadata in zip(contents, metadatas)]
+
+def open_session(db_path=None, profile=None):
+    """
+    Opens a session on the products DB, failing early if the file is missing.
+
+    The engine is shared per process and uses the given SQLite profile
+    (WAL by default, see models.SQLITE_PROFILES), so reading while a crawl
+    is writing doesn't block either side.
+    """
     # If no db_path is given, fallback to 'products.db' in current dir
     if not db_path:
         db_path = "products.db"
@@ -150,23 +314,82 @@ def create_documents(db_path=None):
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"Database file not found: {db_path}")
 
-    engine = create_engine(f"sqlite:///{db_path}")
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    # get_session also brings older DBs up to date, once per engine
+    return get_session(f"sqlite:///{db_path}", profile=profile)
+
+def iter_documents(db_path=None, batch_size=1000, changed_since=None, columnar=None,
+                   seen_since=None):
+    """
+    Streams Product rows from the SQLite DB and yields lists of at most
+    'batch_size' LangChain Document objects.
 
-    # Query all rows from the products table
-    products = session.query(Product).all()
+    If 'changed_since' is given, only products whose content changed at or
+    after that timestamp are included. 'seen_since' maps shops to cutoffs
+    (see models.stale_cutoffs): products the crawler hasn't seen since
+    their shop's cutoff are left out. Rows without a 'last_seen' and shops
+    without a cutoff are kept.
 
-    documents = []
-    for product in products:
-        page_content = build_page_content(product)
-        raw_metadata = build_metadata(product)
-        clean_meta = sanitize_metadata(raw_metadata)
+    Rows are fetched with yield_per, so memory use is bounded by one batch
+    regardless of the catalogue size. With 'columnar' (the default when
+    pandas is installed) each batch is fetched as plain column tuples and
+    built with documents_from_rows instead of row by row.
+    """
+    if columnar is None:
+        columnar = pd is not None
+    if columnar and pd is None:
+        raise ImportError("The columnar document path requires pandas")
+
+    session = open_session(db_path)
+    try:
+        if columnar:
+            columns = [getattr(Product, name) for name in DOCUMENT_COLUMNS]
+            query = session.query(*columns)
+        else:
+            query = session.query(Product)
+        if changed_since is not None:
+            query = query.filter(Product.last_changed >= changed_since)
+        if seen_since:
+            query = query.filter(or_(
+                Product.last_seen.is_(None),
+                Product.shop.is_(None),
+                Product.shop.notin_(list(seen_since)),
+                *(and_(Product.shop == shop, Product.last_seen >= cutoff)
+                  for shop, cutoff in seen_since.items()),
+            ))
+        query = query.order_by(Product.id).yield_per(batch_size)
 
-        doc = Document(page_content=page_content, metadata=clean_meta)
-        documents.append(doc)
+        if columnar:
+            rows = []
+            for row in query:
+                rows.append(tuple(row))
+                if len(rows) >= batch_size:
+                    yield documents_from_rows(rows)
+                    rows = []
+            if rows:
+                yield documents_from_rows(rows)
+            return
 
-    session.close()
+        batch = []
+        for product in query:
+            batch.append(product_to_document(product))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        session.close()
+
+def create_documents(db_path=None):
+    """
+    Connects to the SQLite DB, fetches all Product rows, builds
+    a list of LangChain Document objects.
+
+    Holds every document in memory; use iter_documents() for large catalogues.
+    """
+    documents = []
+    for batch in iter_documents(db_path):
+        documents.extend(batch)
     return documents
 
 if __name__ == "__main__":
@@ -0,0 +1,261 @@
+# dupefilter.py
+"""
+Bloom-filter request de-duplication, within a run and across runs.
+
+A DUPEFILTER_CLASS for Scrapy's scheduler. Requests are keyed on their
+method, body and canonical URL: query parameters sorted, the fragment and
+tracking parameters (utm_*, gclid, fbclid, ...) dropped. So the same product
+listed in several sitemaps or categories, or linked with campaign
+parameters, is only scheduled once.
+
+Fingerprints are kept in a Bloom filter instead of a set of hex strings:
+DUPEFILTER_CAPACITY keys at DUPEFILTER_ERROR_RATE false positives take
+about 2.4 bytes per key at 1e-4, i.e. ~5 MB for 2M URLs. A false positive
+drops a request that wasn't a duplicate, so keep the error rate low and the
+capacity above the number of requests per run.
+
+DUPEFILTER_MODE:
+    run        de-duplicate within the run only (like Scrapy's default)
+    cross_run  also drop requests with meta['dupefilter_persist'] that were
+               fetched successfully by an earlier run. These fingerprints
+               live in DUPEFILTER_DIR/<shop>.bloom, which is loaded when the
+               spider opens and saved when it closes. Meant for runs that
+               should only pick up new products; a full re-crawl should run
+               in 'run' mode. With incremental crawling on, the spiders only
+               set the key for URLs the fetch state has never seen, so known
+               products still get their lastmod / fingerprint checks and are
+               fetched again when they change.
+"""
+
+import os
+import math
+import struct
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from scrapy import signals
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.project import data_path
+from scrapy.utils.request import referer_str
+
+logger = logging.getLogger(__name__)
+
+MODES = ("run", "cross_run")
+
+# Request meta flag for the requests that take part in cross-run filtering
+PERSIST_META_KEY = "dupefilter_persist"
+
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "_ga", "_gl"}
+TRACKING_PREFIXES = ("utm_",)
+
+FILE_MAGIC = b"BLOOM1\0\0"
+FILE_HEADER = struct.Struct("<8sQQdQ")  # magic, bits, hashes, error rate, count
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url):
+    """
+    Lower-cased scheme and host, no fragment, no tracking parameters and
+    the remaining query parameters sorted.
+    """
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not is_tracking_param(name))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/",
+                       urlencode(query), ""))
+
+
+def request_key(request):
+    """
+    16-byte fingerprint of a request's method, canonical URL and body.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(request.method.encode("ascii"))
+    digest.update(b" ")
+    digest.update(canonicalize_url(request.url).encode("utf-8"))
+    if request.body:
+        digest.update(b" ")
+        digest.update(request.body)
+    return digest.digest()
+
+
+class BloomFilter:
+    """
+    Bloom filter over 16-byte keys. Bit positions come from the two 64-bit
+    halves of the key (double hashing), so keys are hashed only once.
+    """
+
+    def __init__(self, capacity=2_000_000, error_rate=1e-4, num_bits=None, num_hashes=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        if num_bits is None:
+            num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        # Round up to whole bytes
+        self.num_bits = (num_bits + 7) // 8 * 8
+        self.num_hashes = num_hashes or max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray(self.num_bits // 8)
+        self.count = 0
+
+    def positions(self, key):
+        h1, h2 = struct.unpack("<QQ", key)
+        h2 |= 1  # odd, so positions don't repeat when num_bits is even
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+    def add(self, key):
+        """
+        Adds a key. Returns False if it was (probably) present already.
+        """
+        bits = self.bits
+        added = False
+        for p in self.positions(key):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    @property
+    def size_bytes(self):
+        return len(self.bits)
+
+    def save(self, path):
+        """
+        Writes the filter atomically (temporary file, then rename).
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, self.num_bits, self.num_hashes,
+                                     self.error_rate, self.count))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, num_bits, num_hashes, error_rate, count = FILE_HEADER.unpack(
+                f.read(FILE_HEADER.size))
+            if magic != FILE_MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            bloom = cls(capacity=1, error_rate=error_rate, num_bits=num_bits, num_hashes=num_hashes)
+            bloom.bits = bytearray(f.read())
+        if len(bloom.bits) != num_bits // 8:
+            raise ValueError(f"{path} is truncated")
+        bloom.capacity = round(num_bits * math.log(2) ** 2 / -math.log(error_rate))
+        bloom.count = count
+        return bloom
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """
+    DUPEFILTER_CLASS that keeps canonical request fingerprints in Bloom
+    filters; see the module docstring for the modes.
+
+    Settings:
+        DUPEFILTER_MODE        "run" (default) or "cross_run"
+        DUPEFILTER_CAPACITY    expected number of requests (per run, and in the cross-run file)
+        DUPEFILTER_ERROR_RATE  false positive rate at capacity
+        DUPEFILTER_DIR         directory of the cross-run files
+        DUPEFILTER_DEBUG       log every filtered request
+    """
+
+    def __init__(self, mode="run", capacity=2_000_000, error_rate=1e-4, directory=None,
+                 debug=False, crawler=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown DUPEFILTER_MODE {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.directory = directory
+        self.debug = debug
+        self.logdupes = True
+        self.crawler = crawler
+        self.seen = BloomFilter(capacity, error_rate)
+        self.persisted = None
+        self.path = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = cls(
+            mode=settings.get("DUPEFILTER_MODE", "run"),
+            capacity=settings.getint("DUPEFILTER_CAPACITY", 2_000_000),
+            error_rate=settings.getfloat("DUPEFILTER_ERROR_RATE", 1e-4),
+            directory=settings.get("DUPEFILTER_DIR", "dupefilter"),
+            debug=settings.getbool("DUPEFILTER_DEBUG"),
+            crawler=crawler,
+        )
+        if dupefilter.mode == "cross_run":
+            # Only successful fetches count as seen, a failed one is retried next run
+            crawler.signals.connect(dupefilter.response_received, signal=signals.response_received)
+        return dupefilter
+
+    def open(self):
+        if self.mode != "cross_run":
+            return
+        spider = self.crawler.spider
+        # UniversalSpider runs under one name for every shop, so key the file by shop
+        name = getattr(spider, "shop_name", None) or spider.name
+        self.path = os.path.join(data_path(self.directory, createdir=True), f"{name}.bloom")
+        if os.path.exists(self.path):
+            self.persisted = BloomFilter.load(self.path)
+            logger.info(f"Loaded {self.persisted.count} seen requests from {self.path}")
+        else:
+            self.persisted = BloomFilter(self.capacity, self.error_rate)
+
+    def close(self, reason):
+        if self.seen.count > self.seen.capacity:
+            logger.warning(f"{self.seen.count} requests passed the dupefilter, above "
+                           f"DUPEFILTER_CAPACITY={self.capacity}; raise it to keep false "
+                           f"positives near DUPEFILTER_ERROR_RATE")
+        if self.persisted is not None:
+            # The file keeps the size it was created with and only grows fuller
+            if self.persisted.count > self.persisted.capacity:
+                logger.warning(f"{self.path} holds {self.persisted.count} requests, above its "
+                               f"capacity of {self.persisted.capacity}; delete it (or run in "
+                               f"'run' mode) to start a new filter sized by DUPEFILTER_CAPACITY")
+                self.inc_stat("dupefilter/persisted_saturated")
+            self.persisted.save(self.path)
+            logger.info(f"Saved {self.persisted.count} seen requests "
+                        f"({self.persisted.size_bytes / 1e6:.1f} MB) to {self.path}")
+
+    def request_seen(self, request):
+        key = request_key(request)
+        if (self.persisted is not None and request.meta.get(PERSIST_META_KEY)
+                and key in self.persisted):
+            self.inc_stat("dupefilter/filtered_cross_run")
+            return True
+        return not self.seen.add(key)
+
+    def response_received(self, response, request, spider):
+        if (self.persisted is not None and request.meta.get(PERSIST_META_KEY)
+                and 200 <= response.status < 400):
+            self.persisted.add(request_key(request))
+            # After a redirect 'request' has the target URL; the next run
+            # requests the original one again
+            redirect_urls = request.meta.get("redirect_urls")
+            if redirect_urls:
+                self.persisted.add(request_key(request.replace(url=redirect_urls[0])))
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug(f"Filtered duplicate request: {request} (referer: {referer_str(request)})")
+        elif self.logdupes:
+            logger.debug(f"Filtered duplicate request: {request} - no more duplicates will be "
+                         f"shown (see DUPEFILTER_DEBUG to show all duplicates)")
+            self.logdupes = False
+        self.inc_stat("dupefilter/filtered")
+
+    def inc_stat(self, key, count=1):
+        if self.crawler is not None:
+            self.crawler.stats.inc_value(key, count)
@@ -0,0 +1,190 @@
+"""
+embedding_cache.py
+
+A persistent embedding cache so identical product texts are never embedded
+twice, e.g. when rebuilding an index, switching index names (--test) or
+recovering from a failed run.
+
+Vectors are stored in a small SQLite file keyed by a hash of the embedding
+model name and the document text (the build_page_content output). The cache
+is capped at 'max_entries' and evicts the least recently used vectors.
+
+CachedEmbeddings wraps any LangChain Embeddings object, so it can be used
+with a fake embedder offline:
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    store = SQLiteEmbeddingStore(":memory:", max_entries=1000)
+    embeddings = CachedEmbeddings(DeterministicFakeEmbedding(size=8), store, "fake")
+    embeddings.embed_documents(["a", "b", "a"])
+    print(embeddings.stats())
+"""
+
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+
+class SQLiteEmbeddingStore:
+    """
+    Size-capped key -> vector store with LRU eviction, backed by SQLite.
+    Vectors are stored as float32 blobs.
+    """
+
+    def __init__(self, path="embedding_cache.sqlite", max_entries=1_000_000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+        # Row count kept in memory so put_many doesn't have to count the
+        # table, see sync_count
+        self.entries = self.count()
+        self.data_version = self.read_data_version()
+
+    def get_many(self, keys):
+        """
+        Returns {key: vector} for the keys that are cached and marks them as used.
+        """
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, vectors):
+        """
+        Stores {key: vector} and evicts the least recently used entries over the cap.
+        """
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()]
+        with self.lock:
+            self.sync_count()
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self.entries += cursor.rowcount
+            self.evict()
+            self.conn.commit()
+
+    def sync_count(self):
+        """
+        Recounts the rows if another connection (e.g. another process
+        sharing the file) committed changes since we last looked.
+        """
+        version = self.read_data_version()
+        if version != self.data_version:
+            self.entries = self.count()
+            self.data_version = version
+
+    def evict(self):
+        overflow = self.entries - self.max_entries
+        if overflow <= 0:
+            return
+        cursor = self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (overflow,),
+        )
+        self.entries -= cursor.rowcount
+
+    def read_data_version(self):
+        # Changes when other connections commit, not on our own commits
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self.count()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves document vectors from a cache and only
+    sends cache misses to the underlying embedder.
+
+    Queries are passed straight through; only documents are cached.
+    """
+
+    def __init__(self, embedder, store, model_name):
+        self.embedder = embedder
+        self.store = store
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def cache_key(self, text):
+        digest = hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self.cache_key(text) for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+
+        # Embed each missing text once, even if it appears several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.store.put_many(fresh)
+            cached.update(fresh)
+
+        with self.lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
+
+    def stats(self):
+        """
+        Hit/miss counters and the current number of cached vectors.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.store),
+        }
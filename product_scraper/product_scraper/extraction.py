@@ -0,0 +1,183 @@
+# extraction.py
+"""
+Compiled extraction plans for shop configs.
+
+A shop config's 'selectors' and 'extras' are compiled once into lxml XPath
+objects (CSS selectors are translated to XPath with parsel's translator, so
+'::text' and '::attr()' keep working). An ExtractionPlan then runs directly
+against the parsed lxml tree of a page, without re-reading the config,
+re-sniffing selector types or recompiling expressions for every field of
+every page.
+
+The module also provides the entry points for running a plan in worker
+processes (init_worker / extract_in_worker), so CPU-bound parsing can be
+moved off the reactor thread.
+
+Results match UniversalSpider.extract_field: single fields return the first
+match, stripped, or None; 'join_text' fields join all non-empty stripped
+matches with spaces.
+"""
+
+from lxml import etree
+from parsel import Selector
+from parsel.csstranslator import HTMLTranslator
+
+STANDARD_FIELDS = ("product_name", "price", "brand", "description")
+
+# Same namespaces parsel makes available to XPath expressions
+XPATH_NAMESPACES = {"re": "http://exslt.org/regular-expressions"}
+
+# Where a saved page states its own URL, in order of preference
+CANONICAL_URL_XPATHS = [
+    etree.XPath("//link[@rel='canonical']/@href", smart_strings=False),
+    etree.XPath("//meta[@property='og:url']/@content", smart_strings=False),
+]
+
+_css_translator = HTMLTranslator()
+
+
+def is_xpath(selector):
+    """
+    Selectors starting with '/', '.' or '(' are XPath, everything else is CSS.
+    """
+    return selector[0] in ("/", ".", "(")
+
+
+def serialize(node):
+    """
+    Turns an XPath result into a string the way parsel's Selector.get() does.
+    """
+    if isinstance(node, etree._Element):
+        return etree.tostring(node, method="html", encoding="unicode", with_tail=False)
+    if node is True:
+        return "1"
+    if node is False:
+        return "0"
+    return str(node)
+
+
+def canonical_url(root):
+    """
+    The <link rel="canonical"> or og:url of a parsed page, or None.
+    """
+    for xpath in CANONICAL_URL_XPATHS:
+        for value in xpath(root):
+            if value.strip():
+                return value.strip()
+    return None
+
+
+class FieldPlan:
+    """
+    One compiled field: an XPath object plus whether to join all matches.
+    """
+
+    __slots__ = ("name", "selector", "join_text", "xpath")
+
+    def __init__(self, name, selector, join_text=False):
+        self.name = name
+        self.selector = selector.strip()
+        self.join_text = join_text
+        if is_xpath(self.selector):
+            expression = self.selector
+        else:
+            expression = _css_translator.css_to_xpath(self.selector)
+        self.xpath = etree.XPath(expression, namespaces=XPATH_NAMESPACES, smart_strings=False)
+
+    def extract(self, root):
+        result = self.xpath(root)
+        if type(result) is not list:
+            result = [result]
+
+        if self.join_text:
+            parts = [text.strip() for text in map(serialize, result) if text.strip()]
+            return " ".join(parts).strip() if parts else None
+
+        if not result:
+            return None
+        return serialize(result[0]).strip() or None
+
+
+def compile_field(name, field_config):
+    """
+    Compiles a field config (a selector string, or a dict with 'selector' and
+    optional 'join_text') into a FieldPlan. Returns None for empty configs.
+    """
+    if not field_config:
+        return None
+    if isinstance(field_config, str):
+        selector, join_text = field_config, False
+    else:
+        selector = field_config.get("selector")
+        join_text = field_config.get("join_text", False)
+    if not selector or not selector.strip():
+        return None
+    return FieldPlan(name, selector, join_text=bool(join_text))
+
+
+class ExtractionPlan:
+    """
+    All compiled fields of a shop config.
+    """
+
+    def __init__(self, config):
+        selectors = config.get("selectors") or {}
+        extras = config.get("extras") or {}
+
+        self.fields = []
+        for name in STANDARD_FIELDS:
+            self.fields.append((name, compile_field(name, selectors.get(name))))
+
+        self.extras = []
+        for name, field_config in extras.items():
+            plan = compile_field(name, field_config)
+            if plan is not None:
+                self.extras.append(plan)
+
+    def extract(self, root):
+        """
+        Runs the plan against a parsed page (e.g. response.selector.root) and
+        returns a plain dict with the standard fields and an 'extras' dict.
+        """
+        values = {}
+        for name, plan in self.fields:
+            values[name] = plan.extract(root) if plan is not None else None
+
+        extras = {}
+        for plan in self.extras:
+            val = plan.extract(root)
+            if val:
+                extras[plan.name] = val
+        values["extras"] = extras
+        return values
+
+
+# ---------------------------------------------------------------------
+# Worker process entry points
+# ---------------------------------------------------------------------
+
+# Compiled plan of the current worker process; lxml XPath objects can't be
+# pickled, so each worker compiles the config once when it starts.
+_worker_plan = None
+
+
+def init_worker(config):
+    """
+    ProcessPoolExecutor initializer: compile the shop config in this worker.
+    """
+    global _worker_plan
+    _worker_plan = ExtractionPlan(config)
+
+
+def extract_in_worker(text):
+    """
+    Parses a page's HTML and runs the worker's plan on it. Returns a plain dict.
+    """
+    return _worker_plan.extract(Selector(text=text, type="html").root)
+
+
+def extract_root_in_worker(root):
+    """
+    Runs the worker's plan on an already parsed page.
+    """
+    return _worker_plan.extract(root)
@@ -0,0 +1,167 @@
+# fetch_state.py
+"""
+Per-URL fetch state for incremental crawls.
+
+The spiders use this to decide whether a page needs to be fetched again:
+a sitemap <lastmod> equal to the one stored at the last successful fetch
+means the page is skipped, otherwise the stored ETag / Last-Modified values
+are sent as If-None-Match / If-Modified-Since so the server can answer 304.
+Spiders that discover products through a listing API can instead store a
+fingerprint of the listing entry and skip the detail request while it stays
+the same. Skipped and 304 pages are counted as "seen" and only get their
+Product.last_seen bumped.
+
+State is keyed on the URL the spider discovered (sitemap <loc>, listing
+URL) and remembers the URL of the product row, which differs after a
+redirect. A fetch is only recorded once SQLitePipeline has committed its
+item (pipelines.items_committed): otherwise a crash before the pipeline's
+flush, or a row that fails to insert, would leave the page marked as
+unchanged with no product row behind it.
+"""
+
+from product_scraper.models import get_session, PageState, Product, chunked, utcnow
+
+
+class FetchStateStore:
+    """
+    Loads the fetch state of one shop into memory and writes changes back in batches.
+    """
+
+    def __init__(self, db_path, shop, flush_every=500, profile=None):
+        self.session = get_session(db_path=db_path, profile=profile)
+        self.shop = shop
+        self.flush_every = flush_every
+
+        # url -> (id, lastmod, etag, last_modified, fingerprint, product_url)
+        self.state = {}
+        rows = (self.session.query(PageState.id, PageState.url, PageState.lastmod,
+                                   PageState.etag, PageState.last_modified,
+                                   PageState.fingerprint, PageState.product_url)
+                .filter(PageState.shop == shop))
+        for row in rows:
+            self.state[row.url] = (row.id, row.lastmod, row.etag, row.last_modified,
+                                   row.fingerprint, row.product_url)
+
+        self.pending = {}
+        self.seen = []
+        # product URL -> (url, validators) of fetches whose item isn't committed yet
+        self.awaiting_commit = {}
+
+    def is_known(self, url):
+        """
+        True if the URL was fetched by an earlier run.
+        """
+        return url in self.state
+
+    def is_unchanged(self, url, lastmod):
+        """
+        True if the sitemap lastmod matches the one stored at the last fetch.
+        """
+        if not lastmod or url not in self.state:
+            return False
+        return self.state[url][1] == lastmod
+
+    def fingerprint_unchanged(self, url, fingerprint):
+        """
+        True if the listing fingerprint matches the one stored at the last fetch.
+        """
+        if url not in self.state:
+            return False
+        return self.state[url][4] == fingerprint
+
+    def conditional_headers(self, url):
+        """
+        Returns If-None-Match / If-Modified-Since headers for a known URL.
+        """
+        headers = {}
+        if url in self.state:
+            _, _, etag, last_modified, _, _ = self.state[url]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def await_commit(self, product_url, url, **validators):
+        """
+        Record the validators of 'url' once the item for 'product_url' is
+        committed, see record_fetch.
+        """
+        self.awaiting_commit[product_url] = (url, validators)
+
+    def items_committed(self, product_urls):
+        for product_url in product_urls:
+            awaiting = self.awaiting_commit.pop(product_url, None)
+            if awaiting is not None:
+                url, validators = awaiting
+                self.record_fetch(url, product_url=product_url, **validators)
+
+    def record_fetch(self, url, lastmod=None, etag=None, last_modified=None, fingerprint=None,
+                     product_url=None):
+        """
+        Remember the validators of a page that was fetched, parsed and stored
+        as the product row of 'product_url' (default: 'url').
+        """
+        product_url = product_url or url
+        row_id = self.state.get(url, (None,))[0]
+        self.state[url] = (row_id, lastmod, etag, last_modified, fingerprint, product_url)
+        self.pending[url] = {
+            "shop": self.shop,
+            "url": url,
+            "product_url": product_url,
+            "lastmod": lastmod,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fingerprint": fingerprint,
+            "last_fetched": utcnow(),
+        }
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def mark_seen(self, url):
+        """
+        Count a skipped or 304 page as seen without re-parsing it.
+        """
+        state = self.state.get(url)
+        # Older rows don't know their product URL
+        self.seen.append(state[5] or url if state else url)
+        if len(self.seen) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        now = utcnow()
+
+        if self.pending:
+            inserts, updates = [], []
+            for url, row in self.pending.items():
+                row_id = self.state[url][0]
+                if row_id is None:
+                    inserts.append(row)
+                else:
+                    updates.append(dict(row, id=row_id))
+            self.session.bulk_insert_mappings(PageState, inserts)
+            self.session.bulk_update_mappings(PageState, updates)
+            self.pending = {}
+            self.remember_ids([row["url"] for row in inserts])
+
+        seen, self.seen = self.seen, []
+        for chunk in chunked(seen):
+            (self.session.query(Product)
+                .filter(Product.shop == self.shop, Product.url.in_(chunk))
+                .update({Product.last_seen: now}, synchronize_session=False))
+
+        self.session.commit()
+
+    def remember_ids(self, urls):
+        """
+        Look up the ids of freshly inserted rows so later flushes update them.
+        """
+        for chunk in chunked(urls):
+            rows = (self.session.query(PageState.id, PageState.url)
+                    .filter(PageState.shop == self.shop, PageState.url.in_(chunk)))
+            for row in rows:
+                self.state[row.url] = (row.id,) + self.state[row.url][1:]
+
+    def close(self):
+        self.flush()
+        self.session.close()
@@ -0,0 +1,208 @@
+# httpcache.py
+"""
+Compressed, content-addressed HTTP cache storage.
+
+A drop-in HTTPCACHE_STORAGE for Scrapy's HttpCacheMiddleware. Because the
+middleware sits above the download handlers, it caches plain HTTP responses
+and Playwright-rendered HTML alike, which lets a spider be re-run fully
+offline while selectors are being tuned (see HTTPCACHE_* in settings.py).
+
+Layout: one SQLite file per shop under HTTPCACHE_DIR.
+
+    blobs      sha256 of the body -> compressed body (zstd if the
+               'zstandard' package is installed, zlib otherwise)
+    responses  request fingerprint -> url, status, raw headers, body hash
+
+Identical bodies (error pages, duplicate products behind several URLs) are
+stored once. Each blob records its codec, so a cache written with zlib can
+still be read after zstandard gets installed and vice versa.
+"""
+
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Commit after this many stored responses
+COMMIT_EVERY = 200
+
+
+class BlobCodec:
+    """
+    Compresses bodies with zstd when available, zlib otherwise, and
+    decompresses either.
+    """
+
+    def __init__(self, level=None):
+        if zstandard is not None:
+            self.name = "zstd"
+            self.level = 3 if level is None else level
+            self.compressor = zstandard.ZstdCompressor(level=self.level)
+        else:
+            self.name = "zlib"
+            self.level = 6 if level is None else level
+            self.compressor = None
+        self.decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def compress(self, data):
+        if self.compressor is not None:
+            return self.compressor.compress(data)
+        return zlib.compress(data, self.level)
+
+    def decompress(self, codec, data):
+        if codec == "zlib":
+            return zlib.decompress(data)
+        if codec == "zstd":
+            if self.decompressor is None:
+                raise RuntimeError("Cached body is zstd-compressed; install 'zstandard' to read it")
+            return self.decompressor.decompress(data)
+        raise ValueError(f"Unknown cache codec {codec!r}")
+
+
+def open_cache_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS blobs ("
+        " hash TEXT PRIMARY KEY,"
+        " codec TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " data BLOB NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        " fingerprint TEXT PRIMARY KEY,"
+        " url TEXT NOT NULL,"
+        " status INTEGER NOT NULL,"
+        " headers BLOB NOT NULL,"
+        " body_hash TEXT NOT NULL,"
+        " timestamp REAL NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+
+def iter_cached_responses(path, statuses=(200,)):
+    """
+    Yields (url, headers, body) for every cached response with one of the
+    given statuses, e.g. to re-extract a shop without a crawl. 'headers' is
+    a dict of raw header lists as accepted by scrapy.http.Headers.
+    """
+    conn = open_cache_db(path)
+    codec = BlobCodec()
+    placeholders = ",".join("?" * len(statuses))
+    try:
+        rows = conn.execute(
+            "SELECT r.url, r.headers, b.codec, b.data"
+            " FROM responses r JOIN blobs b ON b.hash = r.body_hash"
+            f" WHERE r.status IN ({placeholders})",
+            tuple(statuses),
+        )
+        for url, raw_headers, blob_codec, data in rows:
+            yield url, headers_raw_to_dict(raw_headers), codec.decompress(blob_codec, data)
+    finally:
+        conn.close()
+
+
+class SQLiteZstdCacheStorage:
+    """
+    HTTPCACHE_STORAGE backend: one SQLite file per shop, bodies stored
+    compressed and de-duplicated by content hash.
+
+    Settings:
+        HTTPCACHE_DIR             directory of the cache files
+        HTTPCACHE_EXPIRATION_SECS entries older than this are ignored (0 = never expire)
+        HTTPCACHE_ZSTD_LEVEL      compression level (zstd default 3, zlib default 6)
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        level = settings.get("HTTPCACHE_ZSTD_LEVEL")
+        self.codec = BlobCodec(None if level is None else int(level))
+        self.conn = None
+        self.pending = 0
+
+    def open_spider(self, spider):
+        # UniversalSpider runs under one name for every shop, so key the file by shop
+        name = getattr(spider, "shop_name", None) or spider.name
+        self.path = os.path.join(self.cachedir, f"{name}.sqlite")
+        self.conn = open_cache_db(self.path)
+        self.fingerprinter = spider.crawler.request_fingerprinter
+        self.stats = spider.crawler.stats
+        spider.logger.debug(f"Using {self.codec.name} HTTP cache at {self.path}")
+
+    def close_spider(self, spider):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def retrieve_response(self, spider, request):
+        """
+        Returns the cached response for the request, or None on a miss.
+        """
+        row = self.conn.execute(
+            "SELECT r.url, r.status, r.headers, r.timestamp, b.codec, b.data"
+            " FROM responses r JOIN blobs b ON b.hash = r.body_hash"
+            " WHERE r.fingerprint = ?",
+            (self.request_key(request),),
+        ).fetchone()
+        if row is None:
+            return None
+
+        url, status, raw_headers, timestamp, codec, data = row
+        if 0 < self.expiration_secs < time.time() - timestamp:
+            return None
+
+        body = self.codec.decompress(codec, data)
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        # A 304 answers a conditional request; storing it under the same
+        # fingerprint would replace the full page we already have
+        if response.status == 304:
+            return
+
+        body = response.body
+        body_hash = hashlib.sha256(body).hexdigest()
+        # Only compress bodies we don't have yet
+        known = self.conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (body_hash,)).fetchone()
+        if known is None:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)",
+                (body_hash, self.codec.name, len(body), self.codec.compress(body)),
+            )
+            self.stats.inc_value("httpcache/blobs_stored")
+        else:
+            self.stats.inc_value("httpcache/blobs_deduplicated")
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses"
+            " (fingerprint, url, status, headers, body_hash, timestamp)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (self.request_key(request), response.url, response.status,
+             headers_dict_to_raw(response.headers), body_hash, time.time()),
+        )
+
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def request_key(self, request):
+        return self.fingerprinter.fingerprint(request).hex()
@@ -10,6 +10,14 @@ into a Pinecone vector index using LangChain. It:
 4. Tracks metadata of inserted documents using SQLRecordManager.
 5. Creates a LangChain 'Index' object and prints it for verification.
 
+With --pipelined, embedding and Pinecone upserts run in concurrent, bounded
+stages (see pipelined_indexer.py) instead of one synchronous index() call.
+
+With --delta, only products changed since the last successful run of the same
+index are embedded. In both modes, products missing from their shop's last
+finished crawl are left out and deleted from the vector store; shops without
+a finished crawl are left alone. Runs are tracked in the products DB.
+
 To run:
 
   1. Set environment variables:
@@ -18,10 +26,12 @@ To run:
   2. Ensure you have all dependencies installed (langchain, pinecone, etc.).
   3. Execute: python index_into_pinecone.py
      or add the --test flag: python index_into_pinecone.py --test
+     or index only what changed: python index_into_pinecone.py --delta
 """
 
 import os
 import time
+import datetime
 import argparse
 
 # Pinecone imports
@@ -34,12 +44,108 @@ from langchain_openai import OpenAIEmbeddings  # or langchain_community.embeddin
 from langchain_pinecone import PineconeVectorStore
 
 # Local import: your script that creates Document objects
-from create_documents import create_documents
+from create_documents import iter_documents, open_session
+from embedding_cache import CachedEmbeddings, SQLiteEmbeddingStore
+from pipelined_indexer import PipelinedIndexer, PineconeUpserter
+from models import (IndexRun, Product, last_successful_index_run, not_seen_between,
+                    stale_cutoffs, utcnow)
 
 # loading .env file
 from dotenv import load_dotenv
 load_dotenv()
 
+def with_progress(batches, report_every=1000):
+    """
+    Passes batches of documents through, printing progress every
+    'report_every' documents.
+    """
+    started = time.monotonic()
+    total = 0
+    next_report = report_every
+    for batch in batches:
+        yield batch
+        total += len(batch)
+        if total >= next_report:
+            rate = total / max(time.monotonic() - started, 1e-9)
+            print(f"Streamed {total} documents ({rate:.0f} docs/s)")
+            next_report = total + report_every
+    print(f"Streamed {total} documents in total")
+
+
+def delete_sources(urls, record_manager, vectorstore, batch_size=100):
+    """
+    Deletes every vector indexed for the given source URLs from the vector
+    store and the record manager. Returns the number of deleted vectors.
+    """
+    deleted = 0
+    for start in range(0, len(urls), batch_size):
+        keys = record_manager.list_keys(group_ids=urls[start:start + batch_size])
+        if keys:
+            deleted += delete_keys(keys, record_manager, vectorstore)
+    return deleted
+
+
+def run_pipelined(batches, embeddings, index, vectorstore, record_manager, args, delta):
+    """
+    Embeds and upserts document batches through the PipelinedIndexer, then
+    removes vectors that this run superseded. Returns counts shaped like the
+    result of LangChain's index().
+    """
+    run_started = record_manager.get_time()
+    upserter = PineconeUpserter(index, record_manager=record_manager)
+    indexer = PipelinedIndexer(
+        embeddings,
+        upserter,
+        embed_workers=args.embed_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+    )
+
+    # In delta mode remember which products were written, so older vectors
+    # of just those products can be removed afterwards.
+    written_urls = []
+
+    def tracked(batches):
+        for batch in batches:
+            written_urls.extend(document.metadata["url"] for document in batch)
+            yield batch
+
+    metrics = indexer.run(tracked(batches) if delta else batches)
+    for stage in ("read", "embed", "upsert"):
+        print(f"{stage}: {metrics[stage]}")
+
+    # Vectors not touched in this run: everything older in a full run, and
+    # only older vectors of the written products in a delta run.
+    deleted = 0
+    if delta:
+        for start in range(0, len(written_urls), 100):
+            stale_keys = record_manager.list_keys(
+                before=run_started, group_ids=written_urls[start:start + 100]
+            )
+            deleted += delete_keys(stale_keys, record_manager, vectorstore)
+    else:
+        deleted += delete_keys(record_manager.list_keys(before=run_started),
+                               record_manager, vectorstore)
+
+    return {
+        "num_added": metrics["upsert"]["items"],
+        "num_updated": 0,
+        "num_skipped": 0,
+        "num_deleted": deleted,
+    }
+
+
+def delete_keys(keys, record_manager, vectorstore, batch_size=1000):
+    """
+    Deletes the given vector ids from the vector store and the record manager.
+    """
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start:start + batch_size]
+        vectorstore.delete(ids=chunk)
+        record_manager.delete_keys(chunk)
+    return len(keys)
+
+
 def main():
     """
     Main entry point: sets up Pinecone, creates/loads a vector index, and prints a LangChain Index object.
@@ -53,6 +159,27 @@ def main():
     # -------------------------------------------------------------------
     parser = argparse.ArgumentParser(description="Index documents into a Pinecone vector store.")
     parser.add_argument("--test", action="store_true", help="Use a '-test' suffix on the index name.")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="Number of products read from the DB per batch.")
+    parser.add_argument("--delta", action="store_true",
+                        help="Only index products changed since the last successful run.")
+    parser.add_argument("--stale-hours", type=float, default=0.0,
+                        help="Only delete products not seen for this long before their shop's "
+                             "last finished crawl started (for crawls split over several runs).")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Embed and upsert in concurrent stages instead of a single index() call.")
+    parser.add_argument("--embed-workers", type=int, default=4,
+                        help="Number of concurrent embedding workers (--pipelined).")
+    parser.add_argument("--upsert-workers", type=int, default=2,
+                        help="Number of concurrent Pinecone upsert workers (--pipelined).")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Max number of batches waiting between stages (--pipelined).")
+    parser.add_argument("--embedding-cache", default="embedding_cache.sqlite",
+                        help="Path of the local embedding cache.")
+    parser.add_argument("--embedding-cache-size", type=int, default=1_000_000,
+                        help="Max number of cached vectors before LRU eviction.")
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help="Always call the embedding API.")
     args = parser.parse_args()
 
     # -------------------------------------------------------------------
@@ -68,6 +195,13 @@ def main():
     # -------------------------------------------------------------------
     embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
 
+    # Serve vectors for texts we've embedded before from the local cache
+    if not args.no_embedding_cache:
+        embedding_store = SQLiteEmbeddingStore(
+            args.embedding_cache, max_entries=args.embedding_cache_size
+        )
+        embeddings = CachedEmbeddings(embeddings, embedding_store, model_name=embeddings.model)
+
     # -------------------------------------------------------------------
     # 4. Initialize Pinecone client
     # -------------------------------------------------------------------
@@ -123,27 +257,96 @@ def main():
     record_manager.create_schema()  # ensure DB tables exist
 
     # -------------------------------------------------------------------
-    # 10. Create or load your documents from the local SQLite DB
+    # 10. Record this run in the products DB and look up the previous one
     # -------------------------------------------------------------------
     db_path = os.getenv("DB_PATH")
-    documents = create_documents(db_path=db_path)
+    session = open_session(db_path)
+    previous_run = last_successful_index_run(session, index_name)
 
-    print(documents[5])  # print the first document for verification
+    if args.delta and previous_run is None:
+        print(f"No successful run found for {index_name}; running a full index instead.")
+    delta = args.delta and previous_run is not None
 
-    # -------------------------------------------------------------------
-    # 11. Build a LangChain 'Index' object that ties everything together
-    # -------------------------------------------------------------------
-    lc_index = LangchainIndex(
-        documents,
-        record_manager,
-        vectorstore,
-        cleanup="scoped_full",   # remove documents only within this scope if re-indexing
-        source_id_key="url",     # use 'url' from metadata as the source identifier
-    )
+    run = IndexRun(index_name=index_name, mode="delta" if delta else "full",
+                   status="running", started_at=utcnow())
+    session.add(run)
+    session.commit()
+
+    # Per shop: products not seen since its last finished crawl started are
+    # gone from the shop. Shops without a finished crawl have no cutoff.
+    stale_before = stale_cutoffs(session, grace=datetime.timedelta(hours=args.stale_hours))
+    for (shop,) in session.query(Product.shop).distinct():
+        if shop not in stale_before:
+            print(f"No finished crawl of {shop}; not deleting its products.")
+
+    try:
+        # ---------------------------------------------------------------
+        # 11. Stream documents from the local SQLite DB, one batch at a time.
+        #     In delta mode only products changed since the previous run;
+        #     stale products are left out in both modes.
+        # ---------------------------------------------------------------
+        batches = with_progress(
+            iter_documents(
+                db_path=db_path,
+                batch_size=args.batch_size,
+                changed_since=previous_run.started_at if delta else None,
+                seen_since=stale_before,
+            ),
+            report_every=args.batch_size,
+        )
+
+        # ---------------------------------------------------------------
+        # 12. Build a LangChain 'Index' object that ties everything together.
+        #     index() consumes the stream lazily, so memory stays constant.
+        #     A delta run only sees part of the catalogue, so it can't use
+        #     'scoped_full' cleanup; 'incremental' still replaces the old
+        #     version of every changed product.
+        #     With --pipelined, embedding and upserts run concurrently instead.
+        # ---------------------------------------------------------------
+        if args.pipelined:
+            lc_index = run_pipelined(batches, embeddings, index, vectorstore,
+                                     record_manager, args, delta)
+        else:
+            lc_index = LangchainIndex(
+                (document for batch in batches for document in batch),
+                record_manager,
+                vectorstore,
+                cleanup="incremental" if delta else "scoped_full",
+                source_id_key="url",     # use 'url' from metadata as the source identifier
+            )
+        deleted = lc_index["num_deleted"]
+
+        # ---------------------------------------------------------------
+        # 13. Delete every product that is stale now, not just the ones that
+        #     went stale since the previous run: those may have been indexed
+        #     by an earlier run and never cleaned up. Only keys still in the
+        #     record manager are deleted.
+        # ---------------------------------------------------------------
+        gone_urls = []
+        for shop, cutoff in stale_before.items():
+            gone = not_seen_between(session, after=None, before=cutoff, shop=shop)
+            gone_urls.extend(url for (url,) in gone.with_entities(Product.url) if url)
+        gone_deleted = delete_sources(gone_urls, record_manager, vectorstore)
+        deleted += gone_deleted
+        print(f"Deleted {gone_deleted} vectors of products no longer seen by the crawler")
+
+        run.status = "success"
+        run.documents_written = lc_index["num_added"] + lc_index["num_updated"]
+        run.documents_deleted = deleted
+    except BaseException:
+        run.status = "failed"
+        raise
+    finally:
+        run.finished_at = utcnow()
+        session.commit()
+        session.close()
 
     # Printing the index primarily for debugging/verification
     print(lc_index)
     print(f"Successfully indexed documents into: {index_name}")
+    if isinstance(embeddings, CachedEmbeddings):
+        print(f"Embedding cache: {embeddings.stats()}")
+        embeddings.store.close()
 
 
 if __name__ == "__main__":
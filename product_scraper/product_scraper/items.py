@@ -11,6 +11,7 @@ class ProductScraperItem(scrapy.Item):
     url = scrapy.Field()
     product_name = scrapy.Field()
     price = scrapy.Field()
+    currency = scrapy.Field()  # optional ISO 4217 code, else guessed from 'price'
     brand = scrapy.Field()
     description = scrapy.Field()
     # ... any other standard fields for your domain
@@ -3,6 +3,8 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+from collections import deque
+
 from scrapy import signals
 
 # useful for handling different item types with a single interface
@@ -57,14 +59,51 @@ class ProductScraperSpiderMiddleware:
 
 
 class ProductScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """
+    Adaptive per-shop concurrency.
+
+    For every downloader slot (one per shop domain) we keep a rolling window
+    of response latencies (download_latency, which for Playwright requests is
+    the full page render) and of error outcomes (429, 5xx and download
+    exceptions). Every ADAPTIVE_CONCURRENCY_ADJUST_EVERY responses the slot's
+    concurrency is adjusted AIMD-style:
+
+    - halved when the error rate exceeds max_error_rate or p95 latency is over
+      twice its target,
+    - raised by one when p95 latency is under target, there were no errors and
+      requests are queued for the slot,
+    - left alone otherwise,
+
+    always staying within the shop's [min_concurrency, max_concurrency].
+    Defaults come from the ADAPTIVE_CONCURRENCY_* settings and can be
+    overridden per shop with a 'throttle' block in the shop YAML (exposed by
+    the spider as 'throttle_config'). Decisions are exported as stats under
+    adaptive/<slot>/.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.enabled = settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED", True)
+        self.defaults = {
+            "min_concurrency": settings.getint("ADAPTIVE_CONCURRENCY_MIN", 1),
+            "max_concurrency": settings.getint("ADAPTIVE_CONCURRENCY_MAX", 16),
+            "target_latency": settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY", 2.0),
+            "playwright_target_latency": settings.getfloat(
+                "ADAPTIVE_CONCURRENCY_PLAYWRIGHT_TARGET_LATENCY", 8.0),
+            "max_error_rate": settings.getfloat("ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE", 0.05),
+        }
+        self.window = settings.getint("ADAPTIVE_CONCURRENCY_WINDOW", 50)
+        self.adjust_every = settings.getint("ADAPTIVE_CONCURRENCY_ADJUST_EVERY", 20)
+        self.limits = dict(self.defaults)
+        # slot key -> rolling windows and counters
+        self.slots = {}
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
@@ -87,6 +126,9 @@ class ProductScraperDownloaderMiddleware:
         # - return a Response object
         # - return a Request object
         # - or raise IgnoreRequest
+        if self.enabled:
+            error = response.status == 429 or response.status >= 500
+            self.observe(request, request.meta.get("download_latency"), error)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -97,7 +139,89 @@ class ProductScraperDownloaderMiddleware:
         # - return None: continue processing this exception
         # - return a Response object: stops process_exception() chain
         # - return a Request object: stops process_exception() chain
-        pass
+        if self.enabled:
+            self.observe(request, None, True)
 
     def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+        self.limits = dict(self.defaults, **(getattr(spider, "throttle_config", None) or {}))
+        if self.limits["min_concurrency"] > self.limits["max_concurrency"]:
+            raise ValueError(f"throttle: min_concurrency > max_concurrency for {spider.name}")
+        if self.enabled:
+            spider.logger.info(f"Adaptive concurrency limits: {self.limits}")
+
+    # ---------------------------------------------------------------------
+    # Adaptive concurrency
+    # ---------------------------------------------------------------------
+
+    def observe(self, request, latency, error):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key) if key else None
+        if slot is None:
+            return
+
+        state = self.slots.get(key)
+        if state is None:
+            state = self.slots[key] = {
+                "latencies": deque(maxlen=self.window),
+                "errors": deque(maxlen=self.window),
+                "since_adjust": 0,
+            }
+            # Clamp Scrapy's initial per-domain concurrency into the shop's range
+            slot.concurrency = self.clamp(slot.concurrency)
+            self.stats.set_value(f"adaptive/{key}/concurrency", slot.concurrency)
+
+        if latency is not None:
+            # Latency relative to its target, so HTTP and Playwright requests
+            # can share one window
+            if request.meta.get("playwright"):
+                target = self.limits["playwright_target_latency"]
+                self.stats.max_value(f"adaptive/{key}/playwright_latency_max", latency)
+            else:
+                target = self.limits["target_latency"]
+            state["latencies"].append(latency / target)
+        state["errors"].append(error)
+        if error:
+            self.stats.inc_value(f"adaptive/{key}/errors")
+
+        state["since_adjust"] += 1
+        if state["since_adjust"] >= self.adjust_every:
+            state["since_adjust"] = 0
+            self.adjust(key, slot, state)
+
+    def adjust(self, key, slot, state):
+        latencies = sorted(state["latencies"])
+        p50 = percentile(latencies, 0.50)
+        p95 = percentile(latencies, 0.95)
+        error_rate = sum(state["errors"]) / len(state["errors"])
+
+        old = slot.concurrency
+        if error_rate > self.limits["max_error_rate"] or p95 > 2.0:
+            new = self.clamp(old // 2)
+        elif p95 < 1.0 and error_rate == 0 and slot.queue:
+            new = self.clamp(old + 1)
+        else:
+            new = old
+        decision = "increases" if new > old else "decreases" if new < old else "holds"
+
+        slot.concurrency = new
+        self.stats.inc_value(f"adaptive/{key}/{decision}")
+        self.stats.set_value(f"adaptive/{key}/concurrency", new)
+        self.stats.set_value(f"adaptive/{key}/p50_latency_ratio", round(p50, 3))
+        self.stats.set_value(f"adaptive/{key}/p95_latency_ratio", round(p95, 3))
+        self.stats.set_value(f"adaptive/{key}/error_rate", round(error_rate, 3))
+        if new != old:
+            self.crawler.spider.logger.debug(
+                f"Adaptive concurrency for {key}: {old} -> {new} "
+                f"(p50={p50:.2f}, p95={p95:.2f} x target, error rate {error_rate:.1%})"
+            )
+
+    def clamp(self, concurrency):
+        return max(self.limits["min_concurrency"],
+                   min(self.limits["max_concurrency"], concurrency))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
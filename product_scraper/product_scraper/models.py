@@ -1,46 +1,467 @@
 # models.py
 import os
-from sqlalchemy import Column, Integer, String, Text, Float, JSON
+import re
+import json
+import hashlib
+import datetime
+import threading
+from sqlalchemy import Column, Integer, String, Text, Float, JSON, DateTime, Index, Computed, ForeignKey
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 Base = declarative_base()
 
+# Max number of bound parameters per IN (...) clause, well under SQLite's limit
+SQLITE_IN_CHUNK = 500
+
+def chunked(values, size=SQLITE_IN_CHUNK):
+    """
+    Yields consecutive slices of at most 'size' values.
+    """
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+# Fields that make up a product's content. A change in any of these
+# produces a new content hash and bumps 'last_changed'.
+CONTENT_FIELDS = ("product_name", "price", "brand", "description", "extras")
+
+# Fields compared for the change log. Extras are compared key by key and
+# logged as "extras.<key>".
+DIFF_FIELDS = ("product_name", "price", "price_amount", "currency", "brand", "description")
+
+# A number with optional thousands/decimal separators, e.g. "1 899,95" or "2400"
+PRICE_NUMBER_RE = re.compile(r"\d[\d\s\u00a0.,']*")
+CURRENCY_MARKERS = (
+    (re.compile(r"\b(NOK|SEK|DKK|EUR|USD|GBP)\b", re.IGNORECASE), None),
+    (re.compile(r"\bkr\b|,-|\.-", re.IGNORECASE), "NOK"),
+    (re.compile(r"€"), "EUR"),
+    (re.compile(r"\$"), "USD"),
+    (re.compile(r"£"), "GBP"),
+)
+
 class Product(Base):
     """
     Example SQLAlchemy model for storing product data in SQLite.
+
+    Rows are keyed on (shop, url): a re-crawl updates the existing row
+    instead of appending a new one. The (shop, url) index also serves
+    per-shop queries.
+
+    'price' keeps the text as scraped; 'price_amount' and 'currency' are
+    parsed from it once, at ingest (see parse_price).
     """
     __tablename__ = "products"
+    __table_args__ = (
+        Index("uq_products_shop_url", "shop", "url", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     shop = Column(String(100), nullable=True)
-    url = Column(String(500), nullable=True)
+    url = Column(String(500), nullable=True, index=True)
     product_name = Column(String(500), nullable=True)
     price = Column(String(50), nullable=True)
-    brand = Column(String(200), nullable=True)
+    price_amount = Column(Float, nullable=True, index=True)
+    currency = Column(String(3), nullable=True)
+    brand = Column(String(200), nullable=True, index=True)
     description = Column(Text, nullable=True)
     extras = Column(JSON, nullable=True)  # requires SQLAlchemy>=1.3, or use Text
 
+    # Frequently queried extras, promoted to indexed generated (VIRTUAL)
+    # columns. SQLite computes them from 'extras'; they are never written.
+    isbn = Column(String(20), Computed("json_extract(extras, '$.isbn')"), index=True)
+
+    # Change tracking
+    content_hash = Column(String(64), nullable=True)
+    first_seen = Column(DateTime, nullable=True)
+    last_seen = Column(DateTime, nullable=True)
+    last_changed = Column(DateTime, nullable=True, index=True)
+
+class PageState(Base):
+    """
+    Per-URL fetch validators (sitemap lastmod, ETag, Last-Modified, listing
+    fingerprint) used by the spiders to skip or conditionally re-fetch pages
+    that haven't changed.
+    """
+    __tablename__ = "page_state"
+    __table_args__ = (
+        Index("uq_page_state_shop_url", "shop", "url", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    shop = Column(String(100), nullable=True)
+    url = Column(String(500), nullable=True)
+    lastmod = Column(String(64), nullable=True)
+    etag = Column(String(200), nullable=True)
+    last_modified = Column(String(64), nullable=True)
+    fingerprint = Column(String(64), nullable=True)  # hash of the listing entry
+    product_url = Column(String(500), nullable=True)  # Product.url, differs after redirects
+    last_fetched = Column(DateTime, nullable=True)
+
+class IndexRun(Base):
+    """
+    One run of the vector indexer. Delta runs only index products changed
+    since the last successful run of the same index.
+    """
+    __tablename__ = "index_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    index_name = Column(String(200), nullable=False, index=True)
+    mode = Column(String(20), nullable=False)  # "full" or "delta"
+    status = Column(String(20), nullable=False)  # "running", "success" or "failed"
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    documents_written = Column(Integer, nullable=True)
+    documents_deleted = Column(Integer, nullable=True)
+
+class CrawlRun(Base):
+    """
+    One spider run as seen by SQLitePipeline. ProductChange rows point at
+    the run that recorded them.
+    """
+    __tablename__ = "crawl_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    spider = Column(String(100), nullable=False)
+    shop = Column(String(100), nullable=True, index=True)
+    status = Column(String(20), nullable=False)  # "running" or "finished"
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    items_inserted = Column(Integer, nullable=True)
+    items_updated = Column(Integer, nullable=True)
+    items_unchanged = Column(Integer, nullable=True)
+    changes_written = Column(Integer, nullable=True)
+
+class ProductChange(Base):
+    """
+    Append-only change log: one "new" row per first-seen product and one
+    "changed" row per changed field of an existing product, per crawl run.
+    Rows are never updated, so 'id' order is write order.
+    """
+    __tablename__ = "product_changes"
+    __table_args__ = (
+        Index("ix_product_changes_run_field", "run_id", "field"),
+        Index("ix_product_changes_shop_url", "shop", "url"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(Integer, ForeignKey("crawl_runs.id"), nullable=False)
+    shop = Column(String(100), nullable=True)
+    url = Column(String(500), nullable=True)
+    change_type = Column(String(10), nullable=False)  # "new" or "changed"
+    field = Column(String(200), nullable=True)  # None for "new"
+    old_value = Column(JSON, nullable=True)
+    new_value = Column(JSON, nullable=True)
+    changed_at = Column(DateTime, nullable=False)
+
+def utcnow():
+    """
+    Naive UTC timestamp, matching what SQLite stores for DateTime columns.
+    """
+    return datetime.datetime.utcnow()
+
+def _normalize(value):
+    if isinstance(value, str):
+        # collapse whitespace so layout-only changes don't count as content changes
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def parse_number(text):
+    """
+    Parses a price number with either ',' or '.' as decimal separator and
+    spaces, '.', ',' or "'" as thousands separators. A single separator
+    followed by exactly three digits is read as a thousands separator.
+    """
+    cleaned = re.sub(r"[\s\u00a0']", "", text).rstrip(".,")
+    commas, dots = cleaned.count(","), cleaned.count(".")
+
+    if commas and dots:
+        # whichever comes last is the decimal separator
+        if cleaned.rfind(",") > cleaned.rfind("."):
+            cleaned = cleaned.replace(".", "").replace(",", ".")
+        else:
+            cleaned = cleaned.replace(",", "")
+    elif commas or dots:
+        separator = "," if commas else "."
+        decimals = cleaned.rsplit(separator, 1)[1]
+        if commas + dots > 1 or len(decimals) == 3:
+            cleaned = cleaned.replace(separator, "")
+        else:
+            cleaned = cleaned.replace(separator, ".")
+
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def parse_price(value):
+    """
+    Returns (amount, currency) for a scraped price such as '2400,-',
+    'kr 1 899,95', '1,899.95 NOK' or 499.0. Either part is None if it can't
+    be determined.
+    """
+    if value is None or isinstance(value, bool):
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), None
+
+    value = str(value)
+    match = PRICE_NUMBER_RE.search(value)
+    amount = parse_number(match.group()) if match else None
+
+    currency = None
+    for pattern, code in CURRENCY_MARKERS:
+        found = pattern.search(value)
+        if found:
+            currency = code or found.group().upper()
+            break
+    return amount, currency
+
+def compute_content_hash(row: dict) -> str:
+    """
+    Returns a SHA-256 hex digest of the normalized content fields of a product row.
+    """
+    normalized = {field: _normalize(row.get(field)) for field in CONTENT_FIELDS}
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def diff_product(old, new):
+    """
+    Returns the field-level differences between two product rows (dicts of
+    Product column values) as (field, old value, new value) tuples. Like
+    the content hash, whitespace-only changes are ignored.
+    """
+    changes = []
+    for field in DIFF_FIELDS:
+        if _normalize(old.get(field)) != _normalize(new.get(field)):
+            changes.append((field, old.get(field), new.get(field)))
+
+    old_extras = old.get("extras") or {}
+    new_extras = new.get("extras") or {}
+    for key in list(old_extras) + [key for key in new_extras if key not in old_extras]:
+        old_value, new_value = old_extras.get(key), new_extras.get(key)
+        if _normalize(old_value) != _normalize(new_value):
+            changes.append((f"extras.{key}", old_value, new_value))
+    return changes
+
+def changes_since(session, run_id, shop=None, fields=None, change_types=None):
+    """
+    Returns a query for the changes recorded by crawl runs after 'run_id'
+    (0 for all), in the order they were written. Optionally limited to a
+    shop, to some fields (e.g. ["price_amount"]) and to some change types
+    ("new", "changed"). Served from the change log's (run_id, field) index,
+    the products table isn't read.
+    """
+    query = session.query(ProductChange).filter(ProductChange.run_id > run_id)
+    if shop:
+        query = query.filter(ProductChange.shop == shop)
+    if fields:
+        query = query.filter(ProductChange.field.in_(list(fields)))
+    if change_types:
+        query = query.filter(ProductChange.change_type.in_(list(change_types)))
+    return query.order_by(ProductChange.id)
+
+def last_crawl_run(session, shop=None):
+    """
+    Returns the most recent finished CrawlRun (of 'shop'), or None.
+    """
+    query = session.query(CrawlRun).filter(CrawlRun.status == "finished")
+    if shop:
+        query = query.filter(CrawlRun.shop == shop)
+    return query.order_by(CrawlRun.id.desc()).first()
+
+def stale_cutoffs(session, grace=datetime.timedelta(0)):
+    """
+    Returns {shop: cutoff} for every shop with products and a finished
+    CrawlRun. A product last seen before its shop's cutoff (the start of
+    that shop's last finished run, minus 'grace') dropped out of that run.
+    Shops without a finished run are left out.
+    """
+    cutoffs = {}
+    for (shop,) in session.query(Product.shop).distinct():
+        crawl = last_crawl_run(session, shop) if shop else None
+        if crawl is not None and crawl.started_at is not None:
+            cutoffs[shop] = crawl.started_at - grace
+    return cutoffs
+
+def changed_since(session, since, shop=None):
+    """
+    Returns a query for products whose content changed at or after 'since'.
+    """
+    query = session.query(Product).filter(Product.last_changed >= since)
+    if shop:
+        query = query.filter(Product.shop == shop)
+    return query
+
+def not_seen_between(session, after, before, shop=None):
+    """
+    Returns a query for products last seen in [after, before), i.e. products
+    that dropped out of the crawl within that window.
+    """
+    query = session.query(Product).filter(Product.last_seen < before)
+    if after is not None:
+        query = query.filter(Product.last_seen >= after)
+    if shop:
+        query = query.filter(Product.shop == shop)
+    return query
+
+def last_successful_index_run(session, index_name):
+    """
+    Returns the most recent successful IndexRun for 'index_name', or None.
+    """
+    return (session.query(IndexRun)
+            .filter(IndexRun.index_name == index_name, IndexRun.status == "success")
+            .order_by(IndexRun.started_at.desc())
+            .first())
+
+# SQLite connection profiles: PRAGMAs run on every new connection.
+# "performance" uses WAL so the crawler (writer) and create_documents /
+# the indexer (readers) can work on the same DB at the same time; readers
+# see the last committed state and never block the writer.
+SQLITE_PROFILES = {
+    "default": {},  # SQLite's own defaults (rollback journal, synchronous=FULL)
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",   # safe with WAL, fsyncs only at checkpoints
+        "cache_size": -65536,      # negative = KiB, i.e. 64 MB page cache
+        "mmap_size": 268435456,    # 256 MB of the DB file memory-mapped
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,     # ms to wait for a lock instead of failing
+    },
+}
+DEFAULT_PROFILE = "performance"
+
+# (pid, db_path, profile) -> engine. Engines hold connection pools, so each
+# process creates its own and runs create_tables() on it only once.
+_engines = {}
+_engines_lock = threading.Lock()
+
+def resolve_profile(profile=None):
+    """
+    Returns the PRAGMAs of a profile, given by name (see SQLITE_PROFILES) or
+    as a dict of PRAGMAs. Defaults to $SQLITE_PROFILE, then DEFAULT_PROFILE.
+    """
+    if isinstance(profile, dict):
+        return profile
+    name = profile or os.environ.get("SQLITE_PROFILE") or DEFAULT_PROFILE
+    if name not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile {name!r}, expected one of {list(SQLITE_PROFILES)}")
+    return SQLITE_PROFILES[name]
+
+def apply_pragmas(engine, pragmas):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
 # Set up the engine and session factory
-def db_connect(db_path=None):
+def db_connect(db_path=None, profile=None):
     """
-    Creates a SQLite DB connection using the provided db_path.
-    Returns a SQLAlchemy engine.
+    Returns the SQLAlchemy engine for db_path, creating it (with the
+    profile's PRAGMAs and up-to-date tables) on first use in this process.
     """
     # default to 'sqlite:///products.db' if no path is given
     if not db_path:
         db_path = "sqlite:///products.db"
-    return create_engine(db_path)
+    pragmas = resolve_profile(profile)
+    key = (os.getpid(), db_path, tuple(sorted(pragmas.items())))
+
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = create_engine(db_path)
+            if engine.dialect.name == "sqlite" and pragmas:
+                apply_pragmas(engine, pragmas)
+            create_tables(engine)
+            _engines[key] = engine
+    return engine
 
 def create_tables(engine):
     Base.metadata.create_all(engine)
+    migrate(engine)
+
+def migrate(engine):
+    """
+    Brings a DB created by an older version of this module up to date:
+    adds missing columns (generated columns included, SQLite only allows
+    VIRTUAL ones here), backfills parsed prices, drops duplicate (shop, url)
+    rows left behind by the old insert-only pipeline and creates any missing
+    indexes.
+    """
+    inspector = inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        added_columns = set()
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_spec = CreateColumn(column).compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_spec}"))
+            added_columns.add(column.name)
+
+        if table.name == "products" and "price_amount" in added_columns:
+            backfill_prices(engine)
+
+        existing_indexes = {idx["name"] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if index.name == "uq_products_shop_url":
+                # keep the most recent row for each (shop, url)
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        "DELETE FROM products "
+                        "WHERE shop IS NOT NULL AND url IS NOT NULL "
+                        "AND id NOT IN (SELECT MAX(id) FROM products GROUP BY shop, url)"
+                    ))
+            index.create(engine)
+
+def backfill_prices(engine, batch_size=1000):
+    """
+    Fills price_amount / currency of existing rows from their price text.
+
+    Rows are read in id order, 'batch_size' at a time, and each batch is
+    updated in its own transaction, so memory stays bounded on large tables.
+    Re-running it only touches rows that are still unfilled.
+    """
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, price FROM products "
+                "WHERE id > :last_id AND price IS NOT NULL AND price_amount IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                return
+            # Rows whose price can't be parsed stay NULL; the id cursor moves past them
+            last_id = rows[-1][0]
+            updates = []
+            for row_id, price in rows:
+                amount, currency = parse_price(price)
+                if amount is not None or currency is not None:
+                    updates.append({"id": row_id, "amount": amount, "currency": currency})
+            if updates:
+                conn.execute(
+                    text("UPDATE products SET price_amount = :amount, currency = :currency WHERE id = :id"),
+                    updates,
+                )
+
 
-def get_session(db_path=None):
+def get_session(db_path=None, profile=None):
     """
-    Creates and returns a SQLAlchemy session.
+    Creates and returns a SQLAlchemy session on the shared engine for db_path.
     """
-    engine = db_connect(db_path)
-    create_tables(engine)
+    engine = db_connect(db_path, profile=profile)
     Session = sessionmaker(bind=engine)
     return Session()
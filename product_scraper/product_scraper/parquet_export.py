@@ -0,0 +1,298 @@
+"""
+parquet_export.py
+
+Columnar copy of the product catalogue: Parquet files partitioned by shop
+and crawl date (hive layout, readable by pyarrow, pandas, DuckDB, Spark):
+
+    <root>/shop=Ark/crawl_date=2024-05-01/part-<time>-<id>.parquet
+
+Every file has the standard product columns, the raw 'extras' as JSON, and
+one typed column per extra in the shop config ('extra_<name>'). An extra's
+type comes from an optional 'type' key next to its selector:
+
+    extras:
+      number_of_pages:
+        selector: "//dt[normalize-space()='Antall sider']/following-sibling::dd[1]/text()"
+        type: int        # string (default), int, float or bool
+
+Files are written by ParquetExportPipeline during a crawl (set
+PARQUET_EXPORT_DIR) or exported from the products DB with this module's CLI,
+which partitions by the date a product was last seen:
+
+  python -m product_scraper.parquet_export --out catalogue \
+      --config product_scraper/configs/ark_shop_config.yml
+
+read_products() / iter_product_batches() read them back as Arrow data.
+Requires pyarrow.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import argparse
+from urllib.parse import quote
+
+import yaml
+
+from product_scraper.models import get_session, Product, PRICE_NUMBER_RE, parse_number, utcnow
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = ds = pq = None
+
+EXTRA_TYPES = ("string", "int", "float", "bool")
+TRUE_VALUES = {"1", "true", "yes", "ja", "y"}
+FALSE_VALUES = {"0", "false", "no", "nei", "n"}
+
+# Columns every file has, before the typed extras
+BASE_COLUMNS = ("url", "product_name", "price", "price_amount", "currency", "brand",
+                "description", "extras", "crawled_at")
+PARTITION_COLUMNS = ("shop", "crawl_date")
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+
+def extra_types(config):
+    """
+    {extra name: type} from a shop config's 'extras' block.
+    """
+    types = {}
+    for name, field_config in ((config or {}).get("extras") or {}).items():
+        extra_type = field_config.get("type", "string") if isinstance(field_config, dict) else "string"
+        if extra_type not in EXTRA_TYPES:
+            raise ValueError(f"Unknown type {extra_type!r} for extra {name!r}, "
+                             f"expected one of {EXTRA_TYPES}")
+        types[name] = extra_type
+    return types
+
+
+def coerce_extra(value, extra_type):
+    """
+    Converts a scraped extra value to its configured type, or None.
+    Numbers are read from the first number in the text, e.g. '412 sider'.
+    """
+    if value is None:
+        return None
+    if extra_type == "string":
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+    if extra_type == "bool":
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+        return None
+
+    if isinstance(value, bool):
+        number = float(value)
+    elif isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        match = PRICE_NUMBER_RE.search(str(value))
+        number = parse_number(match.group()) if match else None
+    if number is None or number != number or number in (float("inf"), float("-inf")):
+        return None
+    return int(number) if extra_type == "int" else number
+
+
+def product_schema(types):
+    require_pyarrow()
+    arrow_types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_()}
+    fields = [
+        ("url", pa.string()),
+        ("product_name", pa.string()),
+        ("price", pa.string()),
+        ("price_amount", pa.float64()),
+        ("currency", pa.string()),
+        ("brand", pa.string()),
+        ("description", pa.string()),
+        ("extras", pa.string()),  # JSON
+        ("crawled_at", pa.timestamp("us")),
+    ]
+    fields += [(f"extra_{name}", arrow_types[extra_type]) for name, extra_type in types.items()]
+    return pa.schema(fields)
+
+
+def rows_to_table(rows, types, schema):
+    """
+    Builds an Arrow table from product row dicts (Product column names).
+    """
+    columns = {
+        "url": [row.get("url") for row in rows],
+        "product_name": [row.get("product_name") for row in rows],
+        "price": [None if row.get("price") is None else str(row["price"]) for row in rows],
+        "price_amount": [row.get("price_amount") for row in rows],
+        "currency": [row.get("currency") for row in rows],
+        "brand": [row.get("brand") for row in rows],
+        "description": [row.get("description") for row in rows],
+        "extras": [json.dumps(row.get("extras") or {}, ensure_ascii=False) for row in rows],
+        "crawled_at": [row.get("crawled_at") for row in rows],
+    }
+    for name, extra_type in types.items():
+        columns[f"extra_{name}"] = [coerce_extra((row.get("extras") or {}).get(name), extra_type)
+                                    for row in rows]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+class PartitionedParquetWriter:
+    """
+    Writes product rows into <root>/shop=<shop>/crawl_date=<date>/ files,
+    one open ParquetWriter per partition and a row group per 'row_group_size'
+    buffered rows.
+    """
+
+    def __init__(self, root, types_by_shop=None, row_group_size=10000, compression="zstd"):
+        require_pyarrow()
+        self.root = root
+        self.types_by_shop = types_by_shop or {}
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.run_id = f"{utcnow():%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.writers = {}
+        self.buffers = {}
+        self.rows_written = 0
+
+    def write(self, shop, crawl_date, row):
+        key = (shop, str(crawl_date))
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(row)
+        if len(buffer) >= self.row_group_size:
+            self.flush(key)
+
+    def flush(self, key):
+        rows = self.buffers.pop(key, None)
+        if not rows:
+            return
+        shop, crawl_date = key
+        types = self.types_by_shop.get(shop, {})
+        writer = self.writers.get(key)
+        if writer is None:
+            directory = os.path.join(self.root, f"shop={quote(str(shop), safe='')}",
+                                     f"crawl_date={crawl_date}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self.run_id}.parquet")
+            writer = pq.ParquetWriter(path, product_schema(types), compression=self.compression)
+            self.writers[key] = writer
+        writer.write_table(rows_to_table(rows, types, writer.schema))
+        self.rows_written += len(rows)
+
+    def close(self):
+        for key in list(self.buffers):
+            self.flush(key)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+def dataset(root):
+    """
+    A pyarrow Dataset over an export. Shops have different extras columns,
+    so the schema is the union of all file schemas.
+    """
+    require_pyarrow()
+    partitioning = ds.partitioning(
+        pa.schema([("shop", pa.string()), ("crawl_date", pa.string())]), flavor="hive"
+    )
+    files = ds.dataset(root, format="parquet", partitioning=partitioning).files
+    if not files:
+        raise FileNotFoundError(f"No Parquet files under {root}")
+    schema = pa.unify_schemas([pq.read_schema(path) for path in files]
+                              + [partitioning.schema])
+    return ds.dataset(files, schema=schema, format="parquet", partitioning=partitioning,
+                      partition_base_dir=root)
+
+
+def product_filter(shop=None, crawl_date=None):
+    expression = None
+    for column, value in (("shop", shop), ("crawl_date", crawl_date)):
+        if value is None:
+            continue
+        condition = ds.field(column) == str(value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_products(root, shop=None, crawl_date=None, columns=None):
+    """
+    Reads an export (optionally one shop and/or crawl date, and only some
+    columns) into a pyarrow Table; only the matching partitions are read.
+    """
+    return dataset(root).to_table(columns=columns, filter=product_filter(shop, crawl_date))
+
+
+def iter_product_batches(root, shop=None, crawl_date=None, columns=None, batch_size=10000):
+    """
+    Streams an export as pyarrow RecordBatches of at most 'batch_size' rows.
+    """
+    return dataset(root).to_batches(columns=columns, filter=product_filter(shop, crawl_date),
+                                    batch_size=batch_size)
+
+
+# ---------------------------------------------------------------------
+# CLI: export the products DB
+# ---------------------------------------------------------------------
+
+EXPORT_COLUMNS = ("shop", "url", "product_name", "price", "price_amount", "currency", "brand",
+                  "description", "extras", "last_seen")
+
+
+def export_db(db_path, out, types_by_shop, shop=None, batch_size=10000, row_group_size=100000):
+    """
+    Streams the products table into a partitioned export. Rows are
+    partitioned by the date they were last seen.
+    """
+    writer = PartitionedParquetWriter(out, types_by_shop, row_group_size=row_group_size)
+    session = get_session(db_path)
+    try:
+        query = session.query(*[getattr(Product, name) for name in EXPORT_COLUMNS])
+        if shop:
+            query = query.filter(Product.shop == shop)
+        for product in query.order_by(Product.id).yield_per(batch_size):
+            row = product._asdict()
+            row["crawled_at"] = row.pop("last_seen")
+            crawl_date = row["crawled_at"].date() if row["crawled_at"] else "unknown"
+            writer.write(row.pop("shop"), crawl_date, row)
+    finally:
+        writer.close()
+        session.close()
+    return writer.rows_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the products DB to partitioned Parquet.")
+    parser.add_argument("--db", default="sqlite:///products.db", help="Products DB (SQLAlchemy URL).")
+    parser.add_argument("--out", required=True, help="Output directory.")
+    parser.add_argument("--config", action="append", default=[],
+                        help="Shop YAML config with typed extras; can be repeated.")
+    parser.add_argument("--shop", help="Only export this shop.")
+    parser.add_argument("--overwrite", action="store_true", help="Delete the output directory first.")
+    args = parser.parse_args()
+
+    require_pyarrow()
+    if os.path.exists(args.out) and os.listdir(args.out):
+        if not args.overwrite:
+            parser.error(f"{args.out} is not empty; use --overwrite to replace it")
+        shutil.rmtree(args.out)
+
+    types_by_shop = {}
+    for config_file in args.config:
+        with open(config_file) as f:
+            config = yaml.safe_load(f)
+        types_by_shop[config.get("name", "unknown_shop")] = extra_types(config)
+
+    rows = export_db(args.db, args.out, types_by_shop, shop=args.shop)
+    print(f"Exported {rows} products to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
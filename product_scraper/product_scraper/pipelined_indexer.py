@@ -0,0 +1,257 @@
+"""
+pipelined_indexer.py
+
+Overlaps embedding requests and vector store upserts instead of running them
+one after the other:
+
+    document batches -> [bounded queue] -> N embedding workers
+                     -> [bounded queue] -> M upsert workers
+
+The bounded queues provide backpressure: reading from the DB stalls when the
+embedders fall behind, and embedding stalls when the upserts fall behind, so
+memory stays bounded by the queue sizes. Every call is retried with
+exponential backoff, and per-stage throughput, retry and latency metrics are
+returned by PipelinedIndexer.run().
+
+The embedder is any LangChain Embeddings object and the upserter is any
+object with an upsert(ids, vectors, documents) method, so the pipeline can be
+exercised offline with a fake embedder and InMemoryUpserter.
+"""
+
+import time
+import uuid
+import queue
+import threading
+
+# Marks the end of a queue
+_DONE = object()
+
+
+def document_id(document):
+    """
+    Stable vector id for a document: a UUID derived from its source URL, so
+    re-indexing a product overwrites its previous vector.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, document.metadata["url"]))
+
+
+class StageMetrics:
+    """
+    Thread-safe counters for one pipeline stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.retries = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.max_latency = 0.0
+
+    def record_call(self, items, latency):
+        with self.lock:
+            self.batches += 1
+            self.items += items
+            self.busy_seconds += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def as_dict(self, elapsed):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "retries": self.retries,
+            "failures": self.failures,
+            "items_per_sec": self.items / elapsed if elapsed else 0.0,
+            "avg_latency": self.busy_seconds / self.batches if self.batches else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+
+class PipelinedIndexer:
+    """
+    Embeds and upserts batches of documents with concurrent, bounded stages.
+    """
+
+    def __init__(self, embedder, upserter, embed_workers=4, upsert_workers=2,
+                 queue_size=8, max_retries=3, retry_backoff=1.0):
+        self.embedder = embedder
+        self.upserter = upserter
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    def run(self, batches):
+        """
+        Feed all batches through the pipeline and return per-stage metrics.
+        Re-raises the first error once all workers have stopped.
+        """
+        self.embed_metrics = StageMetrics("embed")
+        self.upsert_metrics = StageMetrics("upsert")
+        self.failed = threading.Event()
+        self.errors = []
+
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        upsert_queue = queue.Queue(maxsize=self.queue_size)
+
+        embedders = [
+            threading.Thread(target=self.embed_worker, args=(embed_queue, upsert_queue), daemon=True)
+            for _ in range(self.embed_workers)
+        ]
+        upserters = [
+            threading.Thread(target=self.upsert_worker, args=(upsert_queue,), daemon=True)
+            for _ in range(self.upsert_workers)
+        ]
+        for worker in embedders + upserters:
+            worker.start()
+
+        started = time.monotonic()
+        read_items = 0
+        try:
+            for batch in batches:
+                if self.failed.is_set():
+                    break
+                if batch:
+                    embed_queue.put(batch)  # blocks while the embedders are busy
+                    read_items += len(batch)
+        except BaseException:
+            # The batches generator failed: let the workers drop what's queued
+            self.failed.set()
+            raise
+        finally:
+            # Always stop the workers, or they stay blocked on the queues
+            for _ in embedders:
+                embed_queue.put(_DONE)
+            for worker in embedders:
+                worker.join()
+            for _ in upserters:
+                upsert_queue.put(_DONE)
+            for worker in upserters:
+                worker.join()
+        elapsed = time.monotonic() - started
+
+        if self.errors:
+            raise self.errors[0]
+
+        return {
+            "read": {"items": read_items, "items_per_sec": read_items / elapsed if elapsed else 0.0},
+            "embed": self.embed_metrics.as_dict(elapsed),
+            "upsert": self.upsert_metrics.as_dict(elapsed),
+            "elapsed_seconds": elapsed,
+        }
+
+    def embed_worker(self, embed_queue, upsert_queue):
+        while True:
+            batch = embed_queue.get()
+            if batch is _DONE:
+                return
+            if self.failed.is_set():
+                continue  # keep draining so the feeder never blocks
+
+            texts = [document.page_content for document in batch]
+            try:
+                vectors = self.call_with_retry(self.embed_metrics, len(batch),
+                                               self.embedder.embed_documents, texts)
+            except Exception as exc:
+                self.fail(exc)
+                continue
+            upsert_queue.put((batch, vectors))
+
+    def upsert_worker(self, upsert_queue):
+        while True:
+            work = upsert_queue.get()
+            if work is _DONE:
+                return
+            if self.failed.is_set():
+                continue
+
+            batch, vectors = work
+            ids = [document_id(document) for document in batch]
+            try:
+                self.call_with_retry(self.upsert_metrics, len(batch),
+                                     self.upserter.upsert, ids, vectors, batch)
+            except Exception as exc:
+                self.fail(exc)
+
+    def call_with_retry(self, metrics, items, func, *args):
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                result = func(*args)
+            except Exception:
+                if attempt >= self.max_retries:
+                    metrics.record_failure()
+                    raise
+                metrics.record_retry()
+                time.sleep(self.retry_backoff * 2 ** attempt)
+                attempt += 1
+                continue
+            metrics.record_call(items, time.monotonic() - started)
+            return result
+
+    def fail(self, exc):
+        self.errors.append(exc)
+        self.failed.set()
+
+
+class PineconeUpserter:
+    """
+    Writes vectors straight to a Pinecone index, using the same layout as
+    LangChain's PineconeVectorStore (document text under metadata['text']),
+    and records the ids in the record manager grouped by product URL.
+    """
+
+    def __init__(self, index, record_manager=None, text_key="text",
+                 namespace=None, batch_size=100):
+        self.index = index
+        self.record_manager = record_manager
+        self.text_key = text_key
+        self.namespace = namespace
+        self.batch_size = batch_size
+
+    def upsert(self, ids, vectors, documents):
+        for start in range(0, len(ids), self.batch_size):
+            end = start + self.batch_size
+            self.index.upsert(
+                vectors=[
+                    {
+                        "id": vector_id,
+                        "values": vector,
+                        "metadata": {**document.metadata, self.text_key: document.page_content},
+                    }
+                    for vector_id, vector, document in zip(ids[start:end], vectors[start:end],
+                                                           documents[start:end])
+                ],
+                namespace=self.namespace,
+            )
+        if self.record_manager is not None:
+            self.record_manager.update(
+                ids, group_ids=[document.metadata.get("url") for document in documents]
+            )
+
+
+class InMemoryUpserter:
+    """
+    Local stand-in for a vector store: keeps {id: (vector, document)} in a dict.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vectors = {}
+
+    def upsert(self, ids, vectors, documents):
+        with self.lock:
+            for vector_id, vector, document in zip(ids, vectors, documents):
+                self.vectors[vector_id] = (vector, document)
@@ -9,8 +9,38 @@
 
 from itemadapter import ItemAdapter
 import json
+import time
+from scrapy.exceptions import NotConfigured
 from sqlalchemy.exc import IntegrityError
-from product_scraper.models import get_session, Product
+from product_scraper.models import (get_session, Product, CrawlRun, ProductChange, DIFF_FIELDS,
+                                   SQLITE_IN_CHUNK, chunked, compute_content_hash, diff_product,
+                                   parse_price, utcnow)
+from product_scraper.parquet_export import PartitionedParquetWriter, extra_types, require_pyarrow
+
+# Signal sent by SQLitePipeline after each commit, with the (shop, url) of
+# the committed items as 'rows' (used by UniversalSpider's checkpoint)
+items_committed = object()
+
+
+def item_to_row(item):
+    """
+    Convert an item into a dict of Product column values. The price is
+    parsed into 'price_amount' / 'currency' here, once per item.
+    """
+    adapter = ItemAdapter(item)
+    price_amount, currency = parse_price(adapter.get("price"))
+    return {
+        "shop": adapter.get("shop"),
+        "url": adapter.get("url"),
+        "product_name": adapter.get("product_name"),
+        "price": adapter.get("price"),
+        "price_amount": price_amount,
+        "currency": adapter.get("currency") or currency,
+        "brand": adapter.get("brand"),
+        "description": adapter.get("description"),
+        # 'extras' is a JSON column, so we can just pass the Python dict
+        "extras": adapter.get("extras") or {},
+    }
 
 
 class ProductScraperPipeline:
@@ -20,55 +50,333 @@ class ProductScraperPipeline:
 class SQLitePipeline:
     """
     Pipeline that writes items into a SQLite database using SQLAlchemy.
+
+    Items are buffered and upserted on (shop, url) in a single transaction:
+    new products are inserted, changed products are updated and get a new
+    'last_changed', and unchanged products only get their 'last_seen' bumped.
+    A flush happens when ``batch_size`` items are pending, when an item arrives
+    more than ``flush_interval`` seconds after the previous flush, and when the
+    spider closes.
+
+    Each spider run is recorded as a CrawlRun. With ``change_log`` on, every
+    flush also appends the run's field-level diffs to ProductChange, in the
+    same transaction as the upsert (see models.changes_since).
     """
 
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, batch_size=500, flush_interval=5.0, stats=None,
+                 profile=None, change_log=True, signals=None):
         """
-        Initialize the pipeline with the database path.
+        Initialize the pipeline with the database path and batching options.
         """
         self.db_path = db_path
+        self.profile = profile
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.change_log = change_log
+        self.signals = signals
+        self.buffer = []
+        self.run = None
 
     @classmethod
     def from_crawler(cls, crawler):
         """
-        Scrapy convention: read settings to get the DB path if configured.
+        Scrapy convention: read settings to get the DB path and batching options.
         """
-        db_path = crawler.settings.get("SQLITE_DB_PATH", "sqlite:///products.db")
-        return cls(db_path)
+        settings = crawler.settings
+        db_path = settings.get("SQLITE_DB_PATH", "sqlite:///products.db")
+        return cls(
+            db_path,
+            batch_size=settings.getint("SQLITE_BATCH_SIZE", 500),
+            flush_interval=settings.getfloat("SQLITE_FLUSH_INTERVAL", 5.0),
+            stats=crawler.stats,
+            profile=settings.get("SQLITE_PROFILE"),
+            change_log=settings.getbool("SQLITE_CHANGE_LOG", True),
+            signals=crawler.signals,
+        )
 
     def open_spider(self, spider):
         """
         Called when the spider is opened. We'll set up our DB session here.
         """
-        self.session = get_session(db_path=self.db_path)
+        self.session = get_session(db_path=self.db_path, profile=self.profile)
+        self.buffer = []
+        self.items_written = 0
+        self.run_counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        self.changes_written = 0
+        self.started_at = self.last_flush = time.monotonic()
+
+        self.run = CrawlRun(
+            spider=spider.name,
+            shop=getattr(spider, "shop_name", None),
+            status="running",
+            started_at=utcnow(),
+        )
+        self.session.add(self.run)
+        self.session.commit()
 
     def close_spider(self, spider):
         """
-        Called when the spider is closed. We'll close the session here.
+        Called when the spider is closed. Flush what is left, finish the
+        crawl run and close the session.
         """
+        self.flush(spider)
+        self.run.status = "finished"
+        self.run.finished_at = utcnow()
+        self.run.items_inserted = self.run_counts["inserted"]
+        self.run.items_updated = self.run_counts["updated"]
+        self.run.items_unchanged = self.run_counts["unchanged"]
+        self.run.changes_written = self.changes_written
+        self.session.commit()
+        spider.logger.info(f"Crawl run {self.run.id}: {self.run_counts}, "
+                           f"{self.changes_written} changes logged")
         self.session.close()
 
     def process_item(self, item, spider):
         """
-        Save each item to the database.
+        Buffer each item and flush the buffer once it is full or stale.
         """
-        product = Product()
-        product.shop = item.get("shop")
-        product.url = item.get("url")
-        product.product_name = item.get("product_name")
-        product.price = item.get("price")
-        product.brand = item.get("brand")
-        product.description = item.get("description")
+        self.buffer.append(self.item_to_row(item))
 
-        # If we declared 'extras' as JSON, we can just assign the Python dict
-        # If it's Text, we might do: product.extras = json.dumps(item.get("extras", {}))
-        product.extras = item.get("extras", {})
+        if (len(self.buffer) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush(spider)
+
+        return item
+
+    def item_to_row(self, item):
+        """
+        Convert an item into a dict of Product column values.
+        """
+        return item_to_row(item)
+
+    def flush(self, spider):
+        """
+        Upsert all buffered rows in one transaction.
+
+        If the batch hits an IntegrityError, only this batch is retried
+        row by row so that a single bad item doesn't lose the rest.
+        """
+        if not self.buffer:
+            return
+
+        # Last occurrence wins if the same (shop, url) is buffered twice
+        keyed = {}
+        for row in self.buffer:
+            key = (row["shop"], row["url"]) if row["url"] else id(row)
+            keyed[key] = row
+        rows = list(keyed.values())
+        self.buffer = []
+
+        flush_started = time.monotonic()
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
 
         try:
-            self.session.add(product)
+            changes = self.upsert_rows(rows, utcnow(), counts)
             self.session.commit()
+            committed = rows
         except IntegrityError:
             self.session.rollback()
-            spider.logger.warning(f"IntegrityError on item: {item}")
+            self.inc_stat("sqlite/batch_fallbacks")
+            counts, changes, committed = self.write_rows_one_by_one(rows, spider)
+
+        written = sum(counts.values())
+        now = time.monotonic()
+        self.last_flush = now
+        self.items_written += written
+        self.changes_written += changes
+        for outcome, count in counts.items():
+            self.run_counts[outcome] += count
+            if count:
+                self.inc_stat(f"sqlite/items_{outcome}", count)
+        if changes:
+            self.inc_stat("sqlite/changes_written", changes)
+        if self.signals is not None and committed:
+            self.signals.send_catch_log(signal=items_committed, spider=spider,
+                                        rows=[(row["shop"], row["url"]) for row in committed])
+        self.record_flush_stats(written, len(rows) - written, now - flush_started, now)
+
+    def upsert_rows(self, rows, now, counts):
+        """
+        Insert new (shop, url) keys, update rows whose content hash changed and
+        only bump 'last_seen' on rows that are unchanged. Returns the number
+        of change log rows added.
+        """
+        for row in rows:
+            row["content_hash"] = compute_content_hash(row)
+
+        existing = self.load_existing(rows)
+        inserts, updates, unchanged_ids = [], [], []
+
+        for row in rows:
+            match = existing.get((row["shop"], row["url"]))
+            if match is None:
+                inserts.append(dict(row, first_seen=now, last_seen=now, last_changed=now))
+            elif match.content_hash == row["content_hash"]:
+                unchanged_ids.append(match.id)
+            else:
+                updates.append(dict(row, id=match.id, last_seen=now, last_changed=now))
+
+        # Diff against the stored rows before they are overwritten
+        changes = self.build_changes(inserts, updates, now) if self.change_log else []
+
+        if inserts:
+            self.session.bulk_insert_mappings(Product, inserts)
+        if updates:
+            self.session.bulk_update_mappings(Product, updates)
+        for chunk in chunked(unchanged_ids, SQLITE_IN_CHUNK):
+            (self.session.query(Product)
+                .filter(Product.id.in_(chunk))
+                .update({Product.last_seen: now}, synchronize_session=False))
+        if changes:
+            self.session.bulk_insert_mappings(ProductChange, changes)
+
+        counts["inserted"] += len(inserts)
+        counts["updated"] += len(updates)
+        counts["unchanged"] += len(unchanged_ids)
+        return len(changes)
+
+    def build_changes(self, inserts, updates, now):
+        """
+        Change log rows for a batch: one "new" row per inserted product, with
+        its diffed fields as 'new_value', and one "changed" row per changed
+        field of an updated product.
+        """
+        changes = []
+        for row in inserts:
+            changes.append({
+                "run_id": self.run.id, "shop": row["shop"], "url": row["url"],
+                "change_type": "new", "field": None, "old_value": None,
+                "new_value": {field: row.get(field) for field in DIFF_FIELDS},
+                "changed_at": now,
+            })
+
+        old_rows = self.load_current_values([row["id"] for row in updates])
+        for row in updates:
+            old = old_rows.get(row["id"])
+            if old is None:
+                continue
+            for field, old_value, new_value in diff_product(old, row):
+                changes.append({
+                    "run_id": self.run.id, "shop": row["shop"], "url": row["url"],
+                    "change_type": "changed", "field": field,
+                    "old_value": old_value, "new_value": new_value,
+                    "changed_at": now,
+                })
+        return changes
+
+    def load_current_values(self, ids):
+        """
+        Fetch the stored diffed fields of the given product ids, keyed by id.
+        """
+        columns = [Product.id, Product.extras] + [getattr(Product, field) for field in DIFF_FIELDS]
+        current = {}
+        for chunk in chunked(ids, SQLITE_IN_CHUNK):
+            for match in self.session.query(*columns).filter(Product.id.in_(chunk)):
+                current[match.id] = match._asdict()
+        return current
+
+    def load_existing(self, rows):
+        """
+        Fetch (id, content_hash) for rows already stored, keyed by (shop, url).
+        """
+        urls_by_shop = {}
+        for row in rows:
+            if row["url"]:
+                urls_by_shop.setdefault(row["shop"], []).append(row["url"])
+
+        existing = {}
+        for shop, urls in urls_by_shop.items():
+            for chunk in chunked(urls, SQLITE_IN_CHUNK):
+                matches = (self.session.query(Product.id, Product.url, Product.content_hash)
+                           .filter(Product.shop == shop, Product.url.in_(chunk)))
+                for match in matches:
+                    existing[(shop, match.url)] = match
+        return existing
+
+    def write_rows_one_by_one(self, rows, spider):
+        """
+        Fallback for a failed batch: commit each row on its own and skip the bad ones.
+        """
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        changes = 0
+        committed = []
+        for row in rows:
+            try:
+                row_changes = self.upsert_rows([row], utcnow(), counts)
+                self.session.commit()
+                changes += row_changes
+                committed.append(row)
+            except IntegrityError:
+                self.session.rollback()
+                spider.logger.warning(f"IntegrityError on item: {row}")
+        return counts, changes, committed
+
+    # ---------------------------------------------------------------------
+    # Crawler stats
+    # ---------------------------------------------------------------------
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
 
+    def record_flush_stats(self, written, failed, latency, now):
+        if self.stats is None:
+            return
+        self.stats.inc_value("sqlite/flushes")
+        self.stats.inc_value("sqlite/items_written", written)
+        if failed:
+            self.stats.inc_value("sqlite/items_failed", failed)
+        self.stats.inc_value("sqlite/flush_latency_total", latency)
+        self.stats.max_value("sqlite/flush_latency_max", latency)
+        self.stats.set_value("sqlite/flush_latency_last", latency)
+        elapsed = now - self.started_at
+        if elapsed > 0:
+            self.stats.set_value("sqlite/items_per_sec", self.items_written / elapsed)
+
+
+class ParquetExportPipeline:
+    """
+    Pipeline that writes items into Parquet files partitioned by shop and
+    crawl date, with the shop config's extras as typed columns (see
+    parquet_export.py). Only enabled when PARQUET_EXPORT_DIR is set.
+    """
+
+    def __init__(self, root, row_group_size=10000, stats=None):
+        require_pyarrow()
+        self.root = root
+        self.row_group_size = row_group_size
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        root = settings.get("PARQUET_EXPORT_DIR")
+        if not root:
+            raise NotConfigured("PARQUET_EXPORT_DIR is not set")
+        return cls(
+            root,
+            row_group_size=settings.getint("PARQUET_ROW_GROUP_SIZE", 10000),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self.crawl_date = utcnow().date()
+        # Typed extras come from the shop config, for spiders that have one
+        types_by_shop = {}
+        config = getattr(spider, "config", None)
+        if config:
+            types_by_shop[getattr(spider, "shop_name", None)] = extra_types(config)
+        self.writer = PartitionedParquetWriter(self.root, types_by_shop,
+                                               row_group_size=self.row_group_size)
+
+    def close_spider(self, spider):
+        self.writer.close()
+
+    def process_item(self, item, spider):
+        row = item_to_row(item)
+        row["crawled_at"] = utcnow()
+        self.writer.write(row.pop("shop"), self.crawl_date, row)
+        if self.stats is not None:
+            self.stats.inc_value("parquet/items_written")
         return item
@@ -0,0 +1,143 @@
+# playwright_pool.py
+"""
+Helpers for Playwright-rendered product pages.
+
+ResourceBlocker aborts sub-requests our selectors never need (images, fonts,
+CSS, analytics, ...) through a route handler installed before navigation via
+scrapy-playwright's 'playwright_page_init_callback'.
+
+ContextPool spreads pages over a fixed number of named browser contexts and
+retires a context after 'max_pages_per_context' pages; the retired context is
+closed as soon as its last page is done, so browser memory stays bounded no
+matter how long the crawl runs. Contexts are handed out by
+ContextPoolMiddleware when a request is downloaded, not when it is built, so
+requests waiting in the scheduler don't hold on to a context.
+"""
+
+from product_scraper.url_filter import PatternSet
+
+DEFAULT_BLOCKED_RESOURCE_TYPES = ["image", "media", "font", "stylesheet"]
+DEFAULT_BLOCKED_URL_PATTERNS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "hotjar.com",
+]
+
+# Request meta flag for the requests that take their context from the spider's ContextPool
+POOL_META_KEY = "playwright_context_pool"
+
+
+class ResourceBlocker:
+    """
+    Aborts page sub-requests by resource type or URL pattern.
+    """
+
+    def __init__(self, resource_types=None, url_patterns=None, stats=None):
+        if resource_types is None:
+            resource_types = DEFAULT_BLOCKED_RESOURCE_TYPES
+        if url_patterns is None:
+            url_patterns = DEFAULT_BLOCKED_URL_PATTERNS
+        self.resource_types = frozenset(resource_types)
+        self.url_patterns = PatternSet(url_patterns)
+        self.stats = stats
+
+    async def init_page(self, page, request):
+        """
+        Page init callback: route every sub-request through the blocker.
+        """
+        await page.route("**/*", self.handle_route)
+
+    async def handle_route(self, route):
+        sub_request = route.request
+        resource_type = sub_request.resource_type
+        # never block the document we navigate to
+        if sub_request.is_navigation_request():
+            await route.continue_()
+        elif resource_type in self.resource_types:
+            self.inc_stat(f"playwright/blocked/{resource_type}")
+            await route.abort()
+        elif self.url_patterns.match(sub_request.url) is not None:
+            self.inc_stat("playwright/blocked/url_pattern")
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+
+class ContextPool:
+    """
+    Round-robins pages over 'size' named browser contexts and recycles each
+    context after 'max_pages_per_context' pages.
+    """
+
+    def __init__(self, prefix, size=2, max_pages_per_context=100):
+        self.prefix = prefix
+        self.size = size
+        self.max_pages_per_context = max_pages_per_context
+        self.generations = [0] * size
+        self.issued = [0] * size
+        self.outstanding = {}
+        self.retired = set()
+        self.next_index = 0
+
+    def acquire(self):
+        """
+        Returns the context name to use for the next page.
+        """
+        index = self.next_index
+        self.next_index = (index + 1) % self.size
+
+        if self.issued[index] >= self.max_pages_per_context:
+            self.retired.add(self.name(index))
+            self.generations[index] += 1
+            self.issued[index] = 0
+
+        name = self.name(index)
+        self.issued[index] += 1
+        self.outstanding[name] = self.outstanding.get(name, 0) + 1
+        return name
+
+    def release(self, name):
+        """
+        Marks a page of context 'name' as done. Returns True if the context
+        is retired and has no pages left, i.e. it should be closed now.
+        """
+        remaining = self.outstanding.get(name, 0) - 1
+        if remaining > 0:
+            self.outstanding[name] = remaining
+            return False
+        self.outstanding.pop(name, None)
+        if name in self.retired:
+            self.retired.discard(name)
+            return True
+        return False
+
+    def name(self, index):
+        return f"{self.prefix}-{index}-{self.generations[index]}"
+
+
+class ContextPoolMiddleware:
+    """
+    Downloader middleware that assigns a context from the spider's
+    'context_pool' to requests with meta['playwright_context_pool'] just
+    before they are downloaded. Retries keep the context they already have,
+    unless it has since been released (and possibly closed): then they get
+    a live one.
+    """
+
+    def process_request(self, request, spider):
+        pool = getattr(spider, "context_pool", None)
+        if pool is None or not request.meta.get(POOL_META_KEY):
+            return None
+        context = request.meta.get("playwright_context")
+        if (context is not None and request.meta.get("retry_times")
+                and context not in pool.outstanding):
+            del request.meta["playwright_context"]
+        if "playwright_context" not in request.meta:
+            request.meta["playwright_context"] = pool.acquire()
+        return None
@@ -0,0 +1,318 @@
+"""
+reextract.py
+
+Re-runs a shop config over saved product pages and writes the results into
+the products DB, without a crawl and without Scrapy's engine. Pages are parsed and extracted on all cores with the same compiled
+ExtractionPlan the spider uses, so e.g. a new 'extras' field can be
+backfilled across a whole catalogue at CPU speed.
+
+Re-extraction only updates products that are already in the DB (see
+ProductUpdater): it doesn't insert products, bump 'last_seen' or record a
+crawl run, so an old archive can't bring delisted products back.
+
+Pages can come from:
+  - a directory of .html / .htm files (searched recursively),
+  - a .zip or .tar(.gz/.bz2/.xz) archive of such files,
+  - an HTTP cache file written by SQLiteZstdCacheStorage (HTTPCACHE_DIR/<shop>.sqlite).
+
+The URL of a saved file is taken from --manifest (a CSV of path,url rows,
+paths relative to the directory or as named in the archive) and otherwise
+from the page's <link rel="canonical"> or og:url. Cached responses carry
+their own URL.
+
+Usage (from the directory containing the product_scraper package):
+
+  python -m product_scraper.reextract product_scraper/configs/ark_shop_config.yml pages.zip
+  python -m product_scraper.reextract CONFIG httpcache/ark.sqlite --db sqlite:///products.db
+"""
+
+import os
+import csv
+import time
+import tarfile
+import zipfile
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from scrapy.http import HtmlResponse
+
+from product_scraper.items import ProductScraperItem
+from product_scraper.models import Product, SQLITE_IN_CHUNK, compute_content_hash, get_session, utcnow
+from product_scraper.pipelines import item_to_row
+from product_scraper.extraction import canonical_url, init_worker, extract_root_in_worker
+from product_scraper.httpcache import iter_cached_responses
+from product_scraper.spiders.universal_spider import UniversalSpider
+
+HTML_SUFFIXES = (".html", ".htm")
+SQLITE_MAGIC = b"SQLite format 3\0"
+
+
+# ---------------------------------------------------------------------
+# Page sources: each yields (name, url or None, headers or None, body)
+# ---------------------------------------------------------------------
+
+def load_manifest(path):
+    """
+    Reads a CSV of path,url rows into {path: url}.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row[0].strip(): row[1].strip() for row in csv.reader(f) if len(row) >= 2}
+
+
+def is_cache_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def iter_directory(path, manifest):
+    for dirpath, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(HTML_SUFFIXES):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            name = os.path.relpath(full_path, path).replace(os.sep, "/")
+            with open(full_path, "rb") as f:
+                yield name, manifest.get(name), None, f.read()
+
+
+def iter_zip(path, manifest):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(HTML_SUFFIXES):
+                continue
+            yield info.filename, manifest.get(info.filename), None, archive.read(info)
+
+
+def iter_tar(path, manifest):
+    with tarfile.open(path) as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(HTML_SUFFIXES):
+                continue
+            yield member.name, manifest.get(member.name), None, archive.extractfile(member).read()
+
+
+def iter_cache(path):
+    for url, headers, body in iter_cached_responses(path):
+        # The cache also holds sitemaps and API responses
+        content_type = b"".join(headers.get(b"Content-Type", []))
+        if b"html" in content_type.lower():
+            yield url, url, headers, body
+
+
+def iter_pages(source, manifest=None):
+    manifest = manifest or {}
+    if os.path.isdir(source):
+        return iter_directory(source, manifest)
+    if is_cache_file(source):
+        return iter_cache(source)
+    if zipfile.is_zipfile(source):
+        return iter_zip(source, manifest)
+    if tarfile.is_tarfile(source):
+        return iter_tar(source, manifest)
+    raise ValueError(f"{source} is not a directory, zip/tar archive or HTTP cache file")
+
+
+def chunked(iterable, size):
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ---------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------
+
+def extract_pages(pages):
+    """
+    Worker task: parse and extract a chunk of pages. Returns a list of
+    (name, url, fields, error) tuples.
+    """
+    results = []
+    for name, url, headers, body in pages:
+        try:
+            # Decode the same way the spider does (headers, <meta charset>, BOM)
+            response = HtmlResponse(url=url or f"file:///{name}", headers=headers, body=body)
+            root = response.selector.root
+            results.append((name, url or canonical_url(root), extract_root_in_worker(root), None))
+        except Exception as exc:
+            results.append((name, url, None, repr(exc)))
+    return results
+
+
+# ---------------------------------------------------------------------
+# Main process
+# ---------------------------------------------------------------------
+
+class ProductUpdater:
+    """
+    Update-only writer for re-extracted items. Rewrites the extracted fields
+    and content hash of products already stored under (shop, url), in
+    batches; 'last_changed' is set when the content hash changes, so the
+    indexer picks the product up. Unknown URLs are skipped, and 'last_seen',
+    'first_seen' and crawl runs are never touched.
+    """
+
+    def __init__(self, db_path=None, batch_size=500, profile=None):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.profile = profile
+        self.buffer = []
+        self.counts = Counter()
+
+    def open(self):
+        self.session = get_session(db_path=self.db_path, profile=self.profile)
+
+    def close(self):
+        self.flush()
+        self.session.close()
+
+    def add(self, item):
+        self.buffer.append(item_to_row(item))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        # Last occurrence wins if the same (shop, url) is buffered twice
+        rows = list({(row["shop"], row["url"]): row for row in self.buffer}.values())
+        self.buffer = []
+
+        existing = self.load_existing(rows)
+        now = utcnow()
+        updates = []
+        for row in rows:
+            match = existing.get((row["shop"], row["url"]))
+            if match is None:
+                self.counts["missing"] += 1
+                continue
+            row["content_hash"] = compute_content_hash(row)
+            if match.content_hash == row["content_hash"]:
+                self.counts["unchanged"] += 1
+                continue
+            updates.append(dict(row, id=match.id, last_changed=now))
+
+        if updates:
+            self.session.bulk_update_mappings(Product, updates)
+            self.session.commit()
+        self.counts["updated"] += len(updates)
+
+    def load_existing(self, rows):
+        """
+        Fetch (id, content_hash) for rows already stored, keyed by (shop, url).
+        """
+        urls_by_shop = {}
+        for row in rows:
+            urls_by_shop.setdefault(row["shop"], []).append(row["url"])
+
+        existing = {}
+        for shop, urls in urls_by_shop.items():
+            for start in range(0, len(urls), SQLITE_IN_CHUNK):
+                matches = (self.session.query(Product.id, Product.url, Product.content_hash)
+                           .filter(Product.shop == shop,
+                                   Product.url.in_(urls[start:start + SQLITE_IN_CHUNK])))
+                for match in matches:
+                    existing[(shop, match.url)] = match
+        return existing
+
+
+class Reextractor:
+    """
+    Feeds page chunks to a process pool, at most 'max_inflight' chunks at a
+    time so memory stays bounded, and writes the items through 'writer'
+    (a ProductUpdater).
+    """
+
+    def __init__(self, spider, writer, processes=None, chunk_size=32, max_inflight=None):
+        self.spider = spider
+        self.writer = writer
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_inflight = max_inflight or self.processes * 2
+        self.counts = Counter()
+
+    def run(self, pages):
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker,
+                                 initargs=(self.spider.config,)) as pool:
+            inflight = set()
+            for chunk in chunked(pages, self.chunk_size):
+                if len(inflight) >= self.max_inflight:
+                    done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.write_results(future.result())
+                inflight.add(pool.submit(extract_pages, chunk))
+
+            for future in wait(inflight).done:
+                self.write_results(future.result())
+        return self.counts
+
+    def write_results(self, results):
+        for name, url, fields, error in results:
+            self.counts["pages"] += 1
+            if error is not None:
+                self.counts["failed"] += 1
+                self.spider.logger.warning(f"Failed to extract {name}: {error}")
+                continue
+            if not url:
+                self.counts["no_url"] += 1
+                continue
+            if self.spider.url_filter.rejection(url) is not None:
+                self.counts["filtered"] += 1
+                continue
+
+            item = ProductScraperItem()
+            item['shop'] = self.spider.shop_name
+            item['url'] = url
+            item['product_name'] = fields['product_name']
+            item['price'] = fields['price']
+            item['currency'] = self.spider.currency
+            item['brand'] = fields['brand']
+            item['description'] = fields['description']
+            item['extras'] = fields['extras']
+            self.writer.add(item)
+            self.counts["items"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-extract saved product pages with a shop config and update the products already in the DB."
+    )
+    parser.add_argument("config_file", help="Shop YAML config.")
+    parser.add_argument("source", help="Directory, zip/tar archive or HTTP cache file of saved pages.")
+    parser.add_argument("--manifest", help="CSV of path,url rows for saved files.")
+    parser.add_argument("--db", default="sqlite:///products.db", help="Products DB (SQLAlchemy URL).")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Worker processes (default: number of CPUs).")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Pages per worker task.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Items per DB flush.")
+    args = parser.parse_args()
+
+    spider = UniversalSpider(config_file=args.config_file, incremental="false")
+    manifest = load_manifest(args.manifest) if args.manifest else None
+    writer = ProductUpdater(args.db, batch_size=args.batch_size)
+
+    started = time.monotonic()
+    writer.open()
+    try:
+        counts = Reextractor(spider, writer, processes=args.processes,
+                             chunk_size=args.chunk_size).run(iter_pages(args.source, manifest))
+    finally:
+        writer.close()
+    elapsed = time.monotonic() - started
+
+    print(f"{counts['pages']} pages in {elapsed:.1f}s "
+          f"({counts['pages'] / elapsed if elapsed else 0.0:.0f} pages/s): "
+          f"{counts['items']} items, {counts['no_url']} without URL, "
+          f"{counts['filtered']} filtered, {counts['failed']} failed; "
+          f"{writer.counts['updated']} updated, {writer.counts['unchanged']} unchanged, "
+          f"{writer.counts['missing']} not in the DB (skipped)")
+
+
+if __name__ == "__main__":
+    main()
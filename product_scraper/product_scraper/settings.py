@@ -20,7 +20,8 @@ NEWSPIDER_MODULE = "product_scraper.spiders"
 ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# Raised so that the per-shop adaptive ceilings below are the binding limit
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -50,15 +51,69 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "product_scraper.middlewares.ProductScraperDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    # Above RetryMiddleware (550): process_response/process_exception run in
+    # decreasing order, so the adaptive throttle sees 429s, 5xx and timeouts
+    # before they are retried
+    "product_scraper.middlewares.ProductScraperDownloaderMiddleware": 560,
+    # Assigns pooled Playwright contexts at download time; after the
+    # middlewares that may still drop the request
+    "product_scraper.playwright_pool.ContextPoolMiddleware": 950,
+}
 
+# Adaptive per-shop concurrency (ProductScraperDownloaderMiddleware).
+# Shop YAMLs can override these with a 'throttle' block, e.g.
+#   throttle: {min_concurrency: 2, max_concurrency: 8, target_latency: 1.5}
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 16
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0             # p95 seconds, plain HTTP
+ADAPTIVE_CONCURRENCY_PLAYWRIGHT_TARGET_LATENCY = 8.0  # p95 seconds, rendered pages
+ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.05            # share of 429/5xx/exceptions
+ADAPTIVE_CONCURRENCY_WINDOW = 50
+ADAPTIVE_CONCURRENCY_ADJUST_EVERY = 20
+
+# scrapy-playwright only renders requests with meta["playwright"] = True and
+# hands everything else to Scrapy's plain HTTP handler. Shop configs opt in
+# with 'render: playwright' (see UniversalSpider.render_meta).
 DOWNLOAD_HANDLERS = {
     "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
     "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
 }
 
+# Bound browser memory: at most this many contexts, each with at most this
+# many concurrent pages. UniversalSpider recycles its contexts after a number
+# of pages (see playwright_pool.ContextPool), so keep room for the retiring ones.
+PLAYWRIGHT_MAX_CONTEXTS = 4
+PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = 4
+
+# UniversalSpider: run HTML parsing and field extraction in this many worker
+# processes instead of on the reactor thread (0 = in-process). At most
+# EXTRACTION_MAX_INFLIGHT pages (default: 4 per process) are queued at once.
+EXTRACTION_PROCESSES = 0
+#EXTRACTION_MAX_INFLIGHT = 16
+
+# De-duplicate requests on their canonical URL (tracking parameters and
+# fragments dropped) with a Bloom filter of a few MB instead of a set of
+# fingerprints (see dupefilter.py). DUPEFILTER_MODE = "cross_run" also skips
+# product pages fetched by earlier runs, remembered in DUPEFILTER_DIR/<shop>.bloom
+# (pages incremental crawling knows are re-checked rather than skipped).
+DUPEFILTER_CLASS = "product_scraper.dupefilter.BloomDupeFilter"
+DUPEFILTER_MODE = "run"
+DUPEFILTER_CAPACITY = 2_000_000  # requests; ~5 MB at the default error rate
+DUPEFILTER_ERROR_RATE = 1e-4
+#DUPEFILTER_DIR = "dupefilter"
+
+# UniversalSpider checkpoints its sitemap cursors, pending and completed
+# product URLs to CHECKPOINT_DIR/<shop>.sqlite every CHECKPOINT_INTERVAL
+# seconds. An interrupted crawl resumes from there (-a resume=false starts
+# over); a crawl that finishes deletes its checkpoint. See checkpoint.py.
+CHECKPOINT_ENABLED = True
+CHECKPOINT_INTERVAL = 30.0
+# Failed product fetches are retried by resumed runs up to this many attempts
+CHECKPOINT_MAX_ATTEMPTS = 3
+#CHECKPOINT_DIR = "checkpoints"
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
@@ -69,9 +124,29 @@ DOWNLOAD_HANDLERS = {
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     "product_scraper.pipelines.SQLitePipeline": 300,
+    "product_scraper.pipelines.ParquetExportPipeline": 400,
    #"product_scraper.pipelines.ProductScraperPipeline": 300,
 }
 
+# SQLitePipeline: database location and batched writes.
+# Items are bulk-inserted once SQLITE_BATCH_SIZE are pending or
+# SQLITE_FLUSH_INTERVAL seconds have passed since the last flush.
+SQLITE_DB_PATH = "sqlite:///products.db"
+SQLITE_BATCH_SIZE = 500
+SQLITE_FLUSH_INTERVAL = 5.0
+# Connection PRAGMAs, see models.SQLITE_PROFILES. "performance" enables WAL
+# so create_documents / the indexer can read while a crawl is writing.
+SQLITE_PROFILE = "performance"
+# Append field-level diffs of every run to the product_changes table
+# (see models.changes_since); runs are recorded in crawl_runs either way.
+SQLITE_CHANGE_LOG = True
+
+# ParquetExportPipeline: also write items to Parquet, partitioned as
+# <dir>/shop=<shop>/crawl_date=<YYYY-MM-DD>/ (requires pyarrow).
+# Disabled while PARQUET_EXPORT_DIR is unset.
+#PARQUET_EXPORT_DIR = "catalogue"
+#PARQUET_ROW_GROUP_SIZE = 10000
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -87,11 +162,17 @@ ITEM_PIPELINES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+# The SQLite storage keeps compressed, de-duplicated bodies in one file per
+# shop and also caches Playwright-rendered pages. To replay a crawl offline,
+# e.g. while tuning selectors:
+#   scrapy crawl universal_spider -a config_file=... -a incremental=false \
+#       -s HTTPCACHE_ENABLED=True -s HTTPCACHE_IGNORE_MISSING=True
 #HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
 #HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+#HTTPCACHE_IGNORE_HTTP_CODES = [500, 502, 503, 504]
+HTTPCACHE_STORAGE = "product_scraper.httpcache.SQLiteZstdCacheStorage"
+#HTTPCACHE_ZSTD_LEVEL = 3
 
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
@@ -0,0 +1,88 @@
+# sitemaps.py
+"""
+Incremental sitemap reader.
+
+Sitemaps are read with lxml.etree.iterparse straight from the response bytes,
+so the body is never decoded to one big str and no full DOM is built: each
+<url> / <sitemap> entry is yielded as soon as it has been parsed and is then
+discarded, keeping memory bounded by a single entry. Gzipped sitemaps
+(.xml.gz) are decompressed on the fly, up to 'max_size' bytes (like Scrapy's
+DOWNLOAD_MAXSIZE for gunzipped sitemaps), so a gzip bomb can't exhaust memory.
+
+Malformed XML is parsed in recovery mode: a broken entry is skipped or
+repaired by lxml instead of ending the whole sitemap.
+"""
+
+import io
+import gzip
+from collections import namedtuple
+
+from lxml import etree
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# kind is "url" for <urlset> entries and "sitemap" for <sitemapindex> entries
+SitemapEntry = namedtuple("SitemapEntry", ["kind", "loc", "lastmod"])
+
+
+class SitemapTooLarge(ValueError):
+    """
+    Raised when a gzipped sitemap decompresses to more than 'max_size' bytes.
+    """
+
+
+class SizeLimitedReader:
+    """
+    File-like wrapper that raises SitemapTooLarge once more than 'max_size'
+    bytes have been read from 'stream'.
+    """
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise SitemapTooLarge(f"decompressed sitemap is larger than {self.max_size} bytes")
+        return data
+
+
+def iter_sitemap(body, max_size=0):
+    """
+    Yields a SitemapEntry for every <url> or <sitemap> element in a sitemap
+    or sitemap index, in document order. Entries without a <loc> are skipped.
+
+    Gzipped bodies are decompressed up to 'max_size' bytes (0 = no limit).
+    Raises SitemapTooLarge above that, and OSError / EOFError for a corrupt
+    or truncated gzip stream.
+    """
+    stream = io.BytesIO(body)
+    if body[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream)
+        if max_size:
+            stream = SizeLimitedReader(stream, max_size)
+
+    context = etree.iterparse(
+        stream,
+        events=("end",),
+        tag=("{*}url", "{*}sitemap"),
+        resolve_entities=False,
+        no_network=True,
+        huge_tree=True,
+        recover=True,
+    )
+    for _, element in context:
+        loc = (element.findtext("{*}loc") or "").strip()
+        lastmod = (element.findtext("{*}lastmod") or "").strip()
+        kind = etree.QName(element).localname
+
+        # Drop the parsed entry and everything before it
+        element.clear(keep_tail=False)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+        if loc:
+            yield SitemapEntry(kind, loc, lastmod or None)
@@ -1,23 +1,92 @@
-import scrapy
+import io
 import json
+import hashlib
+from decimal import Decimal
+import scrapy
+from w3lib.url import add_or_replace_parameters
 from product_scraper.items import ProductScraperItem
+from product_scraper.fetch_state import FetchStateStore
+from product_scraper.pipelines import items_committed
+
+try:
+    import ijson  # optional: parse listing pages incrementally
+except ImportError:
+    ijson = None
+
+LISTING_ERRORS = (json.JSONDecodeError,) + ((ijson.JSONError,) if ijson else ())
+
+# Listing fields that feed the stored product (see parse_product), plus
+# stock; other listing data (images, badges, sort positions) is ignored
+LISTING_FINGERPRINT_FIELDS = (
+    "displayName",
+    "price",
+    "brandInfo.brandName",
+    "trackingProduct.category",
+    "colorName",
+    "inStock",
+    "stockStatus",
+)
+
+
+def listing_field(product, path):
+    value = product
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def normalize_numbers(value):
+    """
+    ijson yields Decimal and json yields float/int; 199, 199.0 and
+    Decimal("199.00") all become "199". Nested dicts and lists are walked.
+    """
+    if isinstance(value, dict):
+        return {key: normalize_numbers(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize_numbers(item) for item in value]
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+        return value
+    return format(Decimal(str(value)).normalize(), "f")
+
 
 class BarnasHusSpider(scrapy.Spider):
     name = "barnashus_api"
     allowed_domains = ["barnashus.no"]
-    start_urls = [
-            "https://www.barnashus.no/barneklar?count=99999",
-            "https://www.barnashus.no/barnevogn?count=99999",
-            "https://www.barnashus.no/bilstol?count=99999",
-            "https://www.barnashus.no/barnesko?count=99999",
-            "https://www.barnashus.no/barnerommet?count=99999",
-            "https://www.barnashus.no/ut-pa-tur?count=99999",
-            "https://www.barnashus.no/utstyr-til-barn-og-baby?count=99999",
-            "https://www.barnashus.no/mamma?count=99999",
-            "https://www.barnashus.no/lek-og-fritid?count=99999",
+    # Category listings are paged through with ?count=<page_size>&page=<n>
+    # until a page returns fewer than page_size products.
+    category_urls = [
+            "https://www.barnashus.no/barneklar",
+            "https://www.barnashus.no/barnevogn",
+            "https://www.barnashus.no/bilstol",
+            "https://www.barnashus.no/barnesko",
+            "https://www.barnashus.no/barnerommet",
+            "https://www.barnashus.no/ut-pa-tur",
+            "https://www.barnashus.no/utstyr-til-barn-og-baby",
+            "https://www.barnashus.no/mamma",
+            "https://www.barnashus.no/lek-og-fritid",
             ]
+    page_size = 100
+    page_param = "page"
+    max_pages = 500
 
+    # Incremental mode: only request product details for products that are
+    # new or whose listing entry changed since the last crawl. Disable with
+    # -a incremental=false to re-fetch everything.
+    incremental = True
+    shop_name = "barnashus"
+
+    # Per-shop limits for the adaptive concurrency middleware
+    throttle_config = {"min_concurrency": 1, "max_concurrency": 8}
+
+    # The listing and product endpoints return JSON, so no browser is needed:
+    # use Scrapy's plain HTTP handler instead of the project-wide Playwright one.
     custom_settings = {
+        "DOWNLOAD_HANDLERS": {
+            "http": "scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler",
+            "https": "scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler",
+        },
         "DEFAULT_REQUEST_HEADERS": {
             "x-requested-with": "XMLHttpRequest",
             "Accept": "application/json, text/javascript, */*; q=0.01",
@@ -27,40 +96,122 @@ class BarnasHusSpider(scrapy.Spider):
         },
     }
 
-    def parse(self, response):
-        self.logger.info(f"Status code: {response.status}")
-        self.logger.debug(f"Body snippet: {response.text[:200]!r}")
+    def __init__(self, incremental=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if incremental is not None:
+            self.incremental = str(incremental).lower() in ("1", "true", "yes", "on")
+        self.fetch_state = None
+        # First product URL of the last page seen per category
+        self.last_page_heads = {}
+
+    def start_requests(self):
+        if self.incremental:
+            db_path = self.settings.get("SQLITE_DB_PATH", "sqlite:///products.db")
+            self.fetch_state = FetchStateStore(db_path, self.shop_name,
+                                               profile=self.settings.get("SQLITE_PROFILE"))
+            self.crawler.signals.connect(self.items_committed, signal=items_committed)
+
+        for category_url in self.category_urls:
+            yield self.listing_request(category_url, page=1)
+
+    def listing_request(self, category_url, page):
+        url = add_or_replace_parameters(category_url, {
+            "count": str(self.page_size),
+            self.page_param: str(page),
+        })
+        return scrapy.Request(
+            url=url,
+            callback=self.parse,
+            cb_kwargs={"category_url": category_url, "page": page},
+        )
+
+    def iter_listing_products(self, response):
+        """
+        Yields the entries of the listing's "products" array, streaming them
+        with ijson when it is installed.
+        """
+        if ijson is not None:
+            yield from ijson.items(io.BytesIO(response.body), "products.item")
+        else:
+            yield from json.loads(response.text).get("products", [])
+
+    def parse(self, response, category_url=None, page=1):
         """
         Step 1:
-        - Parse the JSON from https://www.barnashus.no/barneklar
+        - Parse one page of a category listing, e.g. https://www.barnashus.no/barneklar?count=100&page=1
         - Extract the product URLs from the products array
-        - Yield new requests (to the product detail endpoint)
+        - Yield new requests (to the product detail endpoint), once per product URL
+        - Request the next page while pages come back full
         """
+        self.logger.info(f"Status code: {response.status} ({category_url}, page {page})")
+        self.logger.debug(f"Body snippet: {response.body[:200]!r}")
+
+        listed = 0
+        page_head = None
         try:
-            data = json.loads(response.text)  # or response.json() in newer Scrapy versions
-        except json.JSONDecodeError:
-            self.logger.error("Failed to decode JSON from the products endpoint.")
+            for product in self.iter_listing_products(response):
+                listed += 1
+                relative_url = product.get("url")
+                if not relative_url:
+                    continue
+
+                # Build a full URL if needed. In some cases, relative_url already
+                # starts with /, so let's be safe:
+                product_url = response.urljoin(relative_url)
+                if page_head is None:
+                    page_head = product_url
+
+                # Skip the detail request if the listing entry is unchanged
+                fingerprint = self.listing_fingerprint(product)
+                if (self.fetch_state is not None
+                        and self.fetch_state.fingerprint_unchanged(product_url, fingerprint)):
+                    self.fetch_state.mark_seen(product_url)
+                    self.crawler.stats.inc_value("incremental/skipped_listing_unchanged")
+                    continue
+
+                yield scrapy.Request(
+                    url=product_url,
+                    headers={
+                        "x-requested-with": "XMLHttpRequest",
+                        "Accept": "application/json, text/javascript, */*; q=0.01",
+                        "User-Agent": "Mozilla/5.0 ...",
+                    },
+                    callback=self.parse_product,
+                    # Products listed in several categories are only fetched
+                    # once; BloomDupeFilter drops the repeats (and, in cross_run
+                    # mode, products fetched by earlier runs that the fetch
+                    # state doesn't track: those are skipped by fingerprint)
+                    meta={"listing_url": product_url, "listing_fingerprint": fingerprint,
+                          "dupefilter_persist": (self.fetch_state is None
+                                                 or not self.fetch_state.is_known(product_url))},
+                )
+        except LISTING_ERRORS:
+            self.logger.error(f"Failed to decode JSON from the products endpoint: {response.url}")
             return
 
-        products = data.get("products", [])
-        for product in products:
-            relative_url = product.get("url")
-            if not relative_url:
-                continue
-
-            # Build a full URL if needed. In some cases, relative_url already 
-            # starts with /, so let's be safe:
-            product_url = response.urljoin(relative_url)
-
-            yield scrapy.Request(
-                url=product_url,
-                headers={
-                    "x-requested-with": "XMLHttpRequest",
-                    "Accept": "application/json, text/javascript, */*; q=0.01",
-                    "User-Agent": "Mozilla/5.0 ...",
-                },
-                callback=self.parse_product
-            )
+        self.crawler.stats.inc_value("barnashus/listing_pages")
+
+        # A short page is the last one. Also stop if the site ignored the page
+        # parameter and returned the previous page again, to avoid looping.
+        previous_head = self.last_page_heads.get(category_url)
+        self.last_page_heads[category_url] = page_head
+        if listed < self.page_size or (page > 1 and page_head == previous_head):
+            return
+        if page >= self.max_pages:
+            self.logger.warning(f"Stopped paging {category_url} at max_pages={self.max_pages}")
+            return
+        yield self.listing_request(category_url, page + 1)
+
+    def listing_fingerprint(self, product):
+        """
+        Hash of the listing fields in LISTING_FINGERPRINT_FIELDS, with numbers
+        normalized so json and ijson agree; a change means the product
+        details need to be fetched again.
+        """
+        fields = {path: normalize_numbers(listing_field(product, path))
+                  for path in LISTING_FINGERPRINT_FIELDS}
+        payload = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
     def parse_product(self, response):
         """
@@ -86,6 +237,7 @@ class BarnasHusSpider(scrapy.Spider):
                         .get("current", {})
                         .get("inclVat")
         )
+        item["currency"] = "NOK"
 
         # brand name
         brand_info = product_data.get("brandInfo", {})
@@ -107,5 +259,23 @@ class BarnasHusSpider(scrapy.Spider):
         # Color
         item["extras"]["color"] = product_data.get("colorName")
 
+        if self.fetch_state is not None:
+            # Recorded once SQLitePipeline has committed the item
+            self.fetch_state.await_commit(
+                response.url, response.meta.get("listing_url", response.url),
+                fingerprint=response.meta.get("listing_fingerprint"),
+            )
+
 
         yield item
+
+    def items_committed(self, rows, spider):
+        if self.fetch_state is not None:
+            self.fetch_state.items_committed([url for shop, url in rows if shop == self.shop_name])
+
+    def closed(self, reason):
+        """
+        Write the remaining fetch state back to the DB.
+        """
+        if self.fetch_state is not None:
+            self.fetch_state.close()
@@ -1,15 +1,65 @@
 import os
 import yaml
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import scrapy
-from scrapy import Selector
+from scrapy import signals
+from scrapy.utils.project import data_path
+from lxml import etree
 from product_scraper.items import ProductScraperItem
+from product_scraper.fetch_state import FetchStateStore
+from product_scraper.checkpoint import CrawlCheckpoint
+from product_scraper.dupefilter import canonicalize_url
+from product_scraper.pipelines import items_committed
+from product_scraper.sitemaps import SitemapTooLarge, iter_sitemap
+from product_scraper.url_filter import UrlFilter
+from product_scraper.extraction import ExtractionPlan, init_worker, extract_in_worker
+from product_scraper.playwright_pool import POOL_META_KEY, ContextPool, ResourceBlocker
 from scrapy_playwright.page import PageMethod
 
 
+RENDER_MODES = ("http", "playwright")
+REQUEST_KINDS = ("sitemap", "product")
+
+
 class UniversalSpider(scrapy.Spider):
+    """
+    Crawls a shop's product sitemaps and extracts products with the
+    selectors of a YAML config (see configs/), passed as -a config_file=...
+
+    Besides 'name', 'currency', 'sitemap_url' / 'sitemap_urls', 'selectors'
+    and 'extras', a config may set:
+
+        ignore_patterns   URLs to skip: substrings, or regexes prefixed
+                          with "re:" (see url_filter.py)
+        include_patterns  if given, only crawl URLs matching one of these
+        render            how pages are downloaded: "http" (default) or
+                          "playwright" (headless browser, only for pages
+                          that need JavaScript). Can also be set per request
+                          kind, e.g. {sitemap: http, product: playwright}
+        playwright        only used for rendered pages, all keys optional:
+                            block_resource_types   sub-requests to abort, e.g.
+                                                   [image, media, font, stylesheet]
+                            block_url_patterns     sub-request URLs to abort, as
+                                                   substrings or "re:" regexes
+                            wait_for               selector to wait for before
+                                                   reading the HTML
+                            contexts               reusable browser contexts (2)
+                            max_pages_per_context  recycle a context after this
+                                                   many pages (100)
+        throttle          adaptive concurrency limits, see
+                          ProductScraperDownloaderMiddleware (defaults in
+                          settings.py): min_concurrency, max_concurrency,
+                          target_latency and playwright_target_latency (p95
+                          seconds), max_error_rate (share of 429/5xx
+                          responses and errors)
+        incremental       skip product pages whose sitemap <lastmod> hasn't
+                          changed and re-validate the rest with
+                          ETag/Last-Modified (default: true)
+    """
     name = "universal_spider"
 
-    def __init__(self, config_file=None, *args, **kwargs):
+    def __init__(self, config_file=None, incremental=None, resume=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         if not config_file:
@@ -20,6 +70,7 @@ class UniversalSpider(scrapy.Spider):
             self.config = yaml.safe_load(f)
 
         self.shop_name = self.config.get("name", "unknown_shop")
+        self.currency = self.config.get("currency")
         
         # Try to get a list of sitemap URLs; if not provided, fallback to a single sitemap_url.
         self.sitemap_urls = self.config.get("sitemap_urls")
@@ -29,67 +80,415 @@ class UniversalSpider(scrapy.Spider):
                 raise ValueError("No 'sitemap_url' or 'sitemap_urls' found in config.")
             self.sitemap_urls = [sitemap_url]
 
-        # Optional ignore patterns
+        # Selectors are compiled once into an extraction plan
+        self.plan = ExtractionPlan(self.config)
+
+        # Optional ignore / include patterns (substrings or "re:" regexes),
+        # compiled once into a single filter
         self.ignore_patterns = self.config.get("ignore_patterns", [])
+        self.include_patterns = self.config.get("include_patterns", [])
+        self.url_filter = UrlFilter(self.ignore_patterns, self.include_patterns)
+
+        # How each kind of request is downloaded: plain HTTP or a Playwright page
+        self.render = self.load_render_modes(self.config.get("render", "http"))
+
+        # Resource blocking and context recycling for rendered pages
+        self.playwright_config = self.config.get("playwright") or {}
+        self.resource_blocker = None
+        self.context_pool = None
+
+        # Per-shop concurrency floor/ceiling and latency targets, read by
+        # ProductScraperDownloaderMiddleware
+        self.throttle_config = self.config.get("throttle", {})
+
+        # Incremental mode: skip pages whose sitemap <lastmod> is unchanged and
+        # send conditional requests for the rest. Can be overridden with
+        # -a incremental=false, e.g. to force a full re-crawl.
+        if incremental is None:
+            self.incremental = bool(self.config.get("incremental", True))
+        else:
+            self.incremental = str(incremental).lower() in ("1", "true", "yes", "on")
+        self.fetch_state = None
+        self.extraction_pool = None
+
+        # Checkpointing: an interrupted crawl resumes from its checkpoint
+        # unless started with -a resume=false (see checkpoint.py)
+        self.resume = resume is None or str(resume).lower() in ("1", "true", "yes", "on")
+        self.checkpoint = None
+        # Canonical URL -> sitemap <loc> of this run's product requests, to
+        # tell real duplicates from other dropped requests
+        self.canonical_locs = {}
 
     def start_requests(self):
         """
         For each sitemap URL provided, send a request to fetch it.
         """
-        for url in self.sitemap_urls:
-            yield scrapy.Request(
-                url=url,
-                callback=self.parse_sitemap
+        if self.incremental:
+            db_path = self.settings.get("SQLITE_DB_PATH", "sqlite:///products.db")
+            self.fetch_state = FetchStateStore(db_path, self.shop_name,
+                                               profile=self.settings.get("SQLITE_PROFILE"))
+
+        # Optionally run HTML parsing + extraction in worker processes
+        processes = self.settings.getint("EXTRACTION_PROCESSES", 0)
+        if processes > 0:
+            self.extraction_pool = ProcessPoolExecutor(
+                max_workers=processes, initializer=init_worker, initargs=(self.config,)
+            )
+            max_inflight = self.settings.getint("EXTRACTION_MAX_INFLIGHT", processes * 4)
+            self.extraction_slots = asyncio.Semaphore(max_inflight)
+
+        if "playwright" in self.render.values():
+            self.resource_blocker = ResourceBlocker(
+                self.playwright_config.get("block_resource_types"),
+                self.playwright_config.get("block_url_patterns"),
+                stats=self.crawler.stats,
             )
+        if self.render["product"] == "playwright":
+            self.context_pool = ContextPool(
+                prefix=self.shop_name,
+                size=self.playwright_config.get("contexts", 2),
+                max_pages_per_context=self.playwright_config.get("max_pages_per_context", 100),
+            )
+
+        if self.settings.getbool("CHECKPOINT_ENABLED", True):
+            directory = data_path(self.settings.get("CHECKPOINT_DIR", "checkpoints"), createdir=True)
+            self.checkpoint = CrawlCheckpoint(
+                os.path.join(directory, f"{self.shop_name}.sqlite"),
+                interval=self.settings.getfloat("CHECKPOINT_INTERVAL", 30.0),
+                max_attempts=self.settings.getint("CHECKPOINT_MAX_ATTEMPTS", 3),
+                resume=self.resume,
+            )
+
+        if self.fetch_state is not None or self.checkpoint is not None:
+            # Fetch state and checkpoint only count pages whose items are in the DB
+            self.crawler.signals.connect(self.items_committed, signal=items_committed)
+
+        if self.context_pool is not None or self.checkpoint is not None:
+            # Requests dropped after a retry still hold a context slot, and
+            # dropped duplicates count as completed for the checkpoint
+            self.crawler.signals.connect(self.request_dropped, signal=signals.request_dropped)
+
+        if self.checkpoint is not None:
+            # Register every root up front, so roots added to the config since
+            # (or not reached before an interruption) are pending shards too
+            for url in self.sitemap_urls:
+                self.checkpoint.add_shard(url)
+            if self.checkpoint.resumed:
+                yield from self.resume_requests()
+                return
+
+        for url in self.sitemap_urls:
+            yield self.sitemap_request(url)
+
+    def resume_requests(self):
+        """
+        Requests that continue an interrupted crawl: the frontier and the
+        failed products with attempts left first, then the sitemaps that
+        weren't read to the end.
+        """
+        pending = self.checkpoint.pending_requests()
+        retries = self.checkpoint.retry_requests()
+        shards = self.checkpoint.pending_shards()
+        self.logger.info(f"Resuming from {self.checkpoint.path}: {len(pending)} pending products, "
+                         f"{len(retries)} failed products to retry, "
+                         f"{len(self.checkpoint.completed)} completed, {len(shards)} unfinished sitemaps")
+        self.crawler.stats.set_value("checkpoint/resumed_pending", len(pending))
+        self.crawler.stats.set_value("checkpoint/resumed_retries", len(retries))
+        for url, lastmod, shard in pending + retries:
+            request = self.product_request(url, lastmod, shard)
+            if request is not None:
+                yield request
+        for url in shards:
+            yield self.sitemap_request(url)
+
+    def sitemap_request(self, url):
+        return scrapy.Request(
+            url=url,
+            callback=self.parse_sitemap,
+            meta={"sitemap_shard": url, **self.render_meta("sitemap")},
+        )
 
     def parse_sitemap(self, response):
-        sel = Selector(text=response.text, type="xml")
-        loc_list = sel.xpath('//*[local-name()="url"]/*[local-name()="loc"]/text()').getall()
+        """
+        Stream <loc>/<lastmod> pairs out of a sitemap (optionally gzipped) and
+        request each product page as soon as its entry is parsed. Sitemap
+        indexes are followed recursively.
 
-        for loc in loc_list:
-            loc = loc.strip()
-            if any(pattern in loc for pattern in self.ignore_patterns):
-                continue
+        With a checkpoint, entries before the sitemap's cursor were handled
+        by an earlier run and are skipped.
+        """
+        shard = response.meta.get("sitemap_shard", response.url)
+        max_size = getattr(self, "download_maxsize", self.settings.getint("DOWNLOAD_MAXSIZE"))
+        try:
+            skip = self.resume_position(response.body, shard, max_size)
+            for position, entry in enumerate(iter_sitemap(response.body, max_size)):
+                if position < skip:
+                    continue
+                request = self.sitemap_entry_request(entry, shard)
+                if self.checkpoint is not None:
+                    self.checkpoint.advance(shard, position + 1, entry.loc)
+                if request is not None:
+                    yield request
+        except (etree.XMLSyntaxError, SitemapTooLarge, OSError, EOFError) as exc:
+            # OSError / EOFError: corrupt or truncated gzip
+            self.crawler.stats.inc_value("sitemap/parse_errors")
+            self.logger.error(f"Failed to parse sitemap {response.url}: {exc}")
+            return
 
-            yield scrapy.Request(
-                url=loc
-                , callback=self.parse_product
-                )
+        if self.checkpoint is not None:
+            self.checkpoint.finish_shard(shard)
 
-    def parse_product(self, response):
+    def resume_position(self, body, shard, max_size):
+        """
+        Number of leading entries of the sitemap to skip: its checkpoint
+        cursor, if the entry before the cursor is still the last <loc> the
+        checkpoint recorded. If the sitemap changed since, the whole sitemap
+        is read again and the checkpoint's known URLs are skipped instead.
+        """
+        if self.checkpoint is None:
+            return 0
+        cursor = self.checkpoint.cursor(shard)
+        if not cursor:
+            return 0
+        expected = self.checkpoint.last_loc(shard)
+        for position, entry in enumerate(iter_sitemap(body, max_size)):
+            if position == cursor - 1:
+                if entry.loc == expected:
+                    return cursor
+                break
+        self.crawler.stats.inc_value("checkpoint/cursor_mismatch")
+        self.logger.info(f"Sitemap {shard} changed since the checkpoint, re-reading it from the start")
+        return 0
+
+    def sitemap_entry_request(self, entry, shard):
+        """
+        The request for one sitemap entry (a child sitemap or a product
+        page), or None if it is filtered out or already handled.
+        """
+        if entry.kind == "sitemap":
+            self.crawler.stats.inc_value("sitemap/child_sitemaps")
+            if self.checkpoint is not None:
+                # Known child sitemaps are done or re-requested on resume
+                if self.checkpoint.has_shard(entry.loc):
+                    return None
+                self.checkpoint.add_shard(entry.loc, parent=shard)
+            return self.sitemap_request(entry.loc)
+
+        loc = entry.loc
+        rejection = self.url_filter.rejection(loc)
+        if rejection is not None:
+            self.crawler.stats.inc_value(f"url_filter/{rejection}")
+            return None
+
+        if self.checkpoint is not None and self.checkpoint.is_known(loc):
+            self.crawler.stats.inc_value("checkpoint/skipped_known")
+            return None
+
+        return self.product_request(loc, entry.lastmod, shard)
+
+    def product_request(self, loc, lastmod=None, shard=None):
+        """
+        Build the request for a product page, or return None if the sitemap
+        says the page hasn't changed since it was last fetched.
+        """
+        # dupefilter_persist: in DUPEFILTER_MODE=cross_run, skip products
+        # fetched by earlier runs (see dupefilter.py). Products the fetch
+        # state knows are left to the lastmod / conditional checks, so
+        # changed pages are still fetched
+        persist = self.fetch_state is None or not self.fetch_state.is_known(loc)
+        meta = {"sitemap_loc": loc, "sitemap_lastmod": lastmod, "dupefilter_persist": persist,
+                **self.render_meta("product")}
+        headers = {}
+
+        if self.fetch_state is not None:
+            if self.fetch_state.is_unchanged(loc, lastmod):
+                self.fetch_state.mark_seen(loc)
+                self.crawler.stats.inc_value("incremental/skipped_lastmod")
+                if self.checkpoint is not None and loc in self.checkpoint.frontier:
+                    self.checkpoint.mark_completed(loc)
+                return None
+            headers = self.fetch_state.conditional_headers(loc)
+            if headers:
+                meta["handle_httpstatus_list"] = [304]
+
+        if self.checkpoint is not None:
+            self.checkpoint.add_request(loc, lastmod, shard)
+            self.canonical_locs.setdefault(canonicalize_url(loc), loc)
+
+        if self.context_pool is not None:
+            # ContextPoolMiddleware picks the context at download time. We
+            # close pages ourselves so retired contexts can be closed too
+            meta[POOL_META_KEY] = True
+            meta["playwright_include_page"] = True
+
+        return scrapy.Request(
+            url=loc,
+            callback=self.parse_product,
+            errback=self.product_errback,
+            headers=headers,
+            meta=meta,
+        )
+
+    async def parse_product(self, response):
         """
         Parse the actual product detail page using the selectors from the config.
         """
-        selectors = self.config.get("selectors", {})
-        extras_selectors = self.config.get("extras", {})
+        # The rendered HTML is in the response; the browser page can go
+        await self.release_page(response.meta)
+
+        loc = response.meta.get("sitemap_loc", response.url)
+        if self.fetch_state is not None:
+            if response.status == 304:
+                self.fetch_state.mark_seen(loc)
+                self.crawler.stats.inc_value("incremental/not_modified")
+                if self.checkpoint is not None:
+                    self.checkpoint.mark_completed(loc)
+                return
+            # Recorded once SQLitePipeline has committed the item
+            self.fetch_state.await_commit(
+                response.url, loc,
+                lastmod=response.meta.get("sitemap_lastmod"),
+                etag=self.header_value(response, "ETag"),
+                last_modified=self.header_value(response, "Last-Modified"),
+            )
+
+        fields = await self.extract(response)
 
         item = ProductScraperItem()
         item['shop'] = self.shop_name
         item['url'] = response.url
 
-        # Standard fields
-        item['product_name'] = self.extract_field(response, selectors.get('product_name'))
-        item['price']        = self.extract_field(response, selectors.get('price'))
-        item['brand']        = self.extract_field(response, selectors.get('brand'))
-        item['description']  = self.extract_field(response, selectors.get('description'))
-
-        # Extras
-        item['extras'] = {}
-        for field_name, field_config in extras_selectors.items():
-            val = self.extract_field(response, field_config)
-            if val:
-                item['extras'][field_name] = val
+        # Standard fields + extras
+        item['product_name'] = fields['product_name']
+        item['price']        = fields['price']
+        item['currency']     = self.currency
+        item['brand']        = fields['brand']
+        item['description']  = fields['description']
+        item['extras']       = fields['extras']
 
+        if self.checkpoint is not None:
+            # Completed once SQLitePipeline has committed the item
+            self.checkpoint.await_commit(loc, response.url)
         yield item
 
+    async def product_errback(self, failure):
+        await self.release_page(failure.request.meta)
+        self.logger.error(f"Failed to fetch {failure.request.url}: {failure.value!r}")
+        if self.checkpoint is not None:
+            # Stays pending: a resumed run requests it again
+            self.checkpoint.mark_failed(failure.request.meta.get("sitemap_loc", failure.request.url))
+
+    async def release_page(self, meta):
+        """
+        Close the Playwright page of a product request, and its context too
+        if the pool retired it and this was its last page.
+        """
+        if self.context_pool is None:
+            return
+        page = meta.get("playwright_page")
+        if page is not None and not page.is_closed():
+            await page.close()
+        context_name = meta.get("playwright_context")
+        if context_name and self.context_pool.release(context_name) and page is not None:
+            self.crawler.stats.inc_value("playwright/contexts_recycled")
+            await page.context.close()
+
+    def request_dropped(self, request, spider):
+        if self.context_pool is not None and request.meta.get("playwright_context"):
+            self.context_pool.release(request.meta["playwright_context"])
+        # A duplicate of another product URL is done once that one is. Any
+        # other drop (a Bloom false positive, a cross-run drop, a full
+        # scheduler) stays in the frontier for a resumed run.
+        loc = request.meta.get("sitemap_loc")
+        if self.checkpoint is not None and loc is not None:
+            original = self.canonical_locs.get(canonicalize_url(loc))
+            if original is not None and original != loc and self.checkpoint.is_known(original):
+                self.crawler.stats.inc_value("checkpoint/dropped_duplicates")
+                self.checkpoint.mark_completed(loc)
+
+    def items_committed(self, rows, spider):
+        urls = [url for shop, url in rows if shop == self.shop_name]
+        if self.fetch_state is not None:
+            self.fetch_state.items_committed(urls)
+        if self.checkpoint is not None:
+            self.checkpoint.items_committed(urls)
+
+    async def extract(self, response):
+        """
+        Run the extraction plan on a response, in a worker process if a pool
+        is configured. At most EXTRACTION_MAX_INFLIGHT pages are handed to
+        the pool at once.
+        """
+        if self.extraction_pool is None:
+            return self.plan.extract(response.selector.root)
+
+        async with self.extraction_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.extraction_pool, extract_in_worker, response.text)
+
+    def closed(self, reason):
+        """
+        Write the remaining fetch state back to the DB and stop the worker pool.
+        The checkpoint is kept for the next run unless the crawl finished.
+        """
+        if self.fetch_state is not None:
+            self.fetch_state.close()
+        if self.checkpoint is not None:
+            if reason == "finished":
+                self.checkpoint.clear()
+            else:
+                self.checkpoint.close()
+                self.logger.info(f"Crawl {reason}; resume from checkpoint {self.checkpoint.path}")
+        if self.extraction_pool is not None:
+            self.extraction_pool.shutdown(wait=True, cancel_futures=True)
+
     # ---------------------------------------------------------------------
     # Helper Methods
     # ---------------------------------------------------------------------
 
+    def load_render_modes(self, render):
+        """
+        'render' is either a single mode for all requests or a dict per
+        request kind, e.g. {'sitemap': 'http', 'product': 'playwright'}.
+        """
+        if isinstance(render, str):
+            modes = {kind: render for kind in REQUEST_KINDS}
+        else:
+            modes = {kind: render.get(kind, "http") for kind in REQUEST_KINDS}
+
+        for kind, mode in modes.items():
+            if mode not in RENDER_MODES:
+                raise ValueError(f"Unknown render mode {mode!r} for {kind} requests, "
+                                 f"expected one of {RENDER_MODES}")
+        return modes
+
+    def render_meta(self, kind):
+        """
+        Request meta for the given request kind. scrapy-playwright only opens
+        a browser page for requests with meta['playwright'] set; everything
+        else goes through Scrapy's plain HTTP handler.
+        """
+        if self.render[kind] != "playwright":
+            return {}
+
+        meta = {"playwright": True}
+        if self.resource_blocker is not None:
+            meta["playwright_page_init_callback"] = self.resource_blocker.init_page
+        wait_for = self.playwright_config.get("wait_for")
+        if wait_for and kind == "product":
+            meta["playwright_page_methods"] = [PageMethod("wait_for_selector", wait_for)]
+        return meta
+
+    def header_value(self, response, name):
+        value = response.headers.get(name)
+        return value.decode("latin-1") if value else None
+
     def extract_field(self, response, field_config):
         """
         If field_config is a string, do single extraction.
         If it's a dict with {'selector': '...', 'join_text': True}, do multiple extraction + join.
+
+        Uncompiled; parse_product runs the precompiled self.plan instead.
         """
         if not field_config:
             return None
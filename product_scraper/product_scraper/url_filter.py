@@ -0,0 +1,106 @@
+# url_filter.py
+"""
+Compiled URL filter for a shop config's 'ignore_patterns' and 'include_patterns'.
+
+Each pattern is either a plain substring or a regular expression, written as
+"re:<regex>" or {regex: "<regex>"}. All patterns of a list are compiled once
+into a single alternation regex, so a URL is checked with one search per list
+instead of one substring test per pattern. The regex also reports which rule
+matched leftmost in the URL, so each rule's drop count can be exported as a
+stat.
+"""
+
+import re
+
+REGEX_PREFIX = "re:"
+
+# \1 or (?(1)...) refer to groups by number, which shift once rules are combined
+NUMBERED_REFERENCE = re.compile(r"\\[1-9]|\(\?\(\d")
+
+
+def pattern_to_regex(pattern):
+    """
+    Returns (label, regex source) for a substring or regex pattern.
+    """
+    if isinstance(pattern, dict):
+        return f"re:{pattern['regex']}", pattern["regex"]
+    if pattern.startswith(REGEX_PREFIX):
+        return pattern, pattern[len(REGEX_PREFIX):]
+    return pattern, re.escape(pattern)
+
+
+class PatternSet:
+    """
+    A list of patterns compiled into one regex with a named group per rule.
+
+    Rules that can't share one regex (inline global flags such as "(?i)",
+    numbered backreferences, group names used by several rules) make the
+    whole set fall back to one search per rule.
+    """
+
+    def __init__(self, patterns):
+        self.labels = []
+        self.rules = []
+        self.group_labels = {}
+        parts = []
+        for index, pattern in enumerate(patterns or []):
+            label, source = pattern_to_regex(pattern)
+            # validate each rule on its own for a readable error message
+            try:
+                self.rules.append(re.compile(source))
+            except re.error as exc:
+                raise ValueError(f"Invalid URL pattern {label!r}: {exc}") from exc
+            self.labels.append(label)
+            self.group_labels[f"_rule{index}"] = label
+            parts.append(f"(?P<_rule{index}>(?:{source}))")
+
+        self.regex = None
+        if parts and not any(NUMBERED_REFERENCE.search(rule.pattern) for rule in self.rules):
+            try:
+                self.regex = re.compile("|".join(parts))
+            except re.error:
+                pass
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, url):
+        """
+        Returns the label of the rule matching leftmost in 'url', or None.
+        Of rules matching at the same position, the first in config order
+        wins. Only the label is used (for stats), so which rule is reported
+        doesn't change whether a URL is dropped.
+        """
+        if self.regex is None:
+            matches = [(found.start(), index) for index, rule in enumerate(self.rules)
+                       for found in [rule.search(url)] if found is not None]
+            return self.labels[min(matches)[1]] if matches else None
+
+        found = self.regex.search(url)
+        if found is None:
+            return None
+        # the rule's own group closes last, so it is always the last group
+        return self.group_labels[found.lastgroup]
+
+
+class UrlFilter:
+    """
+    Drops URLs matching any ignore pattern and, if include patterns are
+    given, URLs matching none of them.
+    """
+
+    def __init__(self, ignore_patterns=None, include_patterns=None):
+        self.ignore = PatternSet(ignore_patterns)
+        self.include = PatternSet(include_patterns)
+
+    def rejection(self, url):
+        """
+        Returns None if the URL should be crawled, otherwise a short reason
+        such as 'ignored//blog/' or 'not_included', usable as a stats key.
+        """
+        rule = self.ignore.match(url)
+        if rule is not None:
+            return f"ignored/{rule}"
+        if self.include and self.include.match(url) is None:
+            return "not_included"
+        return None
@@ -0,0 +1,39 @@
+import io
+import json
+
+import ijson
+
+from product_scraper.spiders.barnashus_api import BarnasHusSpider
+
+LISTING = (
+    b'{"products": [{"url": "/p/1", "displayName": "Vogn", "colorName": "Sort",'
+    b' "price": {"current": {"inclVat": 1999.00, "exVat": 1599.2}}, "inStock": true,'
+    b' "images": ["a.jpg"], "position": 3}]}'
+)
+
+
+def fingerprint(product):
+    return BarnasHusSpider().listing_fingerprint(product)
+
+
+def test_json_and_ijson_agree():
+    from_json = json.loads(LISTING)["products"][0]
+    from_ijson = next(ijson.items(io.BytesIO(LISTING), "products.item"))
+
+    assert fingerprint(from_json) == fingerprint(from_ijson)
+
+
+def test_ignores_fields_that_are_not_stored():
+    product = json.loads(LISTING)["products"][0]
+    changed = dict(product, images=["b.jpg"], position=7)
+
+    assert fingerprint(changed) == fingerprint(product)
+
+
+def test_price_and_stock_changes_are_detected():
+    product = json.loads(LISTING)["products"][0]
+    cheaper = dict(product, price={"current": {"inclVat": 1499, "exVat": 1199.2}})
+    sold_out = dict(product, inStock=False)
+
+    assert fingerprint(cheaper) != fingerprint(product)
+    assert fingerprint(sold_out) != fingerprint(product)
@@ -0,0 +1,141 @@
+import pytest
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from product_scraper.checkpoint import CrawlCheckpoint
+from product_scraper.spiders.universal_spider import UniversalSpider
+
+SHARD = "https://shop.test/sitemap.xml"
+CONFIG = """
+name: "test"
+sitemap_url: "https://shop.test/sitemap.xml"
+selectors:
+  product_name: "h1::text"
+"""
+
+
+def sitemap(*paths):
+    urls = "".join(f"<url><loc>https://shop.test{path}</loc></url>" for path in paths)
+    return f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'.encode()
+
+
+@pytest.fixture
+def spider(tmp_path):
+    config = tmp_path / "shop.yml"
+    config.write_text(CONFIG)
+    crawler = get_crawler(UniversalSpider, {"DUPEFILTER_CLASS": "scrapy.dupefilters.BaseDupeFilter"})
+    spider = UniversalSpider.from_crawler(crawler, config_file=str(config), incremental="false")
+    spider.checkpoint = CrawlCheckpoint(str(tmp_path / "checkpoint.sqlite"), interval=3600)
+    return spider
+
+
+def parse(spider, body):
+    response = Response(SHARD, body=body, request=spider.sitemap_request(SHARD))
+    return [request.url for request in spider.parse_sitemap(response)]
+
+
+def interrupted_after(spider, paths):
+    """
+    Checkpoint of a run that handled (and completed) the sitemap entries for 'paths'.
+    """
+    spider.checkpoint.add_shard(SHARD)
+    for position, path in enumerate(paths):
+        spider.checkpoint.advance(SHARD, position + 1, f"https://shop.test{path}")
+        spider.checkpoint.mark_completed(f"https://shop.test{path}")
+
+
+def test_resumes_from_cursor_when_sitemap_is_unchanged(spider):
+    body = sitemap("/p/1", "/p/2", "/p/3", "/p/4")
+    interrupted_after(spider, ["/p/1", "/p/2"])
+
+    assert spider.resume_position(body, SHARD, 0) == 2
+    assert parse(spider, body) == ["https://shop.test/p/3", "https://shop.test/p/4"]
+
+
+def test_rereads_sitemap_when_entries_moved(spider):
+    interrupted_after(spider, ["/p/1", "/p/2"])
+    # A new product was inserted at the top, shifting every entry down
+    changed = sitemap("/p/0", "/p/1", "/p/2", "/p/3", "/p/4")
+
+    assert parse(spider, changed) == ["https://shop.test/p/0", "https://shop.test/p/3",
+                                      "https://shop.test/p/4"]
+    assert spider.crawler.stats.get_value("checkpoint/cursor_mismatch") == 1
+
+
+def test_rereads_sitemap_that_shrank_below_the_cursor(spider):
+    interrupted_after(spider, ["/p/1", "/p/2", "/p/3"])
+    shrunk = sitemap("/p/1", "/p/5")
+
+    assert spider.resume_position(shrunk, SHARD, 0) == 0
+    assert parse(spider, shrunk) == ["https://shop.test/p/5"]
+
+
+def test_resume_requests_roots_the_checkpoint_does_not_know(tmp_path):
+    config = tmp_path / "shop.yml"
+    config.write_text(CONFIG.replace(
+        'sitemap_url: "https://shop.test/sitemap.xml"',
+        'sitemap_urls: ["https://shop.test/sitemap.xml", "https://shop.test/new.xml"]'))
+    checkpoint = CrawlCheckpoint(str(tmp_path / "test.sqlite"))
+    checkpoint.add_shard(SHARD)
+    checkpoint.finish_shard(SHARD)
+    checkpoint.close()
+
+    crawler = get_crawler(UniversalSpider, {"CHECKPOINT_DIR": str(tmp_path)})
+    spider = UniversalSpider.from_crawler(crawler, config_file=str(config), incremental="false")
+    requests = list(spider.start_requests())
+
+    assert [request.url for request in requests] == ["https://shop.test/new.xml"]
+    assert spider.checkpoint.pending_shards() == ["https://shop.test/new.xml"]
+
+
+def test_failed_fetches_are_retried_on_resume(tmp_path):
+    path = str(tmp_path / "checkpoint.sqlite")
+    checkpoint = CrawlCheckpoint(path, max_attempts=2)
+    checkpoint.add_request("https://shop.test/p/1", "2024-01-01", SHARD)
+    checkpoint.add_request("https://shop.test/p/2", None, SHARD)
+    checkpoint.mark_failed("https://shop.test/p/1")
+    checkpoint.mark_completed("https://shop.test/p/2")
+    checkpoint.close()
+
+    resumed = CrawlCheckpoint(path, max_attempts=2)
+    assert resumed.pending_requests() == []
+    assert resumed.retry_requests() == [("https://shop.test/p/1", "2024-01-01", SHARD)]
+    assert resumed.is_known("https://shop.test/p/1")
+
+    # Fails again: out of attempts
+    resumed.add_request("https://shop.test/p/1", "2024-01-01", SHARD)
+    resumed.mark_failed("https://shop.test/p/1")
+    resumed.close()
+    assert CrawlCheckpoint(path, max_attempts=2).retry_requests() == []
+
+
+def test_completed_retry_leaves_the_failed_urls(tmp_path):
+    path = str(tmp_path / "checkpoint.sqlite")
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.add_request("https://shop.test/p/1", None, SHARD)
+    checkpoint.mark_failed("https://shop.test/p/1")
+    checkpoint.close()
+
+    resumed = CrawlCheckpoint(path)
+    resumed.add_request("https://shop.test/p/1", None, SHARD)
+    resumed.mark_completed("https://shop.test/p/1")
+    resumed.close()
+
+    reopened = CrawlCheckpoint(path)
+    assert reopened.failed == {}
+    assert reopened.frontier == {}
+    assert "https://shop.test/p/1" in reopened.completed
+
+
+def test_only_real_duplicates_are_completed_when_dropped(spider):
+    spider.checkpoint.add_shard(SHARD)
+    first = spider.product_request("https://shop.test/p/1", shard=SHARD)
+    duplicate = spider.product_request("https://shop.test/p/1?utm_source=mail", shard=SHARD)
+    false_positive = spider.product_request("https://shop.test/p/2", shard=SHARD)
+
+    spider.request_dropped(duplicate, spider)
+    spider.request_dropped(false_positive, spider)
+
+    assert "https://shop.test/p/1?utm_source=mail" in spider.checkpoint.completed
+    assert "https://shop.test/p/2" in spider.checkpoint.frontier
+    assert first.url in spider.checkpoint.frontier
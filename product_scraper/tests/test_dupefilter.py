@@ -0,0 +1,93 @@
+import logging
+
+from scrapy import Request, Spider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from product_scraper.dupefilter import BloomDupeFilter, canonicalize_url, request_key
+from product_scraper.fetch_state import FetchStateStore
+from product_scraper.spiders.universal_spider import UniversalSpider
+
+
+def cross_run_filter(tmp_path, capacity=1000):
+    crawler = get_crawler(Spider, {
+        "DUPEFILTER_MODE": "cross_run",
+        "DUPEFILTER_DIR": str(tmp_path),
+        "DUPEFILTER_CAPACITY": capacity,
+    })
+    crawler.spider = Spider.from_crawler(crawler, name="shop")
+    dupefilter = BloomDupeFilter.from_crawler(crawler)
+    dupefilter.open()
+    return dupefilter
+
+
+def persisted_request(url):
+    return Request(url, meta={"dupefilter_persist": True})
+
+
+def test_canonicalize_url():
+    assert (canonicalize_url("HTTPS://Shop.test/p/1?b=2&utm_source=x&a=1#top")
+            == "https://shop.test/p/1?a=1&b=2")
+
+
+def test_run_mode_filters_duplicates_within_a_run():
+    dupefilter = BloomDupeFilter()
+
+    assert not dupefilter.request_seen(Request("https://shop.test/p/1?utm_source=mail"))
+    assert dupefilter.request_seen(Request("https://shop.test/p/1"))
+    assert not dupefilter.request_seen(Request("https://shop.test/p/2"))
+
+
+def test_cross_run_remembers_original_url_of_redirects(tmp_path):
+    dupefilter = cross_run_filter(tmp_path)
+    original = persisted_request("https://shop.test/old/1")
+    redirected = original.replace(url="https://shop.test/p/1",
+                                  meta={**original.meta, "redirect_urls": [original.url]})
+    dupefilter.response_received(Response(redirected.url, status=200), redirected, None)
+    dupefilter.close("finished")
+
+    next_run = cross_run_filter(tmp_path)
+    assert next_run.request_seen(persisted_request("https://shop.test/old/1"))
+    assert next_run.request_seen(persisted_request("https://shop.test/p/1"))
+    assert not next_run.request_seen(persisted_request("https://shop.test/p/2"))
+
+
+def test_cross_run_ignores_failed_fetches(tmp_path):
+    dupefilter = cross_run_filter(tmp_path)
+    request = persisted_request("https://shop.test/p/1")
+    dupefilter.response_received(Response(request.url, status=503), request, None)
+    dupefilter.close("finished")
+
+    assert not cross_run_filter(tmp_path).request_seen(persisted_request("https://shop.test/p/1"))
+
+
+def test_warns_when_persisted_filter_is_saturated(tmp_path, caplog):
+    dupefilter = cross_run_filter(tmp_path, capacity=10)
+    for i in range(50):
+        request = persisted_request(f"https://shop.test/p/{i}")
+        dupefilter.response_received(Response(request.url, status=200), request, None)
+
+    with caplog.at_level(logging.WARNING, logger="product_scraper.dupefilter"):
+        dupefilter.close("finished")
+
+    assert "above its capacity" in caplog.text
+
+
+def test_incremental_spider_only_persists_urls_it_has_never_fetched(tmp_path):
+    config = tmp_path / "shop.yml"
+    config.write_text('name: "shop"\nsitemap_url: "https://shop.test/sitemap.xml"\n'
+                      'selectors:\n  product_name: "h1::text"\n')
+    crawler = get_crawler(UniversalSpider)
+    spider = UniversalSpider.from_crawler(crawler, config_file=str(config), incremental="false")
+    spider.fetch_state = FetchStateStore(f"sqlite:///{tmp_path / 'products.db'}", "shop")
+    spider.fetch_state.record_fetch("https://shop.test/p/1", lastmod="2024-01-01")
+
+    known = spider.product_request("https://shop.test/p/1", "2024-02-01")
+    new = spider.product_request("https://shop.test/p/2", "2024-02-01")
+
+    # A changed product fetched by an earlier run isn't dropped by the filter
+    dupefilter = cross_run_filter(tmp_path)
+    dupefilter.persisted.add(request_key(known))
+    assert not known.meta["dupefilter_persist"]
+    assert not dupefilter.request_seen(known)
+    assert new.meta["dupefilter_persist"]
@@ -0,0 +1,76 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from product_scraper.embedding_cache import CachedEmbeddings, SQLiteEmbeddingStore
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    calls: int = 0
+    texts: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+
+def test_repeated_texts_are_embedded_once(tmp_path):
+    embedder = CountingEmbedding(size=8)
+    store = SQLiteEmbeddingStore(str(tmp_path / "cache.sqlite"), max_entries=100)
+    embeddings = CachedEmbeddings(embedder, store, "fake")
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = embeddings.embed_documents(["b", "a"])
+
+    assert embedder.texts == 2
+    # Cached vectors are stored as float32
+    assert first[0] == first[2]
+    assert second[1] == pytest.approx(first[0], rel=1e-6)
+    assert second[0] == pytest.approx(first[1], rel=1e-6)
+    stats = embeddings.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 2, 2)
+
+
+def test_cache_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    CachedEmbeddings(CountingEmbedding(size=8), SQLiteEmbeddingStore(path), "fake") \
+        .embed_documents(["a"])
+
+    embedder = CountingEmbedding(size=8)
+    CachedEmbeddings(embedder, SQLiteEmbeddingStore(path), "fake").embed_documents(["a"])
+    assert embedder.calls == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = SQLiteEmbeddingStore(str(tmp_path / "cache.sqlite"), max_entries=2)
+    store.put_many({"a": [1.0]})
+    store.put_many({"b": [2.0]})
+    store.get_many(["a"])
+    store.put_many({"c": [3.0]})
+
+    assert len(store) == 2
+    assert set(store.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_cap_holds_when_processes_share_the_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = SQLiteEmbeddingStore(path, max_entries=3)
+    second = SQLiteEmbeddingStore(path, max_entries=3)
+
+    first.put_many({"a": [1.0], "b": [2.0]})
+    second.put_many({"c": [3.0], "d": [4.0]})
+    first.put_many({"e": [5.0]})
+
+    assert len(first) == len(second) == 3
+
+
+def test_put_many_does_not_count_the_table(tmp_path):
+    store = SQLiteEmbeddingStore(str(tmp_path / "cache.sqlite"), max_entries=2)
+    statements = []
+    store.conn.set_trace_callback(statements.append)
+
+    for key in "abcd":
+        store.put_many({key: [1.0]})
+
+    assert not [statement for statement in statements if "COUNT(" in statement]
+    assert len(store) == 2
@@ -0,0 +1,26 @@
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from product_scraper.httpcache import SQLiteZstdCacheStorage
+
+
+def test_identical_bodies_are_compressed_and_stored_once(tmp_path, monkeypatch):
+    crawler = get_crawler(Spider, {"HTTPCACHE_DIR": str(tmp_path)})
+    spider = Spider.from_crawler(crawler, name="shop")
+    storage = SQLiteZstdCacheStorage(crawler.settings)
+    storage.open_spider(spider)
+    compressed = []
+    compress = storage.codec.compress
+    monkeypatch.setattr(storage.codec, "compress", lambda data: compressed.append(data) or compress(data))
+
+    body = b"<html><h1>Vogn</h1></html>"
+    for url in ("https://shop.test/p/1", "https://shop.test/p/1?ref=a", "https://shop.test/p/2"):
+        storage.store_response(spider, Request(url), HtmlResponse(url, body=body))
+
+    assert compressed == [body]
+    assert crawler.stats.get_value("httpcache/blobs_stored") == 1
+    assert crawler.stats.get_value("httpcache/blobs_deduplicated") == 2
+    cached = storage.retrieve_response(spider, Request("https://shop.test/p/2"))
+    assert cached.body == body
+    storage.close_spider(spider)
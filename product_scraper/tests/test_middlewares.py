@@ -0,0 +1,71 @@
+import inspect
+
+from scrapy import Request, Spider
+from scrapy.core.downloader.middleware import DownloaderMiddlewareManager
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.http import Response
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.conf import build_component_list
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import TCPTimedOutError
+
+from product_scraper import settings as project_settings
+from product_scraper.middlewares import ProductScraperDownloaderMiddleware
+
+
+def throttle_and_retry(monkeypatch):
+    """
+    A middleware manager with the throttle and RetryMiddleware, ordered by
+    the project's DOWNLOADER_MIDDLEWARES, and the errors observe() saw.
+    """
+    crawler = get_crawler(Spider, {"DOWNLOADER_MIDDLEWARES": project_settings.DOWNLOADER_MIDDLEWARES})
+    crawler.spider = Spider.from_crawler(crawler, name="test")
+    middlewares = [
+        build_from_crawler(load_object(path), crawler)
+        for path in build_component_list(crawler.settings.getwithbase("DOWNLOADER_MIDDLEWARES"))
+        if load_object(path) in (ProductScraperDownloaderMiddleware, RetryMiddleware)
+    ]
+    manager = DownloaderMiddlewareManager(*middlewares, crawler=crawler)
+
+    observed = []
+    throttle = next(mw for mw in middlewares if isinstance(mw, ProductScraperDownloaderMiddleware))
+    monkeypatch.setattr(throttle, "observe", lambda request, latency, error: observed.append(error))
+    return manager, crawler.spider, observed
+
+
+def run_chain(manager, spider, name, **kwargs):
+    """
+    Calls the manager's 'name' methods in its order until one returns a
+    Request, like the downloader does.
+    """
+    for method in manager.methods[name]:
+        spider_arg = inspect.signature(method).parameters.get("spider")
+        if spider_arg is not None and spider_arg.default is inspect.Parameter.empty:
+            result = method(spider=spider, **kwargs)
+        else:
+            result = method(**kwargs)
+        if isinstance(result, Request):
+            return result
+    return None
+
+
+def test_server_errors_reach_the_throttle_before_retry(monkeypatch):
+    manager, spider, observed = throttle_and_retry(monkeypatch)
+    request = Request("https://shop.test/p/1")
+
+    outcome = run_chain(manager, spider, "process_response",
+                        request=request, response=Response(request.url, status=503))
+
+    assert observed == [True]
+    # RetryMiddleware still retries it
+    assert isinstance(outcome, Request)
+
+
+def test_download_errors_reach_the_throttle_before_retry(monkeypatch):
+    manager, spider, observed = throttle_and_retry(monkeypatch)
+
+    outcome = run_chain(manager, spider, "process_exception",
+                        request=Request("https://shop.test/p/1"), exception=TCPTimedOutError())
+
+    assert observed == [True]
+    assert isinstance(outcome, Request)
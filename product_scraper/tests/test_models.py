@@ -0,0 +1,56 @@
+import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from product_scraper.models import (Base, CrawlRun, Product, backfill_prices, not_seen_between,
+                                    parse_price, stale_cutoffs)
+
+
+def test_parse_price():
+    assert parse_price("kr 1 899,95") == (1899.95, "NOK")
+    assert parse_price("2400,-") == (2400.0, "NOK")
+    assert parse_price(499) == (499.0, None)
+    assert parse_price(None) == (None, None)
+
+
+def test_backfill_prices_in_batches(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'products.db'}")
+    Base.metadata.create_all(engine)
+    prices = ["kr 100", "ukjent", None, "2400,-", "kr 1 899,95", "???", "199 NOK"]
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO products (shop, url, price) VALUES ('shop', :url, :price)"),
+            [{"url": f"https://shop.test/p/{i}", "price": price} for i, price in enumerate(prices)],
+        )
+
+    backfill_prices(engine, batch_size=2)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT price, price_amount FROM products ORDER BY id")).fetchall()
+    assert [amount for _, amount in rows] == [100.0, None, None, 2400.0, 1899.95, None, 199.0]
+
+
+def test_stale_cutoffs_follow_each_shops_last_finished_crawl():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    day = datetime.datetime(2024, 1, 10)
+    session.add_all([
+        CrawlRun(spider="s", shop="daily", status="finished", started_at=day),
+        CrawlRun(spider="s", shop="weekly", status="finished", started_at=day - datetime.timedelta(days=6)),
+        CrawlRun(spider="s", shop="weekly", status="running", started_at=day),
+        CrawlRun(spider="s", shop="new", status="running", started_at=day),
+        Product(shop="daily", url="https://daily.test/1", last_seen=day - datetime.timedelta(days=1)),
+        Product(shop="weekly", url="https://weekly.test/1", last_seen=day - datetime.timedelta(days=5)),
+        Product(shop="weekly", url="https://weekly.test/2", last_seen=day - datetime.timedelta(days=8)),
+        Product(shop="new", url="https://new.test/1", last_seen=day - datetime.timedelta(days=30)),
+    ])
+    session.commit()
+
+    cutoffs = stale_cutoffs(session)
+    assert cutoffs == {"daily": day, "weekly": day - datetime.timedelta(days=6)}
+
+    gone = [product.url for shop, cutoff in cutoffs.items()
+            for product in not_seen_between(session, after=None, before=cutoff, shop=shop)]
+    assert sorted(gone) == ["https://daily.test/1", "https://weekly.test/2"]
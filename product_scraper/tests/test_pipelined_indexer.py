@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from product_scraper.pipelined_indexer import InMemoryUpserter, PipelinedIndexer, document_id
+
+
+def make_batches(count, size):
+    for start in range(0, count, size):
+        yield [Document(page_content=f"product {i}", metadata={"url": f"https://shop.test/p/{i}"})
+               for i in range(start, min(start + size, count))]
+
+
+def test_indexes_every_document():
+    upserter = InMemoryUpserter()
+    indexer = PipelinedIndexer(DeterministicFakeEmbedding(size=8), upserter,
+                               embed_workers=3, upsert_workers=2, queue_size=2)
+
+    metrics = indexer.run(make_batches(95, 10))
+
+    assert len(upserter.vectors) == 95
+    vector, document = upserter.vectors[document_id(Document(
+        page_content="", metadata={"url": "https://shop.test/p/42"}))]
+    assert document.page_content == "product 42"
+    assert len(vector) == 8
+    assert metrics["read"]["items"] == 95
+    assert metrics["embed"]["items"] == 95
+    assert metrics["upsert"]["items"] == 95
+
+
+def test_failing_batches_stop_the_workers():
+    def batches():
+        yield from make_batches(30, 10)
+        raise RuntimeError("db went away")
+
+    threads_before = threading.active_count()
+    indexer = PipelinedIndexer(DeterministicFakeEmbedding(size=8), InMemoryUpserter(),
+                               embed_workers=2, upsert_workers=2, queue_size=1)
+
+    with pytest.raises(RuntimeError, match="db went away"):
+        indexer.run(batches())
+
+    assert threading.active_count() == threads_before
+
+
+def test_embedding_errors_are_raised_after_retries():
+    class FailingEmbedding(DeterministicFakeEmbedding):
+        def embed_documents(self, texts):
+            raise ConnectionError("embedding service down")
+
+    indexer = PipelinedIndexer(FailingEmbedding(size=8), InMemoryUpserter(),
+                               max_retries=1, retry_backoff=0)
+
+    with pytest.raises(ConnectionError):
+        indexer.run(make_batches(50, 10))
+
+    assert indexer.embed_metrics.retries >= 1
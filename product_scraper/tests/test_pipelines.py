@@ -0,0 +1,154 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from product_scraper import pipelines
+from product_scraper.items import ProductScraperItem
+from product_scraper.models import (Product, ProductChange, changes_since, compute_content_hash,
+                                    create_tables, diff_product)
+from product_scraper.pipelines import SQLitePipeline, item_to_row
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    """
+    Points the pipeline at a fresh in-memory DB instead of the shared engines.
+    """
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(pipelines, "get_session", lambda **kwargs: factory())
+    return factory
+
+
+@pytest.fixture
+def spider():
+    return SimpleNamespace(name="universal_spider", shop_name="shop",
+                           logger=logging.getLogger("test"))
+
+
+def make_item(url, price="kr 100", name="Vogn"):
+    item = ProductScraperItem()
+    item["shop"] = "shop"
+    item["url"] = url
+    item["product_name"] = name
+    item["price"] = price
+    item["currency"] = "NOK"
+    item["brand"] = None
+    item["description"] = None
+    item["extras"] = {}
+    return item
+
+
+def crawl(spider, *items):
+    """
+    One crawl run writing 'items' in a single flush. Returns the pipeline.
+    """
+    pipeline = SQLitePipeline("sqlite://", batch_size=len(items) + 1, flush_interval=3600)
+    pipeline.open_spider(spider)
+    for item in items:
+        pipeline.process_item(item, spider)
+    pipeline.close_spider(spider)
+    return pipeline
+
+
+def stored(session, url):
+    session.expire_all()
+    return session.query(Product).filter(Product.url == url).one()
+
+
+def test_insert_then_unchanged_then_changed(session_factory, spider):
+    session = session_factory()
+    url = "https://shop.test/p/1"
+
+    first = crawl(spider, make_item(url))
+    product = stored(session, url)
+    inserted = (product.first_seen, product.last_seen, product.last_changed)
+    assert first.run_counts == {"inserted": 1, "updated": 0, "unchanged": 0}
+    assert product.content_hash == compute_content_hash(item_to_row(make_item(url)))
+    assert product.price_amount == 100.0
+
+    second = crawl(spider, make_item(url))
+    product = stored(session, url)
+    assert second.run_counts == {"inserted": 0, "updated": 0, "unchanged": 1}
+    assert product.last_changed == inserted[2]
+    assert product.last_seen > inserted[1]
+
+    third = crawl(spider, make_item(url, price="kr 80"))
+    product = stored(session, url)
+    assert third.run_counts == {"inserted": 0, "updated": 1, "unchanged": 0}
+    assert product.content_hash == compute_content_hash(item_to_row(make_item(url, price="kr 80")))
+    assert product.last_changed > inserted[2]
+    assert product.first_seen == inserted[0]
+
+    changes = [(change.run_id, change.change_type, change.field, change.old_value, change.new_value)
+               for change in changes_since(session, 0)]
+    assert changes[0][:3] == (first.run.id, "new", None)
+    assert changes[0][4]["price"] == "kr 100"
+    # Nothing logged for the unchanged run
+    assert changes[1:] == [
+        (third.run.id, "changed", "price", "kr 100", "kr 80"),
+        (third.run.id, "changed", "price_amount", 100.0, 80.0),
+    ]
+    assert [change.field for change in changes_since(session, second.run.id,
+                                                     fields=["price_amount"])] == ["price_amount"]
+    assert changes_since(session, third.run.id).count() == 0
+    session.close()
+
+
+def test_duplicate_url_in_one_batch_keeps_the_last(session_factory, spider):
+    session = session_factory()
+    url = "https://shop.test/p/1"
+
+    pipeline = crawl(spider, make_item(url), make_item(url, price="kr 80"))
+
+    assert pipeline.run_counts == {"inserted": 1, "updated": 0, "unchanged": 0}
+    assert stored(session, url).price == "kr 80"
+    session.close()
+
+
+def test_integrity_error_falls_back_to_one_row_at_a_time(session_factory, spider, monkeypatch):
+    session = session_factory()
+    crawl(spider, make_item("https://shop.test/p/1"))
+
+    # Another writer inserted p/1 after the lookup, so the batch insert fails
+    pipeline = SQLitePipeline("sqlite://", batch_size=10, flush_interval=3600)
+    pipeline.open_spider(spider)
+    load_existing = pipeline.load_existing
+    lookups = []
+
+    def stale_lookup(rows):
+        lookups.append(len(rows))
+        return {} if len(lookups) == 1 else load_existing(rows)
+
+    monkeypatch.setattr(pipeline, "load_existing", stale_lookup)
+    pipeline.process_item(make_item("https://shop.test/p/1", price="kr 80"), spider)
+    pipeline.process_item(make_item("https://shop.test/p/2"), spider)
+    pipeline.close_spider(spider)
+
+    assert lookups == [2, 1, 1]
+    assert pipeline.run_counts == {"inserted": 1, "updated": 1, "unchanged": 0}
+    assert stored(session, "https://shop.test/p/1").price == "kr 80"
+    assert session.query(Product).count() == 2
+    assert [(change.change_type, change.url, change.field)
+            for change in changes_since(session, pipeline.run.id - 1)] == [
+        ("changed", "https://shop.test/p/1", "price"),
+        ("changed", "https://shop.test/p/1", "price_amount"),
+        ("new", "https://shop.test/p/2", None),
+    ]
+    assert session.query(ProductChange).count() == 4
+    session.close()
+
+
+def test_diff_product_ignores_whitespace_and_diffs_extras():
+    old = {"product_name": "Vogn", "price": "kr 100", "extras": {"isbn": "1", "color": "rød"}}
+    new = {"product_name": " Vogn ", "price": "kr 80", "extras": {"isbn": "1", "size": "L"}}
+
+    assert diff_product(old, new) == [
+        ("price", "kr 100", "kr 80"),
+        ("extras.color", "rød", None),
+        ("extras.size", None, "L"),
+    ]
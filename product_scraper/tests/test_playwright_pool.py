@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+from scrapy import Request
+
+from product_scraper.playwright_pool import POOL_META_KEY, ContextPool, ContextPoolMiddleware
+
+
+def pooled_request(url):
+    return Request(url, meta={POOL_META_KEY: True, "playwright": True})
+
+
+def test_context_is_assigned_at_download_time():
+    spider = SimpleNamespace(context_pool=ContextPool("shop", size=2, max_pages_per_context=2))
+    middleware = ContextPoolMiddleware()
+    queued = [pooled_request(f"https://shop.test/p/{i}") for i in range(100)]
+
+    # Building and queueing requests takes no context
+    assert spider.context_pool.outstanding == {}
+
+    request = queued[0]
+    middleware.process_request(request, spider)
+    assert request.meta["playwright_context"] == "shop-0-0"
+    assert spider.context_pool.outstanding == {"shop-0-0": 1}
+
+
+def test_retries_keep_their_context():
+    spider = SimpleNamespace(context_pool=ContextPool("shop", size=2))
+    middleware = ContextPoolMiddleware()
+    request = pooled_request("https://shop.test/p/1")
+    middleware.process_request(request, spider)
+
+    retry = request.replace(meta={**request.meta, "retry_times": 1})
+    middleware.process_request(retry, spider)
+
+    assert retry.meta["playwright_context"] == request.meta["playwright_context"]
+    assert spider.context_pool.outstanding == {"shop-0-0": 1}
+
+
+def test_retries_of_a_released_context_get_a_live_one():
+    spider = SimpleNamespace(context_pool=ContextPool("shop", size=1, max_pages_per_context=1))
+    middleware = ContextPoolMiddleware()
+    request = pooled_request("https://shop.test/p/1")
+    middleware.process_request(request, spider)
+    # The page was released before the retry and the context recycled since
+    spider.context_pool.release(request.meta["playwright_context"])
+    spider.context_pool.acquire()
+
+    retry = request.replace(meta={**request.meta, "retry_times": 1})
+    middleware.process_request(retry, spider)
+
+    assert retry.meta["playwright_context"] == "shop-0-2"
+    assert spider.context_pool.outstanding == {"shop-0-1": 1, "shop-0-2": 1}
+
+
+def test_other_requests_are_left_alone():
+    spider = SimpleNamespace(context_pool=ContextPool("shop"))
+    middleware = ContextPoolMiddleware()
+    request = Request("https://shop.test/sitemap.xml", meta={"playwright": True})
+
+    middleware.process_request(request, spider)
+    middleware.process_request(pooled_request("https://shop.test/p/1"), SimpleNamespace())
+
+    assert "playwright_context" not in request.meta
+    assert spider.context_pool.outstanding == {}
+
+
+def test_retired_context_closes_after_its_last_page():
+    pool = ContextPool("shop", size=1, max_pages_per_context=2)
+    first, second = pool.acquire(), pool.acquire()
+    third = pool.acquire()
+
+    assert first == second == "shop-0-0"
+    assert third == "shop-0-1"
+    assert pool.release(first) is False
+    assert pool.release(second) is True
+    assert pool.release(third) is False
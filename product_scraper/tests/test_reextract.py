@@ -0,0 +1,57 @@
+import logging
+from types import SimpleNamespace
+
+from product_scraper.items import ProductScraperItem
+from product_scraper.models import CrawlRun, Product, compute_content_hash, get_session
+from product_scraper.pipelines import SQLitePipeline, item_to_row
+from product_scraper.reextract import ProductUpdater
+
+
+def make_item(url, name, extras=None):
+    item = ProductScraperItem()
+    item["shop"] = "shop"
+    item["url"] = url
+    item["product_name"] = name
+    item["price"] = "kr 100"
+    item["currency"] = "NOK"
+    item["brand"] = None
+    item["description"] = None
+    item["extras"] = extras or {}
+    return item
+
+
+def test_updates_only_stored_products(tmp_path):
+    db_path = f"sqlite:///{tmp_path / 'products.db'}"
+    spider = SimpleNamespace(name="universal_spider", shop_name="shop",
+                             logger=logging.getLogger("test"))
+    pipeline = SQLitePipeline(db_path)
+    pipeline.open_spider(spider)
+    pipeline.process_item(make_item("https://shop.test/p/1", "Vogn"), spider)
+    pipeline.process_item(make_item("https://shop.test/p/2", "Stol"), spider)
+    pipeline.close_spider(spider)
+
+    session = get_session(db_path)
+    before = {product.url: (product.last_seen, product.last_changed)
+              for product in session.query(Product)}
+
+    writer = ProductUpdater(db_path)
+    writer.open()
+    changed = make_item("https://shop.test/p/1", "Vogn", extras={"isbn": "123"})
+    writer.add(changed)
+    writer.add(make_item("https://shop.test/p/2", "Stol"))
+    writer.add(make_item("https://shop.test/p/delisted", "Gammel"))
+    writer.close()
+
+    session.expire_all()
+    products = {product.url: product for product in session.query(Product)}
+    assert set(products) == {"https://shop.test/p/1", "https://shop.test/p/2"}
+    assert dict(writer.counts) == {"updated": 1, "unchanged": 1, "missing": 1}
+
+    updated = products["https://shop.test/p/1"]
+    assert updated.extras == {"isbn": "123"}
+    assert updated.content_hash == compute_content_hash(item_to_row(changed))
+    assert updated.last_seen == before[updated.url][0]
+    assert updated.last_changed > before[updated.url][1]
+    assert products["https://shop.test/p/2"].last_changed == before["https://shop.test/p/2"][1]
+    assert session.query(CrawlRun).count() == 1
+    session.close()
@@ -0,0 +1,53 @@
+import gzip
+
+import pytest
+
+from product_scraper.sitemaps import SitemapEntry, SitemapTooLarge, iter_sitemap
+
+URLSET = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+    b'<url><loc>https://shop.test/p/1</loc><lastmod>2024-01-01</lastmod></url>'
+    b'<url><loc> https://shop.test/p/2 </loc></url>'
+    b'<url><lastmod>2024-01-01</lastmod></url>'
+    b'</urlset>'
+)
+
+
+def test_reads_urlset_entries():
+    assert list(iter_sitemap(URLSET)) == [
+        SitemapEntry("url", "https://shop.test/p/1", "2024-01-01"),
+        SitemapEntry("url", "https://shop.test/p/2", None),
+    ]
+
+
+def test_reads_gzipped_sitemap_index():
+    body = gzip.compress(
+        b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        b'<sitemap><loc>https://shop.test/s1.xml.gz</loc></sitemap>'
+        b'</sitemapindex>'
+    )
+    assert list(iter_sitemap(body)) == [SitemapEntry("sitemap", "https://shop.test/s1.xml.gz", None)]
+
+
+def test_recovers_from_malformed_entries():
+    body = (
+        b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        b'<url><loc>https://shop.test/p/1?a=1&b=2</loc></url>'
+        b'<url><loc>https://shop.test/p/2</loc></url>'
+    )
+    locs = [entry.loc for entry in iter_sitemap(body)]
+    assert "https://shop.test/p/2" in locs
+
+
+def test_caps_decompressed_size():
+    body = gzip.compress(URLSET[:-len(b"</urlset>")] + b"<!-- " + b" " * 100_000 + b" -->" + b"</urlset>")
+    assert len(list(iter_sitemap(body, max_size=1_000_000))) == 2
+    with pytest.raises(SitemapTooLarge):
+        list(iter_sitemap(body, max_size=10_000))
+
+
+def test_truncated_gzip_raises():
+    body = gzip.compress(URLSET)[:40]
+    with pytest.raises((OSError, EOFError)):
+        list(iter_sitemap(body))
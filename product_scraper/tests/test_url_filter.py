@@ -0,0 +1,63 @@
+import pytest
+
+from product_scraper.url_filter import PatternSet, UrlFilter
+
+
+def test_substring_and_regex_rules():
+    url_filter = UrlFilter(["/blog/", "re:\\?page=\\d+$"], ["re:/p/\\d+"])
+
+    assert url_filter.rejection("https://shop.test/p/1") is None
+    assert url_filter.rejection("https://shop.test/blog/p/1") == "ignored//blog/"
+    assert url_filter.rejection("https://shop.test/p/1?page=2") == "ignored/re:\\?page=\\d+$"
+    assert url_filter.rejection("https://shop.test/about") == "not_included"
+
+
+def test_alternation_stays_inside_its_rule():
+    patterns = PatternSet(["re:^https://a|b$", "/c"])
+
+    assert patterns.regex is not None
+    assert patterns.match("https://x/c") == "/c"
+    assert patterns.match("https://x/b") == "re:^https://a|b$"
+
+
+@pytest.mark.parametrize("rules", [
+    ["/sale", "shop.test"],
+    ["re:(?i)/SALE", "shop.test"],
+])
+def test_reports_leftmost_matching_rule(rules):
+    patterns = PatternSet(rules)
+
+    # "/sale" is listed first, but "shop.test" matches further left
+    assert patterns.match("https://shop.test/sale") == "shop.test"
+    assert patterns.match("https://other.test/sale") == rules[0]
+
+
+def test_reports_first_rule_matching_at_the_same_position():
+    patterns = PatternSet(["/sale", "/s"])
+
+    assert patterns.match("https://x.test/sale") == "/sale"
+
+
+@pytest.mark.parametrize("rules", [
+    ["/blog", "re:(?i)/NEWS"],
+    ["re:/(a)\\1", "/blog"],
+    ["re:/(?P<x>a)x", "re:/(?P<x>b)x"],
+])
+def test_falls_back_to_one_search_per_rule(rules):
+    patterns = PatternSet(rules)
+
+    assert patterns.regex is None
+    assert patterns.match("https://shop.test/blog") == ("/blog" if "/blog" in rules else None)
+
+
+def test_fallback_keeps_rule_semantics():
+    patterns = PatternSet(["re:(?i)/NEWS", "re:/(a)\\1"])
+
+    assert patterns.match("https://shop.test/news") == "re:(?i)/NEWS"
+    assert patterns.match("https://shop.test/aa") == "re:/(a)\\1"
+    assert patterns.match("https://shop.test/ab") is None
+
+
+def test_invalid_rule_raises():
+    with pytest.raises(ValueError, match="Invalid URL pattern"):
+        PatternSet(["re:(unclosed"])